@@ -0,0 +1,80 @@
+"""
+Compare `combine_related_objects` with the `deepmerge` based merge it replaced.
+
+Simulates the merges done while serializing a list: every item contributes a
+`{model_key: {pk: dict}}` block whose objects are `--depth` levels deep, with
+`--overlap` of the pks shared with the previous items.
+
+    python -m benchmarks.bench_merge --items 2000 --models 4 --depth 4
+"""
+import argparse
+import copy
+import json
+import timeit
+
+from better_nested_serializer.helpers import combine_related_objects
+
+try:
+    from deepmerge import always_merger
+except ImportError:  # pragma: no cover
+    always_merger = None
+
+
+def make_object(pk, depth, width):
+    obj = {"id": pk, "name": f"object {pk}"}
+    node = obj
+    for level in range(depth):
+        node["child"] = {f"field_{index}": index for index in range(width)}
+        node = node["child"]
+    return obj
+
+
+def make_blocks(items, models, depth, width, overlap):
+    blocks = []
+    for item in range(items):
+        block = {}
+        for model in range(models):
+            # `overlap` of the pks are shared with the previous item
+            pks = {item, int(item * (1 - overlap)) + 1}
+            block[f"app_model_{model}"] = {
+                pk: make_object(pk, depth, width) for pk in pks
+            }
+        blocks.append(block)
+    return blocks
+
+
+def merge_all(merge, blocks):
+    related_objects = {}
+    for block in blocks:
+        related_objects = merge(related_objects, block)
+    return related_objects
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--models", type=int, default=4)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--width", type=int, default=5)
+    parser.add_argument("--overlap", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    blocks = make_blocks(args.items, args.models, args.depth, args.width, args.overlap)
+
+    mergers = {"combine_related_objects": combine_related_objects}
+    if always_merger is not None:
+        mergers["deepmerge"] = always_merger.merge
+
+    results = {}
+    for name, merge in mergers.items():
+        # Both merges mutate their target, so each run gets fresh blocks
+        runs = [copy.deepcopy(blocks) for _ in range(args.repeat)]
+        timer = timeit.Timer(lambda: merge_all(merge, runs.pop()))
+        results[name] = min(timer.repeat(repeat=args.repeat, number=1))
+
+    print(json.dumps({"parameters": vars(args), "seconds": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
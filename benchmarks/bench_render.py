@@ -0,0 +1,78 @@
+"""
+Compare `BetterJSONRenderer` with the DRF `JSONRenderer` on large payloads.
+
+Renders a synthetic `{"object": [...], "related_objects": {...}}` payload of
+`--items` primary objects referencing `--related` objects of each of
+`--models` related models, as returned by `BetterModelSerializer.data`.
+
+    python -m benchmarks.bench_render --items 10000 --related 2000 --models 3
+"""
+import argparse
+import json
+import timeit
+
+from benchmarks.django_setup import setup_django
+
+
+def make_payload(items, related, models):
+    from rest_framework.utils.serializer_helpers import ReturnDict
+
+    related_objects = {
+        f"app_model_{model}": {
+            pk: {
+                "id": pk,
+                "name": f"Related object {pk}",
+                "age": 20 + pk % 50,
+                "description": "Lorem ipsum dolor sit amet " * 3,
+            }
+            for pk in range(1, related + 1)
+        }
+        for model in range(models)
+    }
+    primary_objects = [
+        {
+            "id": pk,
+            "title": f"Primary object {pk} é",
+            "content": "Content " * 10,
+            **{f"model_{model}": pk % related + 1 for model in range(models)},
+        }
+        for pk in range(1, items + 1)
+    ]
+    return ReturnDict(
+        {"object": primary_objects, "related_objects": related_objects},
+        serializer=None,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--related", type=int, default=2000)
+    parser.add_argument("--models", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django(":memory:")
+
+    from rest_framework.renderers import JSONRenderer
+
+    from better_nested_serializer import renderers
+
+    payload = make_payload(args.items, args.related, args.models)
+
+    results = {}
+    for name, renderer in {
+        "JSONRenderer": JSONRenderer(),
+        f"BetterJSONRenderer ({renderers.BACKEND})": renderers.BetterJSONRenderer(),
+    }.items():
+        timer = timeit.Timer(lambda: renderer.render(payload))
+        results[name] = {
+            "seconds": min(timer.repeat(repeat=args.repeat, number=1)),
+            "bytes": len(renderer.render(payload)),
+        }
+
+    print(json.dumps({"parameters": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
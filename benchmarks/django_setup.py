@@ -0,0 +1,33 @@
+"""
+Standalone Django configuration for the benchmarks, using the `test_app` models.
+"""
+import django
+from django.conf import settings
+
+
+def setup_django(database_name=":memory:"):
+    """
+    Configure Django with a SQLite database (`":memory:"` or a file path) and
+    create the `test_app` tables.
+    """
+    if not settings.configured:
+        settings.configure(
+            DATABASES={
+                "default": {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": database_name,
+                }
+            },
+            INSTALLED_APPS=[
+                "django.contrib.contenttypes",
+                "django.contrib.auth",
+                "test_app",
+            ],
+            USE_TZ=True,
+            SECRET_KEY="benchmark-secret-key",
+        )
+        django.setup()
+
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
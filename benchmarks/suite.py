@@ -0,0 +1,355 @@
+"""
+Benchmark `BetterModelSerializer` against plain DRF nested serializers.
+
+Builds a synthetic dataset with the `test_app` models (Author, Publisher, Blog,
+Comment) in SQLite, then serializes it at several nesting depths with both
+serializer families. For each scenario it reports wall time, query count, peak
+memory (tracemalloc) and JSON payload size, and writes everything to a JSON
+file so that versions can be compared.
+
+    python -m benchmarks.suite --rows 2000 --fan-out 3 --duplication 0.9 \\
+        --database disk --output bench_results.json
+
+Depths:
+    1: Blog -> author, publisher
+    2: Author -> blogs -> publisher
+    3: Author -> blogs -> comments -> author
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from importlib import metadata
+
+from benchmarks.django_setup import setup_django
+
+DEPTHS = (1, 2, 3)
+
+
+def get_serializers():
+    """
+    `{depth: (plain DRF serializer, BetterModelSerializer, primary model)}`
+    """
+    from rest_framework import serializers
+
+    from better_nested_serializer.serializers.model_serializer import (
+        BetterModelSerializer,
+    )
+    from test_app.models import Author, Blog, Comment, Publisher
+
+    class PlainAuthorSerializer(serializers.ModelSerializer):
+        class Meta:
+            model = Author
+            fields = "__all__"
+
+    class PlainPublisherSerializer(serializers.ModelSerializer):
+        class Meta:
+            model = Publisher
+            fields = "__all__"
+
+    class PlainBlogSerializer(serializers.ModelSerializer):
+        author = PlainAuthorSerializer(read_only=True)
+        publisher = PlainPublisherSerializer(read_only=True)
+
+        class Meta:
+            model = Blog
+            fields = "__all__"
+
+    class PlainBlogWithPublisherSerializer(serializers.ModelSerializer):
+        publisher = PlainPublisherSerializer(read_only=True)
+
+        class Meta:
+            model = Blog
+            fields = "__all__"
+
+    class PlainAuthorWithBlogsSerializer(serializers.ModelSerializer):
+        blogs = PlainBlogWithPublisherSerializer(
+            many=True, read_only=True, source="blog_set"
+        )
+
+        class Meta:
+            model = Author
+            fields = "__all__"
+
+    class PlainCommentSerializer(serializers.ModelSerializer):
+        author = PlainAuthorSerializer(read_only=True)
+
+        class Meta:
+            model = Comment
+            fields = "__all__"
+
+    class PlainBlogWithCommentsSerializer(serializers.ModelSerializer):
+        comments = PlainCommentSerializer(many=True, read_only=True)
+
+        class Meta:
+            model = Blog
+            fields = "__all__"
+
+    class PlainAuthorWithBlogCommentsSerializer(serializers.ModelSerializer):
+        blogs = PlainBlogWithCommentsSerializer(
+            many=True, read_only=True, source="blog_set"
+        )
+
+        class Meta:
+            model = Author
+            fields = "__all__"
+
+    class BetterAuthorSerializer(BetterModelSerializer):
+        class Meta:
+            model = Author
+            fields = "__all__"
+
+    class BetterPublisherSerializer(BetterModelSerializer):
+        class Meta:
+            model = Publisher
+            fields = "__all__"
+
+    class BetterBlogSerializer(BetterModelSerializer):
+        author = BetterAuthorSerializer(read_only=True)
+        publisher = BetterPublisherSerializer(read_only=True)
+
+        class Meta:
+            model = Blog
+            fields = "__all__"
+
+    class BetterBlogWithPublisherSerializer(BetterModelSerializer):
+        publisher = BetterPublisherSerializer(read_only=True)
+
+        class Meta:
+            model = Blog
+            fields = "__all__"
+
+    class BetterAuthorWithBlogsSerializer(BetterModelSerializer):
+        blogs = BetterBlogWithPublisherSerializer(
+            many=True, read_only=True, source="blog_set"
+        )
+
+        class Meta:
+            model = Author
+            fields = "__all__"
+
+    class BetterCommentSerializer(BetterModelSerializer):
+        author = BetterAuthorSerializer(read_only=True)
+
+        class Meta:
+            model = Comment
+            fields = "__all__"
+
+    class BetterBlogWithCommentsSerializer(BetterModelSerializer):
+        comments = BetterCommentSerializer(many=True, read_only=True)
+
+        class Meta:
+            model = Blog
+            fields = "__all__"
+
+    class BetterAuthorWithBlogCommentsSerializer(BetterModelSerializer):
+        blogs = BetterBlogWithCommentsSerializer(
+            many=True, read_only=True, source="blog_set"
+        )
+
+        class Meta:
+            model = Author
+            fields = "__all__"
+
+    return {
+        1: (PlainBlogSerializer, BetterBlogSerializer, Blog),
+        2: (PlainAuthorWithBlogsSerializer, BetterAuthorWithBlogsSerializer, Author),
+        3: (
+            PlainAuthorWithBlogCommentsSerializer,
+            BetterAuthorWithBlogCommentsSerializer,
+            Author,
+        ),
+    }
+
+
+def create_dataset(rows, fan_out, duplication):
+    """
+    Create `rows` blogs with `fan_out` comments each. `duplication` is the
+    share of references that point to an already used author / publisher
+    (0: every blog and comment has its own author, 0.9: 10% distinct ones).
+    """
+    from test_app.models import Author, Blog, Comment, Publisher
+
+    distinct = max(1, round(rows * (1 - duplication)))
+
+    authors = Author.objects.bulk_create(
+        Author(name=f"Author {index}", age=20 + index % 50) for index in range(distinct)
+    )
+    publishers = Publisher.objects.bulk_create(
+        Publisher(name=f"Publisher {index}") for index in range(distinct)
+    )
+    blogs = Blog.objects.bulk_create(
+        Blog(
+            title=f"Blog {index}",
+            content="Lorem ipsum dolor sit amet. " * 4,
+            author=authors[index % distinct],
+            publisher=publishers[index % distinct],
+        )
+        for index in range(rows)
+    )
+    Comment.objects.bulk_create(
+        Comment(
+            blog=blog,
+            text=f"Comment {index}",
+            author=authors[(blog_index + index) % distinct],
+        )
+        for blog_index, blog in enumerate(blogs)
+        for index in range(fan_out)
+    )
+
+
+def measure(serializer_class, queryset, repeat):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.utils.encoders import JSONEncoder
+
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        data = serializer_class(queryset.all(), many=True).data
+        timings.append(time.perf_counter() - start)
+
+    with CaptureQueriesContext(connection) as queries:
+        serializer_class(queryset.all(), many=True).data
+    query_count = len(queries.captured_queries)
+
+    gc.collect()
+    tracemalloc.start()
+    data = serializer_class(queryset.all(), many=True).data
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    payload = json.dumps(data, cls=JSONEncoder)
+
+    return {
+        "wall_time_seconds": {
+            "min": min(timings),
+            "median": statistics.median(timings),
+        },
+        "queries": query_count,
+        "peak_memory_bytes": peak_memory,
+        "payload_bytes": len(payload.encode()),
+    }
+
+
+def run(args):
+    from test_app.models import Author, Blog, Comment, Publisher
+
+    for model_class in (Comment, Blog, Author, Publisher):
+        model_class.objects.all().delete()
+    create_dataset(args.rows, args.fan_out, args.duplication)
+
+    serializers_by_depth = get_serializers()
+    results = []
+
+    for depth in args.depths:
+        plain_serializer, better_serializer, model_class = serializers_by_depth[depth]
+
+        # Both serializer families get the same joins / prefetches, so that
+        # only the serialization itself is compared.
+        queryset = model_class.objects.order_by("pk")
+        if args.optimize:
+            queryset = better_serializer.optimize_queryset(queryset)
+
+        for name, serializer_class in (
+            ("drf", plain_serializer),
+            ("better", better_serializer),
+        ):
+            result = {
+                "serializer": name,
+                "depth": depth,
+                "primary_objects": queryset.count(),
+                **measure(serializer_class, queryset, args.repeat),
+            }
+            results.append(result)
+            print(
+                f"depth={depth} {name:>6}: "
+                f"{result['wall_time_seconds']['median'] * 1000:9.1f} ms, "
+                f"{result['queries']:4d} queries, "
+                f"{result['peak_memory_bytes'] / 1024:9.0f} KiB peak, "
+                f"{result['payload_bytes'] / 1024:9.0f} KiB payload"
+            )
+
+    return results
+
+
+def get_versions():
+    import django
+    import rest_framework
+
+    try:
+        package_version = metadata.version("better-nested-serializer")
+    except metadata.PackageNotFoundError:
+        package_version = None
+
+    return {
+        "better_nested_serializer": package_version,
+        "django": django.get_version(),
+        "djangorestframework": rest_framework.VERSION,
+        "python": platform.python_version(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1000, help="Number of blogs")
+    parser.add_argument(
+        "--fan-out", type=int, default=3, help="Comments per blog (reverse relation)"
+    )
+    parser.add_argument(
+        "--duplication",
+        type=float,
+        default=0.5,
+        help="Share of references to an already used related object, in [0, 1)",
+    )
+    parser.add_argument(
+        "--depths", type=int, nargs="+", default=list(DEPTHS), choices=DEPTHS
+    )
+    parser.add_argument("--database", choices=("memory", "disk"), default="memory")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--no-optimize",
+        dest="optimize",
+        action="store_false",
+        help="Do not add select_related / prefetch_related to the querysets",
+    )
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    if args.database == "disk":
+        database_file = tempfile.NamedTemporaryFile(suffix=".sqlite3", delete=False)
+        database_file.close()
+        database_name = database_file.name
+    else:
+        database_name = ":memory:"
+
+    try:
+        setup_django(database_name)
+        results = run(args)
+    finally:
+        if args.database == "disk":
+            os.unlink(database_name)
+
+    with open(args.output, "w") as fp:
+        json.dump(
+            {
+                "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "versions": get_versions(),
+                "parameters": vars(args),
+                "results": results,
+            },
+            fp,
+            indent=2,
+        )
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class BetterNestedSerializerConfig(AppConfig):
+    name = "better_nested_serializer"
+
+    def ready(self):
+        from better_nested_serializer.cache import connect_all_invalidation
+
+        connect_all_invalidation()
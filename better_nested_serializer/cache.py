@@ -0,0 +1,293 @@
+import hashlib
+import sys
+import uuid
+from typing import Any, Dict, Iterable, Optional, Tuple, Type
+
+from django.apps import apps
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Model
+from django.db.models.signals import post_delete, post_save
+
+from better_nested_serializer.conf import get_setting
+from better_nested_serializer.field_plan import FieldKind
+from better_nested_serializer.formats import OBJECTS
+from better_nested_serializer.helpers import get_model_key
+
+# Private local-memory caches, used when `RELATED_CACHE_ALIAS` is `None`, by
+# name and maximum number of entries
+_local_caches: Dict[Tuple[str, int], LocMemCache] = {}
+
+
+def _get_local_cache(name: str, max_entries: int) -> LocMemCache:
+    cache = _local_caches.get((name, max_entries))
+    if cache is None:
+        cache = _local_caches[(name, max_entries)] = LocMemCache(
+            f"better_nested_serializer:{name}",
+            {"OPTIONS": {"MAX_ENTRIES": max_entries}},
+        )
+    return cache
+
+
+def get_cache():
+    """
+    The cache of the serialized related objects: the `RELATED_CACHE_ALIAS`
+    cache, else a private local-memory cache of at most
+    `RELATED_CACHE_MAX_ENTRIES` objects.
+    """
+    alias = get_setting("RELATED_CACHE_ALIAS")
+    if alias is None:
+        return _get_local_cache("objects", get_setting("RELATED_CACHE_MAX_ENTRIES"))
+    return caches[alias]
+
+
+def get_token_cache():
+    """
+    The cache of the version tokens: the `RELATED_CACHE_ALIAS` cache, else a
+    private local-memory cache that is never culled, since losing a token
+    invalidates the cached objects of its instance. Tokens are small, one
+    per saved or versioned instance.
+    """
+    alias = get_setting("RELATED_CACHE_ALIAS")
+    if alias is None:
+        return _get_local_cache("tokens", sys.maxsize)
+    return caches[alias]
+
+
+def get_shared_cache():
+    """
+    The cache of the `RELATED_CACHE_ALIAS` setting, for version tokens that
+    every process must agree on. Raise `ImproperlyConfigured` when it is not
+    set, or is a local-memory (per process) or dummy cache.
+    """
+    alias = get_setting("RELATED_CACHE_ALIAS")
+    cache = None if alias is None else caches[alias]
+    if cache is None or isinstance(cache, (LocMemCache, DummyCache)):
+        raise ImproperlyConfigured(
+            "Version tokens need a cache shared by every process: set "
+            "BETTER_NESTED_SERIALIZER['RELATED_CACHE_ALIAS'] to one (not a "
+            "local-memory or dummy cache), or give the serializers a "
+            "`Meta.related_cache_version_field`."
+        )
+    return cache
+
+
+def _get_version_key(model_key: str, pk) -> str:
+    return f"better_nested_serializer:version:{model_key}:{pk}"
+
+
+def _bump_version(sender, instance, **kwargs):
+    get_token_cache().set(
+        _get_version_key(get_model_key(sender), instance.pk),
+        uuid.uuid4().hex,
+        timeout=None,
+    )
+
+
+def get_version_tokens(model_key: str, pks: Iterable[Any]) -> Dict[Any, str]:
+    """
+    The version tokens of `pks` of `model_key` (see `connect_invalidation`).
+    """
+    cache = get_token_cache()
+    keys = {_get_version_key(model_key, pk): pk for pk in pks}
+    versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+
+    # An unknown (or evicted) version gets a fresh token, so that a stale
+    # entry can never be matched again.
+    new_versions = {
+        key: uuid.uuid4().hex for key, pk in keys.items() if pk not in versions
+    }
+    if new_versions:
+        cache.set_many(new_versions, timeout=None)
+        versions.update((keys[key], version) for key, version in new_versions.items())
+
+    return versions
+
+
+def read_version_field(
+    model_class: Type[Model], version_field: str, items: Iterable[Tuple[Any, Any]]
+) -> Dict[Any, str]:
+    """
+    The `version_field` values of `items`, `(pk, instance or None)` pairs: of
+    the loaded instances as they are, of the others with a single
+    `values_list` query. Dangling pks have no version.
+    """
+    versions = {}
+    pending_pks = []
+    for pk, instance in items:
+        if instance is None:
+            pending_pks.append(pk)
+        else:
+            versions[pk] = str(getattr(instance, version_field))
+
+    if pending_pks:
+        versions.update(
+            (pk, str(version))
+            for pk, version in model_class._base_manager.filter(
+                pk__in=pending_pks
+            ).values_list("pk", version_field)
+        )
+    return versions
+
+
+def get_object_versions(
+    serializer, model_class: Type[Model], items, related_object_cache=None
+) -> Optional[Dict[Any, str]]:
+    """
+    The versions of `items` (see `RelatedObjectCache.get_versions`) of the
+    related serializer `serializer`: read from its
+    `Meta.related_cache_version_field`, or its cache tokens. `None` when it
+    has neither.
+    """
+    if related_object_cache is not None:
+        return related_object_cache.get_versions(items)
+    version_field = getattr(
+        getattr(serializer, "Meta", None), "related_cache_version_field", None
+    )
+    if version_field is None:
+        return None
+    return read_version_field(model_class, version_field, items)
+
+
+def connect_invalidation(model_class: Type[Model]):
+    """
+    Give every saved or deleted instance of `model_class` a new version, so
+    that its cached representations are not used anymore.
+
+    With `better_nested_serializer` in `INSTALLED_APPS` every model already
+    is (see `connect_all_invalidation`): nothing is connected.
+    """
+    if apps.is_installed("better_nested_serializer"):
+        return
+    dispatch_uid = f"better_nested_serializer:{get_model_key(model_class)}"
+    post_save.connect(
+        _bump_version, sender=model_class, weak=False, dispatch_uid=dispatch_uid
+    )
+    post_delete.connect(
+        _bump_version, sender=model_class, weak=False, dispatch_uid=dispatch_uid
+    )
+
+
+def connect_all_invalidation():
+    """
+    Give every saved or deleted instance, of any model, a new version token.
+    Connected at startup by the app config, so that every process (web
+    workers that did not serialize yet, task workers, management commands,
+    admin...) invalidates the tokens of a shared cache.
+    """
+    post_save.connect(
+        _bump_version, weak=False, dispatch_uid="better_nested_serializer"
+    )
+    post_delete.connect(
+        _bump_version, weak=False, dispatch_uid="better_nested_serializer"
+    )
+
+
+def require_invalidation():
+    """
+    Raise `ImproperlyConfigured` when version tokens are kept in a shared
+    cache (`RELATED_CACHE_ALIAS`) but invalidated lazily, by the processes
+    that serialized only: `better_nested_serializer` must be in
+    `INSTALLED_APPS`.
+    """
+    if get_setting("RELATED_CACHE_ALIAS") is not None and not apps.is_installed(
+        "better_nested_serializer"
+    ):
+        raise ImproperlyConfigured(
+            "Version tokens in a shared cache are only invalidated by every "
+            "process when 'better_nested_serializer' is in INSTALLED_APPS."
+        )
+
+
+class RelatedObjectCache:
+    """
+    Cache of the representations produced by `serializer` (the child of a
+    `many=True` serializer), shared across requests.
+
+    Entries are keyed by serializer class, field set, context fingerprint,
+    format (`objects` or `columnar` rows), model, pk and version. The version is read from the field named by
+    `Meta.related_cache_version_field` (e.g. `updated_at`) when set;
+    otherwise it is a token stored in the cache and replaced on every
+    `post_save` / `post_delete` of the instance.
+    """
+
+    def __init__(
+        self, serializer, model_class: Type[Model], related_format=OBJECTS
+    ):
+        meta = serializer.Meta
+        self.cache = get_cache()
+        self.timeout = get_setting("RELATED_CACHE_TIMEOUT")
+        self.model_class = model_class
+        self.model_key = get_model_key(model_class)
+        self.version_field = getattr(meta, "related_cache_version_field", None)
+
+        context_fingerprint = tuple(
+            (key, repr(serializer.context.get(key)))
+            for key in getattr(meta, "related_cache_context_keys", ())
+        )
+        fingerprint = repr(
+            (
+                f"{serializer.__class__.__module__}.{serializer.__class__.__qualname__}",
+                tuple(field.field_name for field in serializer._readable_fields),
+                context_fingerprint,
+                related_format,
+            )
+        )
+        self.key_prefix = (
+            "better_nested_serializer:object:"
+            f"{hashlib.sha1(fingerprint.encode()).hexdigest()}:{self.model_key}"
+        )
+
+        if self.version_field is None:
+            require_invalidation()
+            connect_invalidation(model_class)
+
+    def get_versions(self, items: Iterable[Tuple[Any, Any]]) -> Dict[Any, str]:
+        """
+        The versions of `items`, `(pk, instance or None)` pairs (see
+        `NestedDataHelper.get_model_items`). No instance is loaded.
+        """
+        if self.version_field is not None:
+            return read_version_field(self.model_class, self.version_field, items)
+        return get_version_tokens(self.model_key, [pk for pk, _ in items])
+
+    def _get_key(self, pk, version) -> str:
+        return f"{self.key_prefix}:{pk}:{version}"
+
+    def get_many(self, versions: Dict[Any, str]) -> Dict[Any, dict]:
+        keys = {self._get_key(pk, version): pk for pk, version in versions.items()}
+        return {keys[key]: data for key, data in self.cache.get_many(keys).items()}
+
+    def set_many(self, versions: Dict[Any, str], data: Dict[Any, dict]):
+        self.cache.set_many(
+            {
+                self._get_key(pk, versions[pk]): obj
+                for pk, obj in data.items()
+                if pk in versions
+            },
+            timeout=self.timeout,
+        )
+
+
+def get_related_object_cache(serializer, model_class, related_format=OBJECTS):
+    """
+    Return the `RelatedObjectCache` of `serializer`, or `None` when its class
+    does not opt in with `Meta.related_cache = True`.
+
+    Serializers that collect related objects of their own (a
+    `BetterModelSerializer` with nested fields) are never cached, since their
+    `related_objects` would have to be rebuilt anyway.
+    """
+    if not getattr(getattr(serializer, "Meta", None), "related_cache", False):
+        return None
+
+    get_compiled_fields = getattr(serializer, "_get_compiled_fields", None)
+    if get_compiled_fields is not None and any(
+        field_plan.kind is not FieldKind.PRIMITIVE
+        for _, field_plan in get_compiled_fields()
+    ):
+        return None
+
+    return RelatedObjectCache(serializer, model_class, related_format)
@@ -0,0 +1,46 @@
+from django.conf import settings
+
+DEFAULTS = {
+    # Alias (in `CACHES`) of the cache holding serialized related objects.
+    # `None` uses a local-memory cache private to this package.
+    "RELATED_CACHE_ALIAS": None,
+    # Seconds a serialized related object is kept in the cache
+    "RELATED_CACHE_TIMEOUT": 300,
+    # Serialized related objects kept by the local-memory cache (when
+    # `RELATED_CACHE_ALIAS` is `None`), per process
+    "RELATED_CACHE_MAX_ENTRIES": 10000,
+    # Maximum threads used to serialize related models with `parallel_related`
+    "PARALLEL_RELATED_WORKERS": 4,
+    # Dotted path of the `SerializationObserver` class receiving phase events
+    "OBSERVER": None,
+    # Query parameters selecting the fields of the primary objects and of
+    # the related objects (`?fields=id,title&related=app_model(name)`)
+    "FIELDS_PARAM": "fields",
+    "RELATED_FIELDS_PARAM": "related",
+    # Query parameter selecting the format of `related_objects`
+    # (`objects` or `columnar`)
+    "RELATED_FORMAT_PARAM": "related_format",
+    # Request header listing the related objects (and their version tags)
+    # the client already has, left out of the response (see `KnownObjects`)
+    "KNOWN_OBJECTS_HEADER": "X-Known-Related-Objects",
+    # Related objects whose pks `BetterCursorPagination` carries in its
+    # cursors at most, and characters they take in the cursor at most;
+    # beyond either the set starts over
+    "CURSOR_MAX_SENT_OBJECTS": 2000,
+    "CURSOR_MAX_SENT_SIZE": 2048,
+    # Serialize simple related serializers from `values_list` rows
+    "VALUES_FAST_PATH": True,
+    # Limits of the related objects of a serialization (see `RelatedLimits`),
+    # `None` for no limit
+    "MAX_RELATED_DEPTH": None,
+    "MAX_RELATED_OBJECTS_PER_MODEL": None,
+    "MAX_RELATED_OBJECTS": None,
+}
+
+
+def get_setting(name):
+    """
+    Read `name` from the `BETTER_NESTED_SERIALIZER` dict of the Django
+    settings, falling back to `DEFAULTS`.
+    """
+    return getattr(settings, "BETTER_NESTED_SERIALIZER", {}).get(name, DEFAULTS[name])
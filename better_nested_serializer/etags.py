@@ -0,0 +1,276 @@
+import hashlib
+from typing import Any, Dict
+
+from django.utils.http import parse_etags
+from rest_framework import serializers, status
+from rest_framework.response import Response
+
+from better_nested_serializer.cache import (
+    connect_invalidation,
+    get_shared_cache,
+    get_version_tokens,
+    read_version_field,
+    require_invalidation,
+)
+from better_nested_serializer.field_plan import FieldKind
+from better_nested_serializer.fieldsets import get_field_selection, select_fields
+from better_nested_serializer.formats import get_related_format
+from better_nested_serializer.helpers import NestedDataHelper, get_model_key
+from better_nested_serializer.known_objects import get_known_objects
+from better_nested_serializer.limits import get_related_limits
+from better_nested_serializer.serializers.model_serializer import BetterModelSerializer
+
+
+def get_versions(serializer, model_class, items) -> Dict[Any, str]:
+    """
+    The versions of `items`, `(pk, instance or None)` pairs of objects
+    serialized by `serializer`: its `Meta.related_cache_version_field`
+    column, else the tokens replaced on every `post_save` / `post_delete`
+    (see `connect_invalidation`).
+
+    Tokens are only consistent across processes, and only kept, in a shared
+    cache: without a version field, the `RELATED_CACHE_ALIAS` setting must
+    name one (see `get_shared_cache`), and `better_nested_serializer` must be
+    installed so that every process replaces them (see `require_invalidation`).
+    """
+    version_field = getattr(
+        getattr(serializer, "Meta", None), "related_cache_version_field", None
+    )
+    if version_field is not None:
+        return read_version_field(model_class, version_field, items)
+
+    get_shared_cache()
+    require_invalidation()
+    connect_invalidation(model_class)
+    return get_version_tokens(get_model_key(model_class), [pk for pk, _ in items])
+
+
+def _has_nested_fields(serializer) -> bool:
+    return isinstance(serializer, BetterModelSerializer) and any(
+        field_plan.kind is not FieldKind.PRIMITIVE
+        for _, field_plan in serializer._get_compiled_fields()
+    )
+
+
+class _GraphFingerprint:
+    """
+    Hash of the `(model_key, pk, version)` of the objects of a
+    serialization, and of the relations between them.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.selection = get_field_selection(context)
+        self.limits = get_related_limits(context)
+        self.hash = hashlib.blake2b(digest_size=16)
+        self.versions: Dict[str, Dict[Any, str]] = {}
+        # Pks whose relations were collected, by (model, serializer class)
+        self.visited: Dict[tuple, set] = {}
+
+    def update(self, value):
+        self.hash.update(repr(value).encode())
+        self.hash.update(b"\n")
+
+    def add_objects(self, serializer, instances, nesting_level):
+        """
+        Add `instances`, serialized by `serializer`, their relations and,
+        recursively, their related objects.
+        """
+        model_class = serializer.Meta.model
+        versions = get_versions(
+            serializer, model_class, [(instance.pk, instance) for instance in instances]
+        )
+        self.versions.setdefault(get_model_key(model_class), {}).update(versions)
+
+        if not _has_nested_fields(serializer):
+            return
+
+        nested_helper = NestedDataHelper()
+        relations = serializer.collect_related(instances, nested_helper)
+        self.update(
+            [
+                (get_model_key(model_class), instance.pk, instance_relations)
+                for instance, instance_relations in zip(instances, relations)
+            ]
+        )
+        self.add_related(serializer, nested_helper, nesting_level + 1)
+
+    def add_related(self, serializer, nested_helper, nesting_level):
+        # Beyond the depth limit, related objects are only sent as pks,
+        # which the relations of their parents already cover
+        if self.limits.is_too_deep(nesting_level):
+            return
+
+        for _, field_info in nested_helper.items():
+            model_class = field_info.model_class
+            model_key = get_model_key(model_class)
+            related_serializer = field_info.serializer_class(
+                many=True, context=self.context, **field_info.kwargs
+            ).child
+            if self.selection is not None:
+                select_fields(
+                    related_serializer, self.selection.get_related_fields(model_key)
+                )
+
+            visited = self.visited.setdefault(
+                (model_class, field_info.serializer_class), set()
+            )
+            items = nested_helper.get_model_items(model_class, exclude_pks=visited)
+            if not items:
+                continue
+
+            # Related objects with nested fields of their own are loaded to
+            # collect their relations; the others are only versioned
+            if _has_nested_fields(related_serializer):
+                instances = nested_helper.get_model_instances(
+                    model_class, exclude_pks=visited
+                )
+                visited.update(pk for pk, _ in items)
+                self.add_objects(related_serializer, instances, nesting_level)
+            else:
+                visited.update(pk for pk, _ in items)
+                self.versions.setdefault(model_key, {}).update(
+                    get_versions(related_serializer, model_class, items)
+                )
+
+    def hexdigest(self) -> str:
+        for model_key in sorted(self.versions):
+            self.update(
+                (
+                    model_key,
+                    sorted(
+                        self.versions[model_key].items(),
+                        key=lambda item: str(item[0]),
+                    ),
+                )
+            )
+        return self.hash.hexdigest()
+
+
+def get_graph_fingerprint(serializer, extra=None) -> str:
+    """
+    A fingerprint of what `serializer` (a `BetterModelSerializer`, with or
+    without `many=True`) would output, computed from the relation-collection
+    phase only: the pk, version and relations of the primary objects, and
+    the pk and version of every related object. No related object is
+    serialized and only the related objects with nested fields of their own
+    are loaded.
+
+    Versions are read from `Meta.related_cache_version_field` (e.g.
+    `updated_at`) of each serializer, or are the tokens replaced on every
+    `post_save` / `post_delete` of the instance, which need a shared
+    `RELATED_CACHE_ALIAS` (see `get_versions`). `extra` (e.g. pagination
+    links) is part of the fingerprint.
+
+    A queryset given to a `many=True` serializer is evaluated and replaced
+    by the list of its instances, so that serializing afterwards does not
+    query it again.
+    """
+    many = isinstance(serializer, serializers.ListSerializer)
+    child = serializer.child if many else serializer
+
+    if many:
+        serializer.instance = list(serializer.get_iterable(serializer.instance))
+        instances = serializer.instance
+    else:
+        instances = [serializer.instance]
+    if isinstance(child, BetterModelSerializer):
+        # Fields must be selected before the compiled fields are cached
+        child.select_primary_fields()
+        related_format = get_related_format(child)
+    else:
+        related_format = None
+
+    fingerprint = _GraphFingerprint(serializer.context)
+    known_objects = get_known_objects(serializer.context)
+    fingerprint.update(
+        (
+            f"{child.__class__.__module__}.{child.__class__.__qualname__}",
+            fingerprint.selection,
+            related_format,
+            getattr(known_objects, "known", None),
+            extra,
+        )
+    )
+    fingerprint.update(
+        [instance.pk for instance in instances if instance is not None]
+    )
+    fingerprint.add_objects(
+        child, [instance for instance in instances if instance is not None], 0
+    )
+    return fingerprint.hexdigest()
+
+
+def get_graph_etag(serializer, extra=None) -> str:
+    """
+    The weak `ETag` header value of `get_graph_fingerprint`.
+    """
+    return f'W/"{get_graph_fingerprint(serializer, extra)}"'
+
+
+def etag_matches(request, etag: str) -> bool:
+    """
+    Whether the `If-None-Match` header of `request` matches `etag` (weak
+    comparison).
+    """
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return "*" in etags or etag.removeprefix("W/") in (
+        candidate.removeprefix("W/") for candidate in etags
+    )
+
+
+class GraphETagMixin:
+    """
+    `list` and `retrieve` for DRF generic views of `BetterModelSerializer`s,
+    answering `304 Not Modified` when the `If-None-Match` header of the
+    request matches the graph fingerprint (see `get_graph_fingerprint`),
+    before any related object is serialized or anything rendered.
+
+    Responses carry the `ETag` header. Put it before the generic view in the
+    bases: `class BlogViewSet(GraphETagMixin, viewsets.ReadOnlyModelViewSet)`.
+    """
+
+    def get_graph_etag(self, serializer, extra=None) -> str:
+        renderer = getattr(self.request, "accepted_renderer", None)
+        return get_graph_etag(serializer, (getattr(renderer, "format", None), extra))
+
+    def get_not_modified_response(self, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            # The count and links of the page are part of the response
+            etag = self.get_graph_etag(
+                serializer, dict(self.paginator.get_paginated_response(None).data)
+            )
+        else:
+            serializer = self.get_serializer(queryset, many=True)
+            etag = self.get_graph_etag(serializer)
+
+        if etag_matches(request, etag):
+            return self.get_not_modified_response(etag)
+
+        if page is not None:
+            response = self.get_paginated_response(serializer.data)
+        else:
+            response = Response(serializer.data)
+        response["ETag"] = etag
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.get_object())
+        etag = self.get_graph_etag(serializer)
+
+        if etag_matches(request, etag):
+            return self.get_not_modified_response(etag)
+
+        response = Response(serializer.data)
+        response["ETag"] = etag
+        return response
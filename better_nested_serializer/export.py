@@ -0,0 +1,214 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.db import connections
+from rest_framework.utils.encoders import JSONEncoder
+
+from better_nested_serializer.formats import COLUMNAR, OBJECTS, combine_columnar
+from better_nested_serializer.helpers import combine_related_objects, get_unsent_refs
+
+EXPORT_FORMATS = ("json", "jsonl")
+
+
+def get_pk_ranges(queryset, chunk_size):
+    """
+    Split `queryset` into `(first_pk, next_first_pk)` ranges of `chunk_size`
+    rows (the last range is open: `next_first_pk` is `None`).
+
+    Only the pks are read, ordered, in chunks of `chunk_size`.
+    """
+    boundaries = []
+    pks = queryset.order_by("pk").values_list("pk", flat=True)
+    for index, pk in enumerate(pks.iterator(chunk_size=chunk_size)):
+        if index % chunk_size == 0:
+            boundaries.append(pk)
+    return list(zip(boundaries, boundaries[1:] + [None]))
+
+
+def _initialize_worker(settings_module):
+    # Forked workers inherit the configured Django, spawned ones must set it
+    # up from the settings module of the parent.
+    if not settings.configured and settings_module:
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    django.setup()
+
+
+def _get_queryset_state(queryset):
+    """
+    What `_rebuild_queryset` needs to rebuild `queryset` in a worker.
+    Pickling the queryset itself would evaluate it (`QuerySet.__getstate__`
+    fetches its rows), its `Query` is pickled as it is.
+    """
+    return (
+        queryset.__class__,
+        queryset.model,
+        queryset.query,
+        queryset.db,
+        queryset._prefetch_related_lookups,
+    )
+
+
+def _rebuild_queryset(queryset_state):
+    queryset_class, model, query, using, prefetch_related_lookups = queryset_state
+    queryset = queryset_class(model=model, query=query, using=using)
+    if prefetch_related_lookups:
+        queryset = queryset.prefetch_related(*prefetch_related_lookups)
+    return queryset
+
+
+def _serialize_range(serializer_class, queryset_state, pk_range, context):
+    first_pk, next_first_pk = pk_range
+    queryset = (
+        _rebuild_queryset(queryset_state).filter(pk__gte=first_pk).order_by("pk")
+    )
+    if next_first_pk is not None:
+        queryset = queryset.filter(pk__lt=next_first_pk)
+
+    serializer = serializer_class(queryset, many=True, context=context)
+    return serializer.to_representation(queryset)
+
+
+def _serialize_range_in_worker(*args):
+    try:
+        return _serialize_range(*args)
+    finally:
+        connections.close_all()
+
+
+def _map_ranges(serializer_class, queryset, pk_ranges, context, workers):
+    arguments = (
+        [serializer_class] * len(pk_ranges),
+        [_get_queryset_state(queryset)] * len(pk_ranges),
+        pk_ranges,
+        [context] * len(pk_ranges),
+    )
+
+    if workers <= 1:
+        yield from map(_serialize_range, *arguments)
+        return
+
+    # Connections must not be shared with forked workers
+    connections.close_all()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_initialize_worker,
+        initargs=(os.environ.get("DJANGO_SETTINGS_MODULE"),),
+    ) as executor:
+        yield from executor.map(_serialize_range_in_worker, *arguments)
+
+
+def export_queryset(
+    serializer_class,
+    queryset,
+    workers=1,
+    chunk_size=5000,
+    context=None,
+    fp=None,
+    export_format="json",
+    related_format=OBJECTS,
+):
+    """
+    Serialize `queryset` with `serializer_class` (a `BetterModelSerializer`)
+    in `workers` processes, `chunk_size` rows per task.
+
+    The queryset is split by pk ranges and every range is serialized with
+    `many=True` by a worker process, which rebuilds the queryset from its
+    `Query`: the parent only reads the pks. `context` must be picklable. The
+    parent keeps the primary objects in pk order and merges the related
+    objects of all ranges by pk.
+
+    Without `fp` the normalized `{"object": [...], "related_objects": {...}}`
+    dict is returned. Otherwise it is written to the text file `fp` and the
+    number of primary objects is returned:
+
+    - `export_format="json"`: a single normalized JSON document, the primary
+      objects being written as their range is done;
+    - `export_format="jsonl"`: JSON Lines, one
+      `{"object": {...}}` line per primary object, then one
+      `{"model": "<model_key>", "related_object": {...}}` line per related
+      object, and one `{"model": "<model_key>", "related_refs": [...]}` line
+      per model with references left out by the `RelatedLimits`.
+
+    With `related_format="columnar"` the related objects are columnar tables
+    (see `formats`); in JSON Lines, one
+    `{"model": "<model_key>", "related_objects": {...}}` line per model.
+
+    Worker processes are forked when the platform allows it; with the spawn
+    start method they set Django up from `DJANGO_SETTINGS_MODULE`.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"export_format must be one of {EXPORT_FORMATS}, got {export_format!r}"
+        )
+
+    columnar = related_format == COLUMNAR
+    pk_ranges = get_pk_ranges(queryset, chunk_size)
+    results = _map_ranges(
+        serializer_class,
+        queryset,
+        pk_ranges,
+        {**(context or {}), "related_format": related_format},
+        workers,
+    )
+
+    related_objects = {}
+    related_refs = {}
+
+    def combine(result):
+        if columnar:
+            combine_columnar(related_objects, result["related_objects"])
+        else:
+            combine_related_objects(related_objects, result["related_objects"])
+        for model_key, pks in result.get("related_refs", {}).items():
+            related_refs.setdefault(model_key, {}).update(dict.fromkeys(pks))
+
+    if fp is None:
+        primary_objects = []
+        for result in results:
+            primary_objects.extend(result["object"])
+            combine(result)
+        payload = {"object": primary_objects, "related_objects": related_objects}
+        related_refs = get_unsent_refs(related_refs, related_objects, columnar)
+        if related_refs:
+            payload["related_refs"] = related_refs
+        return payload
+
+    encoder = JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    count = 0
+
+    if export_format == "json":
+        fp.write('{"object":[')
+    for result in results:
+        for primary_object in result["object"]:
+            if export_format == "jsonl":
+                fp.write(encoder.encode({"object": primary_object}) + "\n")
+            else:
+                fp.write(("," if count else "") + encoder.encode(primary_object))
+            count += 1
+        combine(result)
+    related_refs = get_unsent_refs(related_refs, related_objects, columnar)
+
+    if export_format == "json":
+        fp.write('],"related_objects":' + encoder.encode(related_objects))
+        if related_refs:
+            fp.write(',"related_refs":' + encoder.encode(related_refs))
+        fp.write("}")
+        return count
+
+    for model_key, objects in related_objects.items():
+        if columnar:
+            fp.write(
+                encoder.encode({"model": model_key, "related_objects": objects}) + "\n"
+            )
+            continue
+        for related_object in objects.values():
+            fp.write(
+                encoder.encode({"model": model_key, "related_object": related_object})
+                + "\n"
+            )
+    for model_key, pks in related_refs.items():
+        fp.write(encoder.encode({"model": model_key, "related_refs": pks}) + "\n")
+
+    return count
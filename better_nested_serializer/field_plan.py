@@ -0,0 +1,111 @@
+import dataclasses
+import enum
+from typing import Callable, Dict, Optional, Tuple, Type
+
+from django.db.models import Field, Model
+from rest_framework import serializers
+from rest_framework.serializers import ListSerializer
+
+from better_nested_serializer.helpers import NestedData, get_model_key
+from better_nested_serializer.query_plan import get_relation
+
+
+class FieldKind(enum.Enum):
+    PRIMITIVE = "primitive"
+    NESTED = "nested"
+    NESTED_MANY = "nested_many"
+
+
+# pk extractors, both called with the list of instances of a nested field
+
+
+def _get_pk(instances):
+    return instances[0].pk
+
+
+def _get_pks(instances):
+    return [instance.pk for instance in instances]
+
+
+@dataclasses.dataclass(frozen=True)
+class FieldPlan:
+    field_name: str
+    kind: FieldKind
+    # Only set for nested fields
+    nested_data: Optional[NestedData] = None
+    model_key: Optional[str] = None
+    get_pk: Optional[Callable] = None
+    # Set for nested fields backed by a forward foreign key (or one-to-one)
+    # to the primary key of the nested model: the pk is read from
+    # `instance.<attname>` without loading the related instance.
+    foreign_key: Optional[Field] = None
+
+
+@dataclasses.dataclass(frozen=True)
+class RepresentationPlan:
+    fields: Tuple[FieldPlan, ...]
+
+
+# By serializer class, field name and field type: bounded by the declared
+# fields, whichever subsets of them clients select
+_field_plans: Dict[tuple, FieldPlan] = {}
+
+
+def _get_foreign_key(model_class: Type[Model], field, nested_model_class):
+    if len(field.source_attrs) != 1:
+        return None
+    relation = get_relation(model_class, field.source)
+    if (
+        relation is None
+        or not relation.concrete
+        or not (relation.many_to_one or relation.one_to_one)
+        or not relation.target_field.primary_key
+        or not issubclass(nested_model_class, relation.related_model)
+    ):
+        return None
+    return relation
+
+
+def _compile_field(model_class: Type[Model], field) -> FieldPlan:
+    if isinstance(field, serializers.ModelSerializer):
+        kind, nested_serializer, get_pk = FieldKind.NESTED, field, _get_pk
+    elif isinstance(field, ListSerializer) and isinstance(
+        field.child, serializers.ModelSerializer
+    ):
+        kind, nested_serializer, get_pk = FieldKind.NESTED_MANY, field.child, _get_pks
+    else:
+        return FieldPlan(field.field_name, FieldKind.PRIMITIVE)
+
+    nested_model_class: Type[Model] = nested_serializer.Meta.model
+    return FieldPlan(
+        field_name=field.field_name,
+        kind=kind,
+        nested_data=NestedData(nested_model_class, nested_serializer.__class__, {}),
+        model_key=get_model_key(nested_model_class),
+        get_pk=get_pk,
+        foreign_key=(
+            _get_foreign_key(model_class, field, nested_model_class)
+            if kind is FieldKind.NESTED
+            else None
+        ),
+    )
+
+
+def get_representation_plan(serializer, fields) -> RepresentationPlan:
+    """
+    Return the `RepresentationPlan` of `serializer` for the given readable
+    `fields`.
+
+    Field plans only depend on the serializer class and on the name and type
+    of the field, so they are compiled once and shared by every instance (and
+    thread) of the class, whichever fields are selected.
+    """
+    model_class = serializer.Meta.model
+    field_plans = []
+    for field in fields:
+        key = (serializer.__class__, field.field_name, field.__class__)
+        field_plan = _field_plans.get(key)
+        if field_plan is None:
+            field_plan = _field_plans[key] = _compile_field(model_class, field)
+        field_plans.append(field_plan)
+    return RepresentationPlan(tuple(field_plans))
@@ -0,0 +1,116 @@
+import dataclasses
+import re
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from rest_framework.exceptions import ValidationError
+
+from better_nested_serializer.conf import get_setting
+
+# Always kept: related objects are keyed by it
+PK_FIELD_NAME = "id"
+
+_RELATED_ENTRY = r"\s*(\w+)\s*\(([\w\s,]*)\)\s*"
+_RELATED_PATTERN = re.compile(rf"{_RELATED_ENTRY}(?:,{_RELATED_ENTRY})*")
+
+
+def _parse_field_names(value: str) -> FrozenSet[str]:
+    return frozenset(name.strip() for name in value.split(",") if name.strip())
+
+
+@dataclasses.dataclass(frozen=True)
+class FieldSelection:
+    """
+    The fields requested for the primary objects (`fields`, `None` for
+    all) and for the related objects of given model keys (`related`).
+    """
+
+    fields: Optional[FrozenSet[str]] = None
+    related: Tuple[Tuple[str, FrozenSet[str]], ...] = ()
+
+    @classmethod
+    def parse(cls, fields: Optional[str] = None, related: Optional[str] = None):
+        """
+        Build a selection from the query parameter syntax:
+        `fields="id,title"` and `related="test_app_author(name),test_app_publisher()"`.
+        """
+        related_fields: Dict[str, FrozenSet[str]] = {}
+        if related:
+            if _RELATED_PATTERN.fullmatch(related) is None:
+                raise ValidationError(
+                    {
+                        get_setting("RELATED_FIELDS_PARAM"): (
+                            "Expected a comma separated list of "
+                            "`<model_key>(<field>,...)` entries."
+                        )
+                    }
+                )
+            for model_key, field_names in re.findall(_RELATED_ENTRY, related):
+                related_fields[model_key] = _parse_field_names(field_names)
+
+        return cls(
+            fields=_parse_field_names(fields) if fields else None,
+            related=tuple(sorted(related_fields.items())),
+        )
+
+    def restrict(
+        self, fields: FrozenSet[str], related: Dict[str, FrozenSet[str]]
+    ) -> "FieldSelection":
+        """
+        This selection, with the primary field names limited to `fields` and
+        the related ones to the model keys and field names of `related`
+        (`{model_key: field names}`), e.g. to drop names that do not exist.
+        """
+        return FieldSelection(
+            fields=None if self.fields is None else self.fields & fields,
+            related=tuple(
+                (model_key, field_names & related[model_key])
+                for model_key, field_names in self.related
+                if model_key in related
+            ),
+        )
+
+    def get_related_fields(self, model_key: str) -> Optional[FrozenSet[str]]:
+        for related_model_key, field_names in self.related:
+            if related_model_key == model_key:
+                return field_names
+        return None
+
+
+def is_selected(field_name: str, field_names: Optional[FrozenSet[str]]) -> bool:
+    return field_names is None or field_name in field_names or field_name == PK_FIELD_NAME
+
+
+def get_field_selection(context) -> Optional[FieldSelection]:
+    """
+    The `FieldSelection` of a serialization: the `field_selection` context
+    key, or else the query parameters of the `request` of the context.
+    """
+    selection = context.get("field_selection")
+    if selection is not None:
+        return selection
+
+    query_params = getattr(context.get("request"), "query_params", None)
+    if query_params is None:
+        return None
+    fields = query_params.get(get_setting("FIELDS_PARAM"))
+    related = query_params.get(get_setting("RELATED_FIELDS_PARAM"))
+    if not fields and not related:
+        return None
+
+    # Parsed once, every level of the serializer tree shares the context
+    selection = FieldSelection.parse(fields, related)
+    context["field_selection"] = selection
+    return selection
+
+
+def select_fields(serializer, field_names: Optional[FrozenSet[str]]):
+    """
+    Remove the fields of `serializer` that are not in `field_names`, before
+    anything is serialized: the removed fields are neither read, nor
+    collected, nor queried.
+    """
+    if field_names is None:
+        return
+    for field_name in list(serializer.fields):
+        if not is_selected(field_name, field_names):
+            del serializer.fields[field_name]
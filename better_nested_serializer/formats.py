@@ -0,0 +1,180 @@
+from typing import Any, Dict, Iterable, List, Sequence
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+
+from better_nested_serializer.conf import get_setting
+from better_nested_serializer.fieldsets import PK_FIELD_NAME
+
+# `related_objects[model_key]` is `{pk: {...}}`
+OBJECTS = "objects"
+# `related_objects[model_key]` is `{"fields": [...], "ids": [...], "rows": [[...]]}`
+COLUMNAR = "columnar"
+
+RELATED_FORMATS = (OBJECTS, COLUMNAR)
+
+
+def get_related_format(serializer) -> str:
+    """
+    The format of the `related_objects` of the top-level `serializer`: the
+    `related_format` context key, else the query parameter of the `request`
+    of the context (`RELATED_FORMAT_PARAM` setting), else
+    `Meta.related_format`, else `"objects"`.
+    """
+    context = serializer.context
+    related_format = context.get("related_format")
+
+    if related_format is None:
+        query_params = getattr(context.get("request"), "query_params", None)
+        if query_params is not None:
+            related_format = query_params.get(get_setting("RELATED_FORMAT_PARAM"))
+
+    if related_format is None:
+        related_format = getattr(
+            getattr(serializer, "Meta", None), "related_format", OBJECTS
+        )
+
+    if related_format not in RELATED_FORMATS:
+        raise ValidationError(
+            {
+                get_setting("RELATED_FORMAT_PARAM"): (
+                    f"Expected one of {', '.join(RELATED_FORMATS)}."
+                )
+            }
+        )
+    return related_format
+
+
+def get_row_fields(serializer) -> List[str]:
+    """
+    The names of the columns of the rows of `serializer`: its readable
+    fields but `id`.
+    """
+    return [
+        field.field_name
+        for field in serializer._readable_fields
+        if field.field_name != PK_FIELD_NAME
+    ]
+
+
+def serialize_rows(serializer, instances) -> Dict[Any, list]:
+    """
+    Serialize `instances` with the plain DRF `serializer` as `{pk: row}`,
+    without building a dict per instance (see `get_row_fields`).
+    """
+    fields = list(serializer._readable_fields)
+    rows = {}
+
+    for instance in instances:
+        pk = None
+        row = []
+        for field in fields:
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                value = None
+            else:
+                # Same `None` handling as `Serializer.to_representation`
+                check_for_none = (
+                    attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+                )
+                value = (
+                    None if check_for_none is None else field.to_representation(attribute)
+                )
+
+            if field.field_name == PK_FIELD_NAME:
+                pk = value
+            else:
+                row.append(value)
+        rows[pk] = row
+
+    return rows
+
+
+def objects_to_rows(fields: Sequence[str], objects: Iterable[dict]) -> Dict[Any, list]:
+    """
+    `{pk: row}` of already serialized `objects`.
+    """
+    return {
+        obj[PK_FIELD_NAME]: [obj.get(field_name) for field_name in fields]
+        for obj in objects
+    }
+
+
+def remap_rows(
+    fields: Sequence[str], row_fields: Sequence[str], rows: Iterable[list]
+) -> Iterable[list]:
+    """
+    Reorder `rows` of `row_fields` into rows of `fields` (a superset).
+    """
+    positions = [fields.index(field_name) for field_name in row_fields]
+    if positions == list(range(len(positions))):
+        return rows
+
+    remapped_rows = []
+    for row in rows:
+        remapped = [None] * len(fields)
+        for position, value in zip(positions, row):
+            remapped[position] = value
+        remapped_rows.append(remapped)
+    return remapped_rows
+
+
+def to_columnar(fields: Sequence[str], rows: Dict[Any, list]) -> dict:
+    """
+    The columnar table of the `{pk: row}` `rows` of `fields`. Rows shorter
+    than `fields` (added before a serializer with more fields) are padded.
+    """
+    width = len(fields)
+    return {
+        "fields": list(fields),
+        "ids": list(rows),
+        "rows": [
+            row if len(row) == width else row + [None] * (width - len(row))
+            for row in rows.values()
+        ],
+    }
+
+
+def combine_columnar(
+    related_objects: Dict[str, dict], child_related_objects: Dict[str, dict]
+) -> Dict[str, dict]:
+    """
+    Merge the columnar tables of `child_related_objects` into
+    `related_objects` in place (e.g. the tables of several chunks) and
+    return it. On a pk conflict the row of `child_related_objects` wins.
+    """
+    for model_key, table in child_related_objects.items():
+        existing = related_objects.get(model_key)
+        if existing is None:
+            related_objects[model_key] = {
+                "fields": list(table["fields"]),
+                "ids": list(table["ids"]),
+                "rows": list(table["rows"]),
+            }
+            continue
+
+        fields = existing["fields"]
+        fields.extend(
+            field_name for field_name in table["fields"] if field_name not in fields
+        )
+        rows = dict(zip(existing["ids"], existing["rows"]))
+        rows.update(zip(table["ids"], remap_rows(fields, table["fields"], table["rows"])))
+        existing.update(to_columnar(fields, rows))
+
+    return related_objects
+
+
+def decode_columnar(related_objects: Dict[str, dict]) -> Dict[str, Dict[Any, dict]]:
+    """
+    Turn columnar `related_objects` back into `{model_key: {pk: {...}}}`,
+    the `"objects"` format.
+    """
+    return {
+        model_key: {
+            pk: {PK_FIELD_NAME: pk, **dict(zip(table["fields"], row))}
+            for pk, row in zip(table["ids"], table["rows"])
+        }
+        for model_key, table in related_objects.items()
+    }
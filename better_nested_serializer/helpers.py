@@ -1,11 +1,15 @@
+import asyncio
+import contextlib
 import dataclasses
-from typing import Type, Dict, Iterable
+import threading
+from typing import Any, Type, Dict, Iterable, List, Optional, Tuple
 
-from deepmerge import always_merger
 from django.db.models import Model
 from rest_framework import serializers
 from rest_framework.relations import PKOnlyObject
 
+from better_nested_serializer.formats import COLUMNAR, OBJECTS, remap_rows, to_columnar
+
 
 @dataclasses.dataclass
 class NestedData:
@@ -14,13 +18,47 @@ class NestedData:
     kwargs: dict
 
 
+@dataclasses.dataclass
+class RelatedGroup:
+    """
+    The loaded instances of one related model, ready to be serialized with
+    `serializer` (a `many=True` serializer).
+    """
+
+    model_key: str
+    serializer: serializers.BaseSerializer
+    instances: list
+    # Representations found in the cross-request cache, by pk
+    cached_objects: Dict[Any, dict]
+    cache: Any = None
+    versions: Dict[Any, str] = dataclasses.field(default_factory=dict)
+    # Columns of the rows, in the columnar format only
+    fields: Optional[List[str]] = None
+    # With a `ValuesPlan`, the column values it read replace `instances`
+    values_plan: Any = None
+    values: Optional[list] = None
+    # References to already collected or already claimed instances
+    duplicates_dropped: int = 0
+
+    @property
+    def instance_count(self) -> int:
+        if self.values is not None:
+            return len(self.values)
+        return len(self.instances)
+
+
 class NestedDataHelper:
 
     def __init__(self):
         self._mapping__field_info: Dict[str, NestedData] = {}
+        # Identity map of the collected instances: model -> pk -> instance.
+        # Instances reachable from several objects are kept only once. A
+        # `None` instance is a pk whose instance has not been loaded yet.
         self._model_cache: Dict[
-            Type[Model], Iterable[Model] | Iterable[PKOnlyObject]
+            Type[Model], Dict[Any, Model | PKOnlyObject | None]
         ] = {}
+        # Number of references collected per model, duplicates included
+        self._reference_counts: Dict[Type[Model], int] = {}
 
     def get_model_class(self, field_name):
         return self._mapping__field_info[field_name].model_class
@@ -36,13 +74,102 @@ class NestedDataHelper:
             **self.get_serializer_kwargs(field_name)
         )
 
-    def get_model_instances(self, model_class):
-        if model_class not in self._model_cache:
-            self._model_cache[model_class] = model_class.objects.all()
-        return self._model_cache[model_class]
+    def get_pks(self, model_class):
+        return list(self._model_cache.get(model_class, {}))
+
+    def get_model_instances(self, model_class, exclude_pks=()):
+        # Only instances collected from the serialized objects are returned.
+        # An empty cache (e.g. every reverse relation was empty) must never
+        # widen into the whole table.
+        self.fetch_pending(model_class, exclude_pks)
+        return [
+            instance
+            for pk, instance in self._model_cache.get(model_class, {}).items()
+            if pk not in exclude_pks
+        ]
+
+    def get_model_items(self, model_class, exclude_pks=()):
+        """
+        `(pk, instance)` pairs of `model_class` (but `exclude_pks`), without
+        loading the pending ones: their instance is `None`.
+        """
+        return [
+            (pk, instance)
+            for pk, instance in self._model_cache.get(model_class, {}).items()
+            if pk not in exclude_pks
+        ]
+
+    def get_reference_count(self, model_class):
+        return self._reference_counts.get(model_class, 0)
 
     def append_to_cache(self, model_class, model_instances):
-        self._model_cache[model_class] = always_merger.merge(self._model_cache.get(model_class, {}), model_instances)
+        instances = self._model_cache.setdefault(model_class, {})
+        count = 0
+        for count, instance in enumerate(model_instances, start=1):
+            if instances.get(instance.pk) is None:
+                instances[instance.pk] = instance
+        self._reference_counts[model_class] = (
+            self._reference_counts.get(model_class, 0) + count
+        )
+
+    def append_pks_to_cache(self, model_class, pks):
+        instances = self._model_cache.setdefault(model_class, {})
+        count = 0
+        for count, pk in enumerate(pks, start=1):
+            instances.setdefault(pk, None)
+        self._reference_counts[model_class] = (
+            self._reference_counts.get(model_class, 0) + count
+        )
+
+    def get_pending_pks(self, model_class, exclude_pks=()):
+        return [
+            pk
+            for pk, instance in self._model_cache.get(model_class, {}).items()
+            if instance is None and pk not in exclude_pks
+        ]
+
+    def fetch_pending(self, model_class, exclude_pks=()):
+        """
+        Load every pending pk of `model_class` (but `exclude_pks`) with a
+        single `pk__in` query.
+        """
+        pending_pks = self.get_pending_pks(model_class, exclude_pks)
+        if pending_pks:
+            self.resolve_pending(
+                model_class,
+                pending_pks,
+                model_class._base_manager.in_bulk(pending_pks),
+            )
+
+    async def afetch_pending(self):
+        """
+        Load the pending pks of every model, one `ain_bulk` query per model,
+        gathered concurrently.
+        """
+        pending = {
+            model_class: self.get_pending_pks(model_class)
+            for model_class in self._model_cache
+        }
+        pending = {model_class: pks for model_class, pks in pending.items() if pks}
+
+        results = await asyncio.gather(
+            *(
+                model_class._base_manager.ain_bulk(pks)
+                for model_class, pks in pending.items()
+            )
+        )
+        for (model_class, pks), instances_by_pk in zip(pending.items(), results):
+            self.resolve_pending(model_class, pks, instances_by_pk)
+
+    def resolve_pending(self, model_class, pks, instances_by_pk):
+        instances = self._model_cache[model_class]
+        for pk in pks:
+            instance = instances_by_pk.get(pk)
+            if instance is None:
+                # Dangling reference, there is nothing to serialize
+                del instances[pk]
+            else:
+                instances[pk] = instance
 
     def items(self):
         yield from self._mapping__field_info.items()
@@ -58,14 +185,328 @@ class NestedDataHelper:
         if kwargs is None:
             kwargs = {}
 
-        self._mapping__field_info[field_name] = NestedData(
-            model_class, serializer_class, kwargs
+        self.add_nested_data(
+            field_name,
+            NestedData(model_class, serializer_class, kwargs),
+            append_to_instance_cache,
         )
+
+    def add_nested_data(
+        self,
+        field_name: str,
+        nested_data: NestedData,
+        append_to_instance_cache: Iterable[Model] | Iterable[PKOnlyObject] = None,
+    ):
+        self._mapping__field_info[field_name] = nested_data
         if append_to_instance_cache:
-            self.append_to_cache(model_class, append_to_instance_cache)
+            self.append_to_cache(nested_data.model_class, append_to_instance_cache)
+
+    def add_nested_pk(self, field_name: str, nested_data: NestedData, pk):
+        """
+        Like `add_nested_data`, for a related instance that is only known by
+        its pk. It is loaded when the instances of its model are requested.
+        """
+        self._mapping__field_info[field_name] = nested_data
+        self.append_pks_to_cache(nested_data.model_class, [pk])
+
+
+def get_model_key(model_class: Type[Model]) -> str:
+    """
+    The key of `model_class` in `related_objects`: `<app_label>_<model_name>`.
+    """
+    return f"{model_class._meta.app_label}_{model_class._meta.model_name}"
 
 
 def combine_related_objects(
     related_objects: Dict[str, Dict], child_related_objs: Dict[str, dict]
 ):
-    return always_merger.merge(related_objects, child_related_objs)
+    """
+    Merge `child_related_objs` into `related_objects` in place and return it.
+
+    `related_objects` is always `{model_key: {pk: dict}}`, so a two-level
+    merge is enough: the objects of a model key are `update`d (or extended,
+    for lists), and on a pk conflict the object of `child_related_objs` wins.
+    The objects themselves are never walked.
+    """
+    for model_key, objects in child_related_objs.items():
+        existing = related_objects.get(model_key)
+        if existing is None:
+            related_objects[model_key] = (
+                dict(objects) if isinstance(objects, dict) else list(objects)
+            )
+        elif isinstance(existing, dict):
+            existing.update(objects)
+        else:
+            existing.extend(objects)
+    return related_objects
+
+
+def get_unsent_refs(
+    related_refs: Dict[str, Iterable[Any]],
+    related_objects: Dict[str, Dict],
+    columnar: bool = False,
+) -> Dict[str, list]:
+    """
+    The pks of `related_refs` (`{model_key: pks}`) whose object is not in
+    `related_objects` (columnar tables when `columnar`), e.g. because a later
+    part of the output serialized it.
+    """
+    unsent_refs = {}
+    for model_key, pks in related_refs.items():
+        if columnar:
+            sent_pks = set(related_objects.get(model_key, {}).get("ids", ()))
+        else:
+            sent_pks = related_objects.get(model_key, {})
+        pks = [pk for pk in pks if pk not in sent_pks]
+        if pks:
+            unsent_refs[model_key] = pks
+    return unsent_refs
+
+
+def get_sent_related_objects(context) -> Optional[Dict[str, set]]:
+    """
+    The related objects the client already received, `{model_key: pks}`:
+    the `sent_related_objects` context key, else the one that
+    `BetterCursorPagination` puts on the `request` of the context.
+    """
+    sent_related_objects = context.get("sent_related_objects")
+    if sent_related_objects is None:
+        sent_related_objects = getattr(
+            context.get("request"), "sent_related_objects", None
+        )
+    return sent_related_objects
+
+
+class RelatedObjectsAccumulator:
+    """
+    `related_objects` being built: `{model_key: {pk: dict}}`.
+
+    Nested serializers write their objects directly into the accumulator of
+    the top-level serialization instead of returning dicts to be merged.
+    """
+
+    def __init__(self):
+        self._related_objects: Dict[str, Dict[Any, dict]] = {}
+
+    def add(self, model_key: str, objects: Dict[Any, dict]):
+        self._related_objects.setdefault(model_key, {}).update(objects)
+
+    def merge(self, related_objects: Dict[str, Dict[Any, dict]]):
+        combine_related_objects(self._related_objects, related_objects)
+
+    def as_dict(self) -> Dict[str, Dict[Any, dict]]:
+        return self._related_objects
+
+
+class RelatedObjectRegistry(RelatedObjectsAccumulator):
+    """
+    The related objects of a whole top-level serialization.
+
+    It is shared by every level of the serializer tree through the serializer
+    context. Before serializing related instances, a level claims their pks:
+    a (model, pk) is claimed, and so serialized, at most once in the tree,
+    whichever path reaches it first.
+    """
+
+    context_key = "better_nested_serializer_registry"
+
+    def __init__(self, related_format=OBJECTS, claimed_pks=None):
+        super().__init__()
+        # In the columnar format the objects are rows, `{pk: [...]}`, whose
+        # columns are kept by model key
+        self.related_format = related_format
+        self._fields: Dict[str, List[str]] = {}
+        # `claimed_pks` (e.g. the objects sent by previous pages) is updated
+        # in place with the new claims
+        self._claimed_pks: Dict[str, set] = (
+            {} if claimed_pks is None else claimed_pks
+        )
+        # Claims made by this registry, by model key and in total: the limits
+        # budget the objects of this serialization, not the ones sent before
+        self._claimed_counts: Dict[str, int] = {}
+        self._claimed_count = 0
+        # Pks left out by the limits, sent as references only
+        self._refs: Dict[str, dict] = {}
+        # Version tags of the objects sent, when the client tells the ones it
+        # has (see `KnownObjects`)
+        self._versions: Dict[str, dict] = {}
+        # Related models may be serialized on several threads
+        self._lock = threading.Lock()
+
+    def add(self, model_key: str, objects: Dict[Any, Any], fields=None):
+        """
+        Add the serialized `objects` of `model_key`: `{pk: dict}`, or in
+        the columnar format `{pk: row}` of the columns `fields`.
+        """
+        with self._lock:
+            if fields is not None:
+                # Serializers of the same model may not have the same fields,
+                # their columns are merged
+                known_fields = self._fields.setdefault(model_key, list(fields))
+                known_fields.extend(
+                    field_name
+                    for field_name in fields
+                    if field_name not in known_fields
+                )
+                objects = dict(
+                    zip(objects, remap_rows(known_fields, fields, objects.values()))
+                )
+            super().add(model_key, objects)
+
+    def merge(self, related_objects: Dict[str, Dict[Any, dict]]):
+        with self._lock:
+            super().merge(related_objects)
+
+    def as_dict(self) -> Dict[str, Dict[Any, dict]]:
+        return self._format(self._related_objects)
+
+    def _format(self, related_objects):
+        if self.related_format != COLUMNAR:
+            return related_objects
+        return {
+            model_key: to_columnar(self._fields[model_key], rows)
+            for model_key, rows in related_objects.items()
+        }
+
+    @classmethod
+    @contextlib.contextmanager
+    def for_context(cls, context: dict, related_format=OBJECTS):
+        """
+        Use the registry of `context`, or put a new one (for the
+        `related_format` format) in it for the duration of the block. A new
+        registry starts with the related objects already sent claimed (see
+        `get_sent_related_objects`).
+        """
+        registry = context.get(cls.context_key)
+        if registry is not None:
+            yield registry
+            return
+
+        registry = context[cls.context_key] = cls(
+            related_format, get_sent_related_objects(context)
+        )
+        try:
+            yield registry
+        finally:
+            context.pop(cls.context_key, None)
+
+    def claim(self, model_key: str, pks: Iterable[Any]) -> list:
+        """
+        Claim `pks` of `model_key` and return the ones that were not claimed
+        yet, i.e. the ones the caller has to serialize.
+        """
+        new_pks, _ = self.claim_within_limits(model_key, pks)
+        return new_pks
+
+    def claim_within_limits(
+        self, model_key: str, pks: Iterable[Any], limits=None
+    ) -> Tuple[list, list]:
+        """
+        Like `claim`, as long as the `max_objects_per_model` and
+        `max_objects` of the `RelatedLimits` `limits` allow it.
+
+        Return the new pks to serialize and the unclaimed pks beyond the
+        limits, which are recorded as references.
+        """
+        max_objects_per_model = getattr(limits, "max_objects_per_model", None)
+        max_objects = getattr(limits, "max_objects", None)
+
+        with self._lock:
+            claimed_pks = self._claimed_pks.setdefault(model_key, set())
+            new_pks = [pk for pk in pks if pk not in claimed_pks]
+
+            budget = len(new_pks)
+            if max_objects_per_model is not None:
+                budget = min(
+                    budget,
+                    max_objects_per_model - self._claimed_counts.get(model_key, 0),
+                )
+            if max_objects is not None:
+                budget = min(budget, max_objects - self._claimed_count)
+            budget = max(budget, 0)
+
+            new_pks, ref_pks = new_pks[:budget], new_pks[budget:]
+            claimed_pks.update(new_pks)
+            self._claimed_counts[model_key] = self._claimed_counts.get(
+                model_key, 0
+            ) + len(new_pks)
+            self._claimed_count += len(new_pks)
+        self.add_refs(model_key, ref_pks)
+        return new_pks, ref_pks
+
+    def add_refs(self, model_key: str, pks: Iterable[Any]):
+        """
+        Send `pks` of `model_key` as references, unless they are serialized.
+        """
+        with self._lock:
+            refs = self._refs.setdefault(model_key, {})
+            refs.update(dict.fromkeys(pks))
+
+    def get_refs(self) -> Dict[str, list]:
+        """
+        The referenced pks that were not serialized (by any path), by model
+        key.
+        """
+        refs = {}
+        for model_key, pks in self._refs.items():
+            claimed_pks = self._claimed_pks.get(model_key, ())
+            pks = [pk for pk in pks if pk not in claimed_pks]
+            if pks:
+                refs[model_key] = pks
+        return refs
+
+    def pop_refs(self) -> Dict[str, list]:
+        """
+        Like `get_refs`, forgetting the references (see `pop_objects`).
+        """
+        with self._lock:
+            refs = self.get_refs()
+            self._refs = {}
+        return refs
+
+    def add_versions(self, model_key: str, tags: Dict[Any, str]):
+        """
+        Send the version tags (`{pk: tag}`) of objects of `model_key`.
+        """
+        if not tags:
+            return
+        with self._lock:
+            self._versions.setdefault(model_key, {}).update(tags)
+
+    def get_versions(self) -> Dict[str, Dict[Any, str]]:
+        return self._versions
+
+    def pop_versions(self) -> Dict[str, Dict[Any, str]]:
+        """
+        Like `get_versions`, forgetting the tags (see `pop_objects`).
+        """
+        with self._lock:
+            versions, self._versions = self._versions, {}
+        return versions
+
+    def to_payload(self, primary_objects) -> dict:
+        """
+        The serialized output: the primary objects, the related objects, the
+        `related_refs` left out by the limits and the `related_versions` of
+        the objects sent, if any.
+        """
+        payload = {"object": primary_objects, "related_objects": self.as_dict()}
+        refs = self.get_refs()
+        if refs:
+            payload["related_refs"] = refs
+        versions = self.get_versions()
+        if versions:
+            payload["related_versions"] = versions
+        return payload
+
+    def is_claimed(self, model_key: str, pk) -> bool:
+        return pk in self._claimed_pks.get(model_key, ())
+
+    def pop_objects(self) -> Dict[str, Dict[Any, dict]]:
+        """
+        Return the objects added so far and forget them, while keeping their
+        claims (used to send related objects in several parts).
+        """
+        with self._lock:
+            related_objects, self._related_objects = self._related_objects, {}
+        return self._format(related_objects)
@@ -0,0 +1,98 @@
+import hashlib
+import re
+from typing import Any, Dict, Iterable, Optional
+
+from rest_framework.exceptions import ValidationError
+
+from better_nested_serializer.conf import get_setting
+
+_ENTRY_PATTERN = re.compile(r"[\w.-]+:[0-9a-f]+")
+
+
+def get_version_tag(version: str) -> str:
+    """
+    The short tag of a related object version sent to and by clients.
+    """
+    return hashlib.blake2s(version.encode(), digest_size=6).hexdigest()
+
+
+class KnownObjects:
+    """
+    The related objects a client already holds: `{model_key: {pk: tag}}`,
+    pks being strings.
+
+    Clients send them in the `X-Known-Related-Objects` header (see
+    `parse`), with the tags they received in `related_versions`.
+    """
+
+    def __init__(self, known: Optional[Dict[str, Dict[str, str]]] = None):
+        self.known = known or {}
+
+    @classmethod
+    def parse(cls, value: str) -> "KnownObjects":
+        """
+        Parse `model_key=pk:tag,pk:tag;model_key=pk:tag`.
+        """
+        known = {}
+        for model_entry in filter(None, (part.strip() for part in value.split(";"))):
+            model_key, _, entries = model_entry.partition("=")
+            objects = known.setdefault(model_key.strip(), {})
+            for entry in filter(None, (part.strip() for part in entries.split(","))):
+                if _ENTRY_PATTERN.fullmatch(entry) is None:
+                    raise ValidationError(
+                        {
+                            get_setting("KNOWN_OBJECTS_HEADER"): (
+                                "Expected `<model_key>=<pk>:<tag>,...;...` entries."
+                            )
+                        }
+                    )
+                pk, _, tag = entry.partition(":")
+                objects[pk] = tag
+        return cls(known)
+
+    @staticmethod
+    def format(related_versions: Dict[str, Dict[Any, str]]) -> str:
+        """
+        The header value announcing the objects of `related_versions` (as
+        returned in a payload), for clients.
+        """
+        return ";".join(
+            f"{model_key}="
+            + ",".join(f"{pk}:{tag}" for pk, tag in versions.items())
+            for model_key, versions in related_versions.items()
+        )
+
+    def get_unchanged(self, model_key: str, tags: Dict[Any, str]) -> Iterable[Any]:
+        """
+        The pks of `tags` (`{pk: tag}`) that the client holds with the same
+        tag.
+        """
+        known_tags = self.known.get(model_key)
+        if not known_tags:
+            return []
+        return [pk for pk, tag in tags.items() if known_tags.get(str(pk)) == tag]
+
+
+def get_known_objects(context) -> Optional[KnownObjects]:
+    """
+    The `KnownObjects` of a serialization: the `known_related_objects`
+    context key, else the `X-Known-Related-Objects` header (the
+    `KNOWN_OBJECTS_HEADER` setting) of the `request` of the context.
+
+    `None` when the client does not use the protocol; an empty header
+    enables it, so that `related_versions` is sent.
+    """
+    known_objects = context.get("known_related_objects")
+    if known_objects is not None:
+        return known_objects
+
+    headers = getattr(context.get("request"), "headers", None)
+    if headers is None:
+        return None
+    value = headers.get(get_setting("KNOWN_OBJECTS_HEADER"))
+    if value is None:
+        return None
+
+    # Parsed once, every level of the serializer tree shares the context
+    known_objects = context["known_related_objects"] = KnownObjects.parse(value)
+    return known_objects
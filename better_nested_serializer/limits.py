@@ -0,0 +1,42 @@
+import dataclasses
+from typing import Optional
+
+from better_nested_serializer.conf import get_setting
+
+
+@dataclasses.dataclass(frozen=True)
+class RelatedLimits:
+    """
+    Upper bounds of the related objects of one top-level serialization.
+
+    - `max_depth`: nesting levels of related objects that are serialized
+      (`1`: the objects referenced by the primary objects only);
+    - `max_objects_per_model`: related objects serialized per model key;
+    - `max_objects`: related objects serialized in total.
+
+    Related objects beyond a limit are neither loaded nor serialized: their
+    pks are sent in `related_refs` instead. `None` means no limit.
+    """
+
+    max_depth: Optional[int] = None
+    max_objects_per_model: Optional[int] = None
+    max_objects: Optional[int] = None
+
+    def is_too_deep(self, depth: int) -> bool:
+        return self.max_depth is not None and depth > self.max_depth
+
+
+def get_related_limits(context) -> RelatedLimits:
+    """
+    The `related_limits` of the context, or else the limits of the
+    settings (`MAX_RELATED_DEPTH`, `MAX_RELATED_OBJECTS_PER_MODEL`,
+    `MAX_RELATED_OBJECTS`).
+    """
+    limits = context.get("related_limits")
+    if limits is not None:
+        return limits
+    return RelatedLimits(
+        max_depth=get_setting("MAX_RELATED_DEPTH"),
+        max_objects_per_model=get_setting("MAX_RELATED_OBJECTS_PER_MODEL"),
+        max_objects=get_setting("MAX_RELATED_OBJECTS"),
+    )
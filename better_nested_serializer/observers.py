@@ -0,0 +1,115 @@
+import contextlib
+import dataclasses
+import enum
+import functools
+import logging
+import time
+from typing import Optional
+
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from better_nested_serializer.conf import get_setting
+
+logger = logging.getLogger("better_nested_serializer")
+
+
+class Phase(enum.Enum):
+    # Primary objects built from the instances (nested fields collected)
+    PRIMARY = "primary"
+    # Related instances claimed, looked up in the cache and loaded
+    COLLECT = "collect"
+    # Instances of one related model serialized
+    RELATED = "related"
+
+
+@dataclasses.dataclass
+class PhaseEvent:
+    serializer: object
+    phase: Phase
+    model_key: Optional[str] = None
+    instance_count: int = 0
+    duplicates_dropped: int = 0
+    queries: int = 0
+    elapsed: float = 0.0
+
+
+class SerializationObserver:
+    """
+    Receives a `PhaseEvent` for every phase of `BetterModelSerializer`
+    serialization, at every nesting level.
+
+    Set one per serialization with the `serialization_observer` context key,
+    or globally with `BETTER_NESTED_SERIALIZER["OBSERVER"]` (dotted path of a
+    class instantiated without arguments). Related models serialized with
+    `parallel_related` report from worker threads, so observers must be
+    thread-safe.
+    """
+
+    def record(self, event: PhaseEvent):
+        raise NotImplementedError
+
+
+class LoggingObserver(SerializationObserver):
+    """
+    Log every phase on the `better_nested_serializer` logger (DEBUG level).
+    """
+
+    def record(self, event: PhaseEvent):
+        logger.debug(
+            "%s %s%s: %d instances, %d duplicates dropped, %d queries, %.2f ms",
+            event.serializer.__class__.__name__,
+            event.phase.value,
+            f" {event.model_key}" if event.model_key else "",
+            event.instance_count,
+            event.duplicates_dropped,
+            event.queries,
+            event.elapsed * 1000,
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def _get_observer_from_settings(path):
+    return import_string(path)()
+
+
+def get_observer(context) -> Optional[SerializationObserver]:
+    observer = context.get("serialization_observer")
+    if observer is not None:
+        return observer
+    path = get_setting("OBSERVER")
+    if path is None:
+        return None
+    return _get_observer_from_settings(path)
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextlib.contextmanager
+def observe_phase(observer, serializer, phase: Phase, **info):
+    """
+    Time the block and count the queries it issues (on this thread), then
+    report it to `observer`. The yielded `PhaseEvent` can be completed by the
+    block. Does nothing, and yields `None`, without an observer.
+    """
+    if observer is None:
+        yield None
+        return
+
+    event = PhaseEvent(serializer, phase, **info)
+    counter = _QueryCounter()
+    with contextlib.ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        start = time.perf_counter()
+        yield event
+        event.elapsed = time.perf_counter() - start
+    event.queries = counter.count
+    observer.record(event)
@@ -0,0 +1,184 @@
+import zlib
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Any, Dict, Iterable
+from urllib import parse
+
+from django.core import signing
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, _positive_int
+from rest_framework.utils.urls import replace_query_param
+
+from better_nested_serializer.conf import get_setting
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, position: int):
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def encode_pk_sets(pk_sets: Dict[str, Iterable[Any]]) -> bytes:
+    """
+    Compact binary form of `{model_key: pks}`: per model key, its name, its
+    number of pks and the gaps between its sorted pks, as varints, the whole
+    compressed with zlib. Dense pk ranges take about a bit per pk.
+
+    Only non-negative integer pks are kept: objects with other pks are
+    simply sent again.
+    """
+    out = bytearray()
+    for model_key in sorted(pk_sets):
+        pks = sorted(
+            pk for pk in pk_sets[model_key] if type(pk) is int and pk >= 0
+        )
+        if not pks:
+            continue
+        name = model_key.encode()
+        _write_varint(out, len(name))
+        out += name
+        _write_varint(out, len(pks))
+        previous = 0
+        for pk in pks:
+            _write_varint(out, pk - previous)
+            previous = pk
+    return zlib.compress(bytes(out), 9) if out else b""
+
+
+def decode_pk_sets(data: bytes) -> Dict[str, set]:
+    """
+    The `{model_key: pks}` of `encode_pk_sets`. Raise `ValueError` when
+    `data` is malformed.
+    """
+    if not data:
+        return {}
+    try:
+        data = zlib.decompress(data)
+        pk_sets = {}
+        position = 0
+        while position < len(data):
+            length, position = _read_varint(data, position)
+            model_key = data[position : position + length].decode()
+            position += length
+            count, position = _read_varint(data, position)
+            pks = pk_sets[model_key] = set()
+            pk = 0
+            for _ in range(count):
+                gap, position = _read_varint(data, position)
+                pk += gap
+                pks.add(pk)
+    except (zlib.error, IndexError) as exc:
+        raise ValueError("Malformed pk sets.") from exc
+    return pk_sets
+
+
+def _b64encode(data: bytes) -> str:
+    return urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64decode(value: str) -> bytes:
+    return urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+class BetterCursorPagination(CursorPagination):
+    """
+    Keyset pagination (the DRF `CursorPagination`, no `OFFSET` scans) whose
+    signed cursors also carry the pks of the related objects sent by the
+    previous pages.
+
+    They are claimed before the page is serialized (see
+    `get_sent_related_objects`), so a related object is sent by the first
+    page that references it only: clients keep the `related_objects` of the
+    pages they followed. Past `max_sent_objects` pks (the
+    `CURSOR_MAX_SENT_OBJECTS` setting), or when they would take more than
+    `max_sent_size` characters of the cursor (the `CURSOR_MAX_SENT_SIZE`
+    setting, so that links stay within the URL limits of servers and
+    proxies), the set starts over.
+    """
+
+    cursor_salt = "better_nested_serializer.pagination.cursor"
+    max_sent_objects = None
+    max_sent_size = None
+
+    def get_max_sent_objects(self) -> int:
+        if self.max_sent_objects is not None:
+            return self.max_sent_objects
+        return get_setting("CURSOR_MAX_SENT_OBJECTS")
+
+    def get_max_sent_size(self) -> int:
+        if self.max_sent_size is not None:
+            return self.max_sent_size
+        return get_setting("CURSOR_MAX_SENT_SIZE")
+
+    def encode_sent_related_objects(self) -> str:
+        """
+        The part of the cursor carrying the related objects sent so far;
+        empty past the limits.
+        """
+        sent_related_objects = getattr(self, "sent_related_objects", {})
+        if (
+            sum(len(pks) for pks in sent_related_objects.values())
+            > self.get_max_sent_objects()
+        ):
+            return ""
+        encoded = _b64encode(encode_pk_sets(sent_related_objects))
+        if len(encoded) > self.get_max_sent_size():
+            return ""
+        return encoded
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Filled by `decode_cursor`, then with the claims of this page
+        self.sent_related_objects = {}
+        page = super().paginate_queryset(queryset, request, view)
+        request.sent_related_objects = self.sent_related_objects
+        return page
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            value = signing.Signer(salt=self.cursor_salt).unsign(encoded)
+            position_part, _, sent_part = value.partition(".")
+            tokens = parse.parse_qs(
+                _b64decode(position_part).decode("ascii"), keep_blank_values=True
+            )
+
+            offset = _positive_int(
+                tokens.get("o", ["0"])[0], cutoff=self.offset_cutoff
+            )
+            reverse = bool(int(tokens.get("r", ["0"])[0]))
+            position = tokens.get("p", [None])[0]
+            self.sent_related_objects = decode_pk_sets(_b64decode(sent_part))
+        except (signing.BadSignature, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return Cursor(offset=offset, reverse=reverse, position=position)
+
+    def encode_cursor(self, cursor):
+        tokens = {}
+        if cursor.offset != 0:
+            tokens["o"] = str(cursor.offset)
+        if cursor.reverse:
+            tokens["r"] = "1"
+        if cursor.position is not None:
+            tokens["p"] = cursor.position
+
+        value = signing.Signer(salt=self.cursor_salt).sign(
+            _b64encode(parse.urlencode(tokens, doseq=True).encode("ascii"))
+            + "."
+            + self.encode_sent_related_objects()
+        )
+        return replace_query_param(self.base_url, self.cursor_query_param, value)
@@ -0,0 +1,162 @@
+import dataclasses
+from typing import Dict, FrozenSet, Optional, Set, Tuple
+
+from django.db.models import Model, Prefetch, QuerySet
+from rest_framework import serializers
+from rest_framework.serializers import ListSerializer
+
+from better_nested_serializer.fieldsets import FieldSelection, is_selected
+from better_nested_serializer.helpers import get_model_key
+
+
+@dataclasses.dataclass(frozen=True)
+class QueryPlan:
+    """
+    The `select_related` / `prefetch_related` calls needed to serialize a
+    queryset without per-row queries.
+    """
+
+    select_related: Tuple[str, ...] = ()
+    prefetch_related: Tuple[Prefetch, ...] = ()
+
+    def apply(self, queryset: QuerySet) -> QuerySet:
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+
+        # A lookup that is already prefetched (possibly with a custom
+        # queryset) is left alone, Django refuses to prefetch it twice.
+        already_prefetched = {
+            getattr(lookup, "prefetch_to", lookup)
+            for lookup in queryset._prefetch_related_lookups
+        }
+        prefetches = [
+            prefetch
+            for prefetch in self.prefetch_related
+            if prefetch.prefetch_to not in already_prefetched
+        ]
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+
+        return queryset
+
+
+def get_relation(model_class: type[Model], attribute: str):
+    """
+    Return the relation (forward field or reverse relation) that is reached
+    through `attribute` on instances of `model_class`, or `None`.
+    """
+    for field in model_class._meta.get_fields():
+        if not field.is_relation or field.related_model is None:
+            continue
+        if field.auto_created and not field.concrete:
+            accessor = field.get_accessor_name()
+        else:
+            accessor = field.name
+        if accessor == attribute:
+            return field
+    return None
+
+
+def _iter_relation_fields(serializer):
+    """
+    `(field, nested model serializer, relation)` of the readable fields of
+    `serializer` that `build_query_plan` follows.
+    """
+    model_class = serializer.Meta.model
+    for field in serializer._readable_fields:
+        if isinstance(field, ListSerializer):
+            nested_serializer = field.child
+        else:
+            nested_serializer = field
+
+        if not isinstance(nested_serializer, serializers.ModelSerializer):
+            continue
+        if len(field.source_attrs) != 1:
+            continue
+
+        relation = get_relation(model_class, field.source)
+        if relation is None:
+            continue
+        yield field, nested_serializer, relation
+
+
+def get_relation_fields(
+    serializer: serializers.ModelSerializer,
+) -> Tuple[FrozenSet[str], Dict[str, FrozenSet[str]]]:
+    """
+    The names of the fields that `build_query_plan` follows: of
+    `serializer`, and by model key, of its nested serializers, recursively.
+    A `FieldSelection` only changes the plan through them (see
+    `FieldSelection.restrict`).
+    """
+    related: Dict[str, Set[str]] = {}
+
+    def walk(nested_serializer):
+        field_names = set()
+        for field, child, _ in _iter_relation_fields(nested_serializer):
+            field_names.add(field.field_name)
+            related.setdefault(get_model_key(child.Meta.model), set()).update(
+                walk(child)
+            )
+        return field_names
+
+    fields = walk(serializer)
+    return frozenset(fields), {
+        model_key: frozenset(field_names) for model_key, field_names in related.items()
+    }
+
+
+def build_query_plan(
+    serializer: serializers.ModelSerializer,
+    selection: Optional[FieldSelection] = None,
+    field_names: Optional[FrozenSet[str]] = None,
+) -> QueryPlan:
+    """
+    Walk the readable fields of `serializer` and of its nested model
+    serializers, and derive the joins and prefetches they need.
+
+    Forward relations are joined with `select_related`; reverse and
+    many-to-many relations become `Prefetch` objects whose queryset is
+    optimized for the nested serializer in turn.
+
+    Only the fields in `field_names` (all when `None`) are walked, and the
+    nested levels only walk the fields `selection` keeps for their model.
+    """
+    select_related = []
+    prefetch_related = []
+
+    for field, nested_serializer, relation in _iter_relation_fields(serializer):
+        if not is_selected(field.field_name, field_names):
+            continue
+
+        nested_plan = build_query_plan(
+            nested_serializer,
+            selection,
+            (
+                selection.get_related_fields(
+                    get_model_key(nested_serializer.Meta.model)
+                )
+                if selection is not None
+                else None
+            ),
+        )
+
+        if relation.one_to_many or relation.many_to_many:
+            nested_queryset = nested_plan.apply(
+                nested_serializer.Meta.model._default_manager.all()
+            )
+            prefetch_related.append(Prefetch(field.source, queryset=nested_queryset))
+        else:
+            select_related.append(field.source)
+            select_related.extend(
+                f"{field.source}__{lookup}" for lookup in nested_plan.select_related
+            )
+            prefetch_related.extend(
+                Prefetch(
+                    f"{field.source}__{prefetch.prefetch_through}",
+                    queryset=prefetch.queryset,
+                )
+                for prefetch in nested_plan.prefetch_related
+            )
+
+    return QueryPlan(tuple(select_related), tuple(prefetch_related))
@@ -0,0 +1,61 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Types orjson does not know (Decimal, lazy translations, querysets...), and
+# dates and times, are converted like DRF does.
+_default = JSONEncoder().default
+
+
+def _get_dumps():
+    if orjson is not None:
+        # Int pks keys are written as they are, no str conversion pass.
+        # orjson writes UTC datetimes with `+00:00` where DRF writes `Z`:
+        # datetimes, dates and times go through `_default`.
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+        def dumps(data):
+            return orjson.dumps(data, default=_default, option=options)
+
+        return "orjson", dumps
+
+    return "json", None
+
+
+BACKEND, _dumps = _get_dumps()
+
+
+class BetterJSONRenderer(JSONRenderer):
+    """
+    A `JSONRenderer` for the `{"object", "related_objects"}` payloads,
+    encoding with orjson when installed, to the same bytes.
+
+    It writes compact UTF-8 and `int` dict keys natively. The standard
+    library renderer of DRF is used when it is not installed, when an
+    indented output is requested (`indent` media type parameter) and when
+    `UNICODE_JSON` or `COMPACT_JSON` is disabled.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        renderer_context = renderer_context or {}
+        if (
+            _dumps is None
+            or self.get_indent(accepted_media_type, renderer_context) is not None
+            or self.ensure_ascii
+            or not self.compact
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = _dumps(data)
+        # Like DRF, escape these so that the output is a strict javascript
+        # subset
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+            b"\xe2\x80\xa9", b"\\u2029"
+        )
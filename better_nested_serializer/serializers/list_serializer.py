@@ -1,45 +1,268 @@
+import itertools
+
+from asgiref.sync import sync_to_async
 from django.db import models
 from rest_framework import serializers
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.utils.serializer_helpers import ReturnDict
 
-from better_nested_serializer.helpers import combine_related_objects
+from better_nested_serializer.export import export_queryset
+from better_nested_serializer.fieldsets import get_field_selection
+from better_nested_serializer.formats import (
+    COLUMNAR,
+    OBJECTS,
+    combine_columnar,
+    get_related_format,
+)
+from better_nested_serializer.helpers import (
+    NestedDataHelper,
+    RelatedObjectRegistry,
+    combine_related_objects,
+    get_unsent_refs,
+)
 
 
 class BetterListSerializer(serializers.ListSerializer):
+    def get_iterable(self, data):
+        from better_nested_serializer.serializers.model_serializer import BetterModelSerializer
+
+        # Dealing with nested relationships, data can be a Manager,
+        # so, first get a queryset from the Manager if needed
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+
+        # Opt-in: add the joins and prefetches the child needs, as long as
+        # the queryset has not been evaluated yet.
+        if (
+            isinstance(iterable, models.QuerySet)
+            and iterable._result_cache is None
+            and isinstance(self.child, BetterModelSerializer)
+            and getattr(self.child.Meta, "auto_optimize_queryset", False)
+        ):
+            iterable = self.child.optimize_queryset(
+                iterable, get_field_selection(self.context)
+            )
+
+        return iterable
+
+    def get_related_format(self):
+        """
+        The format of `related_objects` (see `formats.get_related_format`).
+        """
+        from better_nested_serializer.serializers.model_serializer import BetterModelSerializer
+
+        if not isinstance(self.child, BetterModelSerializer):
+            return OBJECTS
+        return get_related_format(self.child)
+
     def to_representation(self, data):
         """
         List of object instances -> List of dicts of primitive datatypes.
         """
         from better_nested_serializer.serializers.model_serializer import BetterModelSerializer
 
-        # Dealing with nested relationships, data can be a Manager,
-        # so, first get a queryset from the Manager if needed
-        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        if not isinstance(self.child, BetterModelSerializer):
+            return {
+                "object": [
+                    self.child.to_representation(item)
+                    for item in self.get_iterable(data)
+                ],
+                "related_objects": {},
+            }
 
-        primary_objects = []
+        self.child.select_primary_fields()
 
-        related_objects = {}
+        with RelatedObjectRegistry.for_context(
+            self.context, self.get_related_format()
+        ) as related_objects:
+            primary_objects = self.to_normalized_representation(data, related_objects)
+
+        return related_objects.to_payload(primary_objects)
+
+    async def ato_representation(self, data):
+        """
+        Async counterpart of `to_representation`: querysets are evaluated
+        with the async ORM and the pending related instances of every model
+        are fetched concurrently (see `BetterModelSerializer.ato_representation`).
+        """
+        from better_nested_serializer.serializers.model_serializer import BetterModelSerializer
+
+        if isinstance(self.child, BetterModelSerializer):
+            self.child.select_primary_fields()
 
-        for item in iterable:
-            child_data = self.child.to_representation(item)
+        iterable = self.get_iterable(data)
+        if isinstance(iterable, models.QuerySet):
+            iterable = [item async for item in iterable]
+
+        if not isinstance(self.child, BetterModelSerializer):
+            return await sync_to_async(self.to_representation)(iterable)
+
+        nested_helper = NestedDataHelper()
+
+        with RelatedObjectRegistry.for_context(
+            self.context, self.get_related_format()
+        ) as related_objects:
+            primary_objects = await sync_to_async(
+                self.child.to_primary_representations
+            )(iterable, nested_helper)
+            await nested_helper.afetch_pending()
+            await sync_to_async(self.child.to_related_representation)(
+                nested_helper, related_objects
+            )
+
+        return related_objects.to_payload(primary_objects)
+
+    def to_normalized_representation(self, data, related_objects):
+        """
+        List of object instances -> List of primary object dicts, writing
+        the related objects into the `related_objects` registry.
+
+        The child must be a `BetterModelSerializer`.
+        """
+        # Two phases: first collect the related instances of every item into
+        # a single helper, then serialize each related model exactly once.
+        nested_helper = NestedDataHelper()
 
-            if isinstance(self.child, BetterModelSerializer):
-                """
-                Here we are dealing with nested relationships, of format:
-                    (<primary_object_dict>, <related_objects_dict>)
-                """
-                child_primary_obj = child_data["object"]
-                child_related_objs = child_data["related_objects"]
-                primary_objects.append(child_primary_obj)
+        primary_objects = self.child.to_primary_representations(
+            self.get_iterable(data), nested_helper
+        )
+        self.child.to_related_representation(nested_helper, related_objects)
 
-                related_objects = combine_related_objects(
-                    related_objects, child_related_objs
+        return primary_objects
+
+    def to_normalized_rows(self, data, related_objects):
+        """
+        Like `to_normalized_representation`, returning the primary objects
+        as `{pk: row}` (see `BetterModelSerializer.to_primary_row`).
+        """
+        nested_helper = NestedDataHelper()
+
+        rows = self.child.to_primary_rows(self.get_iterable(data), nested_helper)
+        self.child.to_related_representation(nested_helper, related_objects)
+
+        return rows
+
+    def iter_chunks(self, chunk_size=2000):
+        """
+        Serialize `self.instance` `chunk_size` items at a time.
+
+        Yields one `{"object": [...], "related_objects": {...}}` dict per
+        chunk (with the `related_refs` and `related_versions` of the chunk, if
+        any). Querysets are
+        iterated with `.iterator(chunk_size=...)`, and a related object is
+        only serialized and yielded by the first chunk that references it:
+        later chunks only find its pk claimed in the registry.
+        """
+        from better_nested_serializer.serializers.model_serializer import BetterModelSerializer
+
+        if isinstance(self.child, BetterModelSerializer):
+            self.child.select_primary_fields()
+
+        iterable = self.get_iterable(self.instance)
+        if isinstance(iterable, models.QuerySet) and iterable._result_cache is None:
+            iterable = iterable.iterator(chunk_size=chunk_size)
+        iterator = iter(iterable)
+
+        with RelatedObjectRegistry.for_context(
+            self.context, self.get_related_format()
+        ) as related_objects:
+            while chunk := list(itertools.islice(iterator, chunk_size)):
+                if not isinstance(self.child, BetterModelSerializer):
+                    yield {
+                        "object": [
+                            self.child.to_representation(item) for item in chunk
+                        ],
+                        "related_objects": {},
+                    }
+                    continue
+
+                primary_objects = self.to_normalized_representation(
+                    chunk, related_objects
                 )
+                payload = {
+                    "object": primary_objects,
+                    "related_objects": related_objects.pop_objects(),
+                }
+                related_refs = related_objects.pop_refs()
+                if related_refs:
+                    payload["related_refs"] = related_refs
+                related_versions = related_objects.pop_versions()
+                if related_versions:
+                    payload["related_versions"] = related_versions
+                yield payload
+
+    def iter_json_chunks(self, chunk_size=2000, interleave_related=False):
+        """
+        Render `self.instance` as JSON, `chunk_size` items at a time.
+
+        By default a single JSON document is produced: `object` entries are
+        emitted as soon as their chunk is serialized and `related_objects` is
+        emitted at the end. With `interleave_related=True` every chunk is
+        emitted as its own JSON line (JSON Lines) holding the related objects
+        that are new in that chunk, so nothing is kept across chunks but the
+        pks of the related objects already sent.
+        """
+        encoder = JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+        if interleave_related:
+            for chunk in self.iter_chunks(chunk_size=chunk_size):
+                yield encoder.encode(chunk) + "\n"
+            return
+
+        columnar = self.get_related_format() == COLUMNAR
+        related_objects = {}
+        related_refs = {}
+        related_versions = {}
+        separator = ""
+
+        yield '{"object":['
+        for chunk in self.iter_chunks(chunk_size=chunk_size):
+            if chunk["object"]:
+                yield separator + encoder.encode(chunk["object"])[1:-1]
+                separator = ","
+            if columnar:
+                combine_columnar(related_objects, chunk["related_objects"])
             else:
-                primary_objects.append(child_data)
-        return {"object": primary_objects, "related_objects": related_objects}
+                combine_related_objects(related_objects, chunk["related_objects"])
+            for model_key, pks in chunk.get("related_refs", {}).items():
+                related_refs.setdefault(model_key, {}).update(dict.fromkeys(pks))
+            for model_key, tags in chunk.get("related_versions", {}).items():
+                related_versions.setdefault(model_key, {}).update(tags)
+
+        related_refs = get_unsent_refs(related_refs, related_objects, columnar)
+        yield '],"related_objects":' + encoder.encode(related_objects)
+        if related_refs:
+            yield ',"related_refs":' + encoder.encode(related_refs)
+        if related_versions:
+            yield ',"related_versions":' + encoder.encode(related_versions)
+        yield "}"
+
+    def export(self, workers=1, chunk_size=5000, fp=None, export_format="json"):
+        """
+        Serialize the queryset of this serializer by pk ranges of
+        `chunk_size` rows in `workers` processes (see `export_queryset`).
+
+        The context of the serializer is sent to the workers, so it must be
+        picklable.
+        """
+        return export_queryset(
+            self.child.__class__,
+            self.get_iterable(self.instance),
+            workers=workers,
+            chunk_size=chunk_size,
+            context=self.context,
+            fp=fp,
+            export_format=export_format,
+            related_format=self.get_related_format(),
+        )
 
     @property
     def data(self):
         ret = self.to_representation(self.instance)
         return ReturnDict(ret, serializer=self)
+
+    async def adata(self):
+        """
+        Async counterpart of `data`: `await serializer.adata()`.
+        """
+        ret = await self.ato_representation(self.instance)
+        return ReturnDict(ret, serializer=self)
@@ -1,20 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models import prefetch_related_objects
 from django.db.models.manager import BaseManager
-from rest_framework import serializers
+from rest_framework import relations, serializers
 from rest_framework.fields import SkipField
-from rest_framework.relations import PKOnlyObject, PrimaryKeyRelatedField
+from rest_framework.relations import PKOnlyObject
 from rest_framework.serializers import (
-    ListSerializer,
     LIST_SERIALIZER_KWARGS_REMOVE,
     LIST_SERIALIZER_KWARGS,
 )
 from rest_framework.utils.serializer_helpers import ReturnDict
 
+from better_nested_serializer.cache import (
+    get_object_versions,
+    get_related_object_cache,
+)
+from better_nested_serializer.conf import get_setting
 from better_nested_serializer.exceptions.serializers import ActionProhibited
-from better_nested_serializer.helpers import NestedDataHelper, combine_related_objects
+from better_nested_serializer.field_plan import FieldKind, get_representation_plan
+from better_nested_serializer.fieldsets import (
+    PK_FIELD_NAME,
+    get_field_selection,
+    select_fields,
+)
+from better_nested_serializer.formats import (
+    COLUMNAR,
+    get_related_format,
+    get_row_fields,
+    objects_to_rows,
+    serialize_rows,
+)
+from better_nested_serializer.helpers import (
+    NestedDataHelper,
+    RelatedGroup,
+    RelatedObjectRegistry,
+    get_model_key,
+)
+from better_nested_serializer.known_objects import (
+    get_known_objects,
+    get_version_tag,
+)
+from better_nested_serializer.limits import get_related_limits
+from better_nested_serializer.observers import Phase, get_observer, observe_phase
+from better_nested_serializer.query_plan import (
+    build_query_plan,
+    get_relation,
+    get_relation_fields,
+)
+from better_nested_serializer.values import get_values_plan
 from better_nested_serializer.serializers.list_serializer import BetterListSerializer
 
 
+# Value of a field that is left out of the representation
+_SKIPPED = object()
+
+
+def _reads_relations(serializer) -> bool:
+    """
+    Whether serializing with `serializer` (the child of a related
+    serializer) reads relations, and so may query the database: the nested
+    fields of a `BetterModelSerializer`, or the nested serializers and
+    related fields (but pk-only ones) of others.
+    """
+    if isinstance(serializer, BetterModelSerializer):
+        return any(
+            field_plan.kind is not FieldKind.PRIMITIVE
+            for _, field_plan in serializer._get_compiled_fields()
+        )
+    return any(
+        isinstance(field, (serializers.BaseSerializer, relations.ManyRelatedField))
+        or (
+            isinstance(field, relations.RelatedField)
+            and not field.use_pk_only_optimization()
+        )
+        for field in getattr(serializer, "_readable_fields", ())
+    )
+
+
 class BetterModelSerializer(serializers.ModelSerializer):
+    # Nesting level of the objects serialized by this serializer: 0 for the
+    # primary objects, 1 for their related objects...
+    nesting_level = 0
 
     def __init__(self, instance=None, is_nested=False, **kwargs):
         self.is_nested = is_nested
@@ -63,6 +131,62 @@ class BetterModelSerializer(serializers.ModelSerializer):
     def get_default_list_serializer_class(cls):
         return BetterListSerializer
 
+    @classmethod
+    def get_query_plan(cls, selection=None):
+        """
+        The `QueryPlan` of this serializer class for the `FieldSelection`
+        `selection` (all fields when `None`), built once from its nested
+        fields and cached on the class.
+
+        Selections come from query parameters: they are restricted to the
+        relation fields of the serializer tree first, so that the cache
+        only grows with the selections that change the plan.
+        """
+        query_plans = cls.__dict__.get("_query_plans")
+        if query_plans is None:
+            cls._relation_fields = get_relation_fields(cls())
+            query_plans = cls._query_plans = {}
+        if selection is not None:
+            selection = selection.restrict(*cls._relation_fields)
+        query_plan = query_plans.get(selection)
+        if query_plan is None:
+            query_plan = build_query_plan(
+                cls(),
+                selection,
+                selection.fields if selection is not None else None,
+            )
+            query_plans[selection] = query_plan
+        return query_plan
+
+    @classmethod
+    def optimize_queryset(cls, queryset, selection=None):
+        """
+        Apply the `select_related` / `prefetch_related` calls needed by this
+        serializer (and its nested serializers) to `queryset`, for the
+        fields kept by `selection`.
+        """
+        return cls.get_query_plan(selection).apply(queryset)
+
+    def select_primary_fields(self):
+        """
+        Drop the fields of the primary objects that the `FieldSelection` of
+        the context leaves out. Called by the root serializer only.
+        """
+        selection = get_field_selection(self.context)
+        if selection is not None:
+            select_fields(self, selection.fields)
+
+    @classmethod
+    def get_writer(cls, data, **kwargs):
+        """
+        The `NormalizedWriter` of a `{"object", "related_objects"}` payload
+        of this serializer: deserialization goes through it, in bulk, since
+        `data=` is prohibited.
+        """
+        from better_nested_serializer.writer import NormalizedWriter
+
+        return NormalizedWriter(cls, data, **kwargs)
+
     def validate(self, attrs):
         raise ActionProhibited(self.__class__, action="Validation")
 
@@ -73,91 +197,561 @@ class BetterModelSerializer(serializers.ModelSerializer):
         raise ActionProhibited(self.__class__, action="Update")
 
     def to_representation(self, instance):
-        primary_object = {}
-        fields = self._readable_fields
+        if self.parent is None:
+            self.select_primary_fields()
 
         nested_helper = NestedDataHelper()
 
-        for field in fields:
-            try:
-                attribute = field.get_attribute(instance)
-            except SkipField:
-                continue
+        with RelatedObjectRegistry.for_context(
+            self.context, get_related_format(self)
+        ) as related_objects:
+            (primary_object,) = self.to_primary_representations(
+                [instance], nested_helper
+            )
+            self.to_related_representation(nested_helper, related_objects)
+
+        return related_objects.to_payload(primary_object)
+
+    async def ato_representation(self, instance):
+        """
+        Async counterpart of `to_representation`.
+
+        The pending related instances of every model are fetched
+        concurrently with the async ORM; the collection and related
+        serialization phases run in a worker thread, so they do not block
+        the event loop.
+        """
+        if self.parent is None:
+            self.select_primary_fields()
+
+        nested_helper = NestedDataHelper()
+
+        with RelatedObjectRegistry.for_context(
+            self.context, get_related_format(self)
+        ) as related_objects:
+            (primary_object,) = await sync_to_async(self.to_primary_representations)(
+                [instance], nested_helper
+            )
+            await nested_helper.afetch_pending()
+            await sync_to_async(self.to_related_representation)(
+                nested_helper, related_objects
+            )
+
+        return related_objects.to_payload(primary_object)
 
-            # We skip `to_representation` for `None` values so that fields do
-            # not have to explicitly deal with that case.
-            #
-            # For related fields with `use_pk_only_optimization` we need to
-            # resolve the pk value.
-            check_for_none = (
-                attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+    def to_primary_representations(self, instances, nested_helper):
+        """
+        `to_primary_representation` of every instance of `instances`, sharing
+        `nested_helper`.
+        """
+        with observe_phase(
+            get_observer(self.context), self, Phase.PRIMARY
+        ) as phase_event:
+            instances = self.prefetch_nested_many(instances)
+            primary_objects = [
+                self.to_primary_representation(instance, nested_helper)
+                for instance in instances
+            ]
+            if phase_event is not None:
+                phase_event.instance_count = len(primary_objects)
+
+        return primary_objects
+
+    def to_primary_rows(self, instances, nested_helper):
+        """
+        `to_primary_row` of every instance of `instances`, sharing
+        `nested_helper`, as `{pk: row}`.
+        """
+        with observe_phase(
+            get_observer(self.context), self, Phase.PRIMARY
+        ) as phase_event:
+            instances = self.prefetch_nested_many(instances)
+            rows = dict(
+                self.to_primary_row(instance, nested_helper) for instance in instances
             )
-            if check_for_none is None:
-                primary_object[field.field_name] = None
+            if phase_event is not None:
+                phase_event.instance_count = len(rows)
+
+        return rows
+
+    def to_primary_representation(self, instance, nested_helper):
+        """
+        Object instance -> Dict of primitive datatypes, with nested fields
+        replaced by their primary keys.
+
+        The related instances are collected into `nested_helper` instead of
+        being serialized, so that several instances can share one helper and
+        have their related objects serialized together afterwards.
+        """
+        primary_object = {}
+
+        for field, field_plan in self._get_compiled_fields():
+            value = self._get_primary_value(instance, field, field_plan, nested_helper)
+            if value is not _SKIPPED:
+                primary_object[field_plan.field_name] = value
+
+        return primary_object
+
+    def to_primary_row(self, instance, nested_helper):
+        """
+        Like `to_primary_representation`, as a `(pk, row)` pair: the row
+        holds the values of the fields but `id`, in field order (`None` for
+        skipped fields). Used by the columnar format.
+        """
+        pk = None
+        row = []
+
+        for field, field_plan in self._get_compiled_fields():
+            value = self._get_primary_value(instance, field, field_plan, nested_helper)
+            if field_plan.field_name == PK_FIELD_NAME:
+                pk = value
             else:
-                if isinstance(field, serializers.ModelSerializer):
-                    primary_object[field.field_name] = PrimaryKeyRelatedField(
-                        queryset=field.Meta.model.objects.all()
-                    ).to_representation(attribute)
-
-                    nested_helper.add(
-                        field_name=field.field_name,
-                        model_class=field.Meta.model,
-                        serializer_class=field.__class__,
-                        # kwargs=field.kwargs,
-                        append_to_instance_cache=[attribute],
-                    )
+                row.append(None if value is _SKIPPED else value)
 
-                elif isinstance(field, ListSerializer) and isinstance(
-                    field.child, serializers.ModelSerializer
-                ):
+        return pk, row
 
-                    if isinstance(attribute, BaseManager):
-                        attribute = attribute.all()
+    def collect_related(self, instances, nested_helper):
+        """
+        The relation-collection phase alone: collect the related instances
+        of `instances` into `nested_helper`, without serializing their other
+        fields.
 
-                    primary_object[field.field_name] = PrimaryKeyRelatedField(
-                        queryset=field.child.Meta.model.objects.all(), many=True
-                    ).to_representation(attribute)
+        Return, per instance, the values of its nested fields (pks, pk lists
+        or `None`), in field order.
+        """
+        nested_fields = [
+            (field, field_plan)
+            for field, field_plan in self._get_compiled_fields()
+            if field_plan.kind is not FieldKind.PRIMITIVE
+        ]
+        values = []
+        for instance in self.prefetch_nested_many(instances):
+            instance_values = []
+            for field, field_plan in nested_fields:
+                value = self._get_primary_value(
+                    instance, field, field_plan, nested_helper
+                )
+                instance_values.append(None if value is _SKIPPED else value)
+            values.append(instance_values)
+        return values
 
-                    nested_helper.add(
-                        field_name=field.field_name,
-                        model_class=field.child.Meta.model,
-                        serializer_class=field.child.__class__,
-                        # kwargs=field.kwargs,
-                        append_to_instance_cache=attribute,
-                    )
-                else:
-                    primary_object[field.field_name] = field.to_representation(
-                        attribute
+    def prefetch_nested_many(self, instances):
+        """
+        Load the related instances of the `many=True` nested fields (reverse
+        and many-to-many relations) of all `instances` at once, one query
+        per field with `prefetch_related_objects`, instead of one `.all()`
+        query per instance. Relations already prefetched (e.g. by the query
+        plan) are not loaded again.
+
+        Return `instances` as a list.
+        """
+        instances = list(instances)
+        lookups = self._get_nested_many_lookups()
+        if lookups and instances:
+            prefetch_related_objects(instances, *lookups)
+        return instances
+
+    def _get_nested_many_lookups(self):
+        """
+        The relations read by the `many=True` nested fields, computed once
+        per serializer instance. Other sources (e.g. properties) are left to
+        `get_attribute`.
+        """
+        if not hasattr(self, "_nested_many_lookups"):
+            model_class = self.Meta.model
+            self._nested_many_lookups = [
+                field.source
+                for field, field_plan in self._get_compiled_fields()
+                if field_plan.kind is FieldKind.NESTED_MANY
+                and len(field.source_attrs) == 1
+                and get_relation(model_class, field.source) is not None
+            ]
+        return self._nested_many_lookups
+
+    def _get_primary_value(self, instance, field, field_plan, nested_helper):
+        """
+        The primary representation of `field` of `instance`, or `_SKIPPED`.
+        """
+        foreign_key = field_plan.foreign_key
+        if foreign_key is not None:
+            # The pk is available locally, the related instance is only
+            # needed for `related_objects` and is loaded in bulk later
+            # unless it was already fetched (e.g. by `select_related`).
+            pk = getattr(instance, foreign_key.attname)
+            if pk is None:
+                pass
+            elif foreign_key.is_cached(instance):
+                nested_helper.add_nested_data(
+                    field_plan.field_name,
+                    field_plan.nested_data,
+                    [foreign_key.get_cached_value(instance)],
+                )
+            else:
+                nested_helper.add_nested_pk(
+                    field_plan.field_name, field_plan.nested_data, pk
+                )
+            return pk
+
+        try:
+            attribute = field.get_attribute(instance)
+        except SkipField:
+            return _SKIPPED
+
+        # We skip `to_representation` for `None` values so that fields do
+        # not have to explicitly deal with that case.
+        #
+        # For related fields with `use_pk_only_optimization` we need to
+        # resolve the pk value.
+        check_for_none = (
+            attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+        )
+        if check_for_none is None:
+            return None
+        if field_plan.kind is FieldKind.PRIMITIVE:
+            return field.to_representation(attribute)
+
+        if field_plan.kind is FieldKind.NESTED_MANY:
+            # Evaluate the relation once, so that its instances are not
+            # replaced when the helper accumulates instances of many items.
+            if isinstance(attribute, BaseManager):
+                attribute = attribute.all()
+            instances = list(attribute)
+        else:
+            instances = [attribute]
+
+        nested_helper.add_nested_data(
+            field_plan.field_name, field_plan.nested_data, instances
+        )
+        return field_plan.get_pk(instances)
+
+    def _get_compiled_fields(self):
+        """
+        Pairs of (readable field, `FieldPlan`), computed once per serializer
+        instance from the plan shared by its class.
+        """
+        if not hasattr(self, "_compiled_fields"):
+            fields = list(self._readable_fields)
+            plan = get_representation_plan(self, fields)
+            self._compiled_fields = list(zip(fields, plan.fields))
+        return self._compiled_fields
+
+    def to_related_representation(self, nested_helper, related_objects=None):
+        """
+        Serialize every related instance collected in `nested_helper` into
+        the `related_objects` registry (a new one when not given), and return
+        the registry.
+
+        Each related model is serialized once with `many=True`, no matter how
+        many primary instances contributed to the helper, and instances
+        already claimed in the registry (by another path of the serializer
+        tree) are skipped.
+
+        The related models are independent of each other: with
+        `Meta.parallel_related = True` (or a `parallel_related` context flag)
+        they are serialized on a thread pool. Worker threads have their own
+        database connections, outside of the transaction of this thread, so
+        everything that queries stays here: loading the instances, and
+        serializing the related models whose serializer reads relations of
+        its own (e.g. a nested `BetterModelSerializer`, which loads the next
+        level), in field order. Results are stored in field order too, so
+        the output is the same as in sequential mode.
+        """
+        if related_objects is None:
+            related_objects = RelatedObjectRegistry()
+
+        observer = get_observer(self.context)
+
+        with observe_phase(observer, self, Phase.COLLECT) as phase_event:
+            related_groups = self.get_related_groups(nested_helper, related_objects)
+            if phase_event is not None:
+                phase_event.instance_count = sum(
+                    related_group.instance_count for related_group in related_groups
+                )
+                phase_event.duplicates_dropped = sum(
+                    related_group.duplicates_dropped
+                    for related_group in related_groups
+                )
+
+        pooled_indexes = []
+        if len(related_groups) > 1 and self.context.get(
+            "parallel_related", getattr(self.Meta, "parallel_related", False)
+        ):
+            pooled_indexes = [
+                index
+                for index, related_group in enumerate(related_groups)
+                if not _reads_relations(related_group.serializer.child)
+            ]
+
+        if pooled_indexes:
+            max_workers = min(
+                len(pooled_indexes), get_setting("PARALLEL_RELATED_WORKERS")
+            )
+            results = [None] * len(related_groups)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    index: executor.submit(
+                        self._serialize_related_group_in_thread,
+                        related_groups[index],
+                        related_objects,
                     )
+                    for index in pooled_indexes
+                }
+                # Meanwhile, the groups that query are serialized here
+                for index, related_group in enumerate(related_groups):
+                    if index not in futures:
+                        results[index] = self.serialize_related_group(
+                            related_group, related_objects
+                        )
+                for index, future in futures.items():
+                    results[index] = future.result()
+        else:
+            results = [
+                self.serialize_related_group(related_group, related_objects)
+                for related_group in related_groups
+            ]
 
-        related_objects = {}
+        for related_group, serialized_objects in zip(related_groups, results):
+            if related_group.cache is not None:
+                related_group.cache.set_many(
+                    related_group.versions, serialized_objects
+                )
+            related_objects.add(
+                related_group.model_key,
+                related_group.cached_objects,
+                fields=related_group.fields,
+            )
+            related_objects.add(
+                related_group.model_key, serialized_objects, fields=related_group.fields
+            )
+
+        return related_objects
+
+    def get_related_groups(self, nested_helper, related_objects):
+        """
+        Claim, look up in the cache and load the related instances (or the
+        column values, see `ValuesPlan`) of `nested_helper`, one
+        `RelatedGroup` per (model, serializer). Every query of the related
+        level runs here, in the calling thread.
+        """
+        related_groups = []
+        serialized = set()
+        selection = get_field_selection(self.context)
+        limits = get_related_limits(self.context)
+        known_objects = get_known_objects(self.context)
+        too_deep = limits.is_too_deep(self.nesting_level + 1)
 
         for field_name, field_info in nested_helper.items():
-            model_name = f"{field_info.model_class._meta.app_label}_{field_info.model_class._meta.model_name}"
+            # Several fields may point at the same model, e.g. two foreign
+            # keys to Author; their instances share one cache entry and only
+            # need to be serialized once.
+            if (field_info.model_class, field_info.serializer_class) in serialized:
+                continue
+            serialized.add((field_info.model_class, field_info.serializer_class))
+
+            model_name = get_model_key(field_info.model_class)
+
+            # Beyond the depth limit, the pks collected so far are sent as
+            # references and nothing is loaded
+            if too_deep:
+                related_objects.add_refs(
+                    model_name, nested_helper.get_pks(field_info.model_class)
+                )
+                continue
 
-            serialized_data = field_info.serializer_class(
+            serializer = field_info.serializer_class(
                 many=True, context=self.context, **field_info.kwargs
-            ).to_representation(
-                data=nested_helper.get_model_instances(field_info.model_class)
             )
-            normalized_serialized_data = []
+            if selection is not None:
+                select_fields(
+                    serializer.child, selection.get_related_fields(model_name)
+                )
+            if isinstance(serializer.child, BetterModelSerializer):
+                serializer.child.nesting_level = self.nesting_level + 1
+
+            # Objects claimed by another path of the tree are neither loaded
+            # nor serialized again, nor are the ones beyond the limits
+            pks = nested_helper.get_pks(field_info.model_class)
+            new_pks, _ = related_objects.claim_within_limits(
+                model_name, pks, limits
+            )
+            exclude_pks = set(pks).difference(new_pks)
+
+            # Objects cached by a previous request are neither loaded nor
+            # serialized, nor are the ones the client already has. Objects
+            # whose serializer reads relations are always sent: their version
+            # does not cover their related objects.
+            cached_objects = {}
+            versions = {}
+            related_object_cache = get_related_object_cache(
+                serializer.child, field_info.model_class, related_objects.related_format
+            )
+            versioned_known_objects = (
+                known_objects
+                if known_objects is not None
+                and not _reads_relations(serializer.child)
+                else None
+            )
+            if new_pks and (
+                related_object_cache is not None
+                or versioned_known_objects is not None
+            ):
+                versions = get_object_versions(
+                    serializer.child,
+                    field_info.model_class,
+                    nested_helper.get_model_items(
+                        field_info.model_class, exclude_pks=exclude_pks
+                    ),
+                    related_object_cache,
+                ) or {}
+            if versions and versioned_known_objects is not None:
+                tags = {
+                    pk: get_version_tag(version) for pk, version in versions.items()
+                }
+                unchanged_pks = versioned_known_objects.get_unchanged(
+                    model_name, tags
+                )
+                exclude_pks.update(unchanged_pks)
+                for pk in unchanged_pks:
+                    del tags[pk]
+                    del versions[pk]
+                related_objects.add_versions(model_name, tags)
+            if not versions:
+                related_object_cache = None
+            if related_object_cache is not None:
+                cached_objects = related_object_cache.get_many(versions)
+                exclude_pks.update(cached_objects)
 
-            if issubclass(field_info.serializer_class, BetterModelSerializer):
-                related_objects = combine_related_objects(
-                    related_objects, serialized_data["related_objects"]
+            # Simple serializers read the pending objects with `values_list`
+            # instead of loading instances
+            values_plan = get_values_plan(serializer)
+            if values_plan is not None:
+                instances = []
+                values = values_plan.get_values(
+                    nested_helper.get_model_items(
+                        field_info.model_class, exclude_pks=exclude_pks
+                    ),
+                    field_info.model_class,
                 )
-                normalized_serialized_data.extend(serialized_data["object"])
             else:
-                normalized_serialized_data.extend(serialized_data)
+                instances = nested_helper.get_model_instances(
+                    field_info.model_class, exclude_pks=exclude_pks
+                )
+                values = None
 
-            related_objects[model_name] = {
-                _["id"]: _ for _ in normalized_serialized_data
-            }
+            related_groups.append(
+                RelatedGroup(
+                    model_key=model_name,
+                    serializer=serializer,
+                    instances=instances,
+                    cached_objects=cached_objects,
+                    cache=related_object_cache,
+                    versions=versions,
+                    duplicates_dropped=(
+                        nested_helper.get_reference_count(field_info.model_class)
+                        - len(new_pks)
+                    ),
+                    fields=(
+                        get_row_fields(serializer.child)
+                        if related_objects.related_format == COLUMNAR
+                        else None
+                    ),
+                    values_plan=values_plan,
+                    values=values,
+                )
+            )
 
-        return {"object": primary_object, "related_objects": related_objects}
+        return related_groups
+
+    def serialize_related_group(self, related_group, related_objects):
+        """
+        Serialize the instances of `related_group`, returning `{pk: dict}`
+        (`{pk: row}` in the columnar format).
+        """
+        serializer = related_group.serializer
+        instances = related_group.instances
+
+        with observe_phase(
+            get_observer(self.context),
+            self,
+            Phase.RELATED,
+            model_key=related_group.model_key,
+            instance_count=related_group.instance_count,
+            duplicates_dropped=related_group.duplicates_dropped,
+        ):
+            values_plan = related_group.values_plan
+            if values_plan is not None:
+                if related_group.fields is not None:
+                    return values_plan.values_to_rows(related_group.values)
+                return values_plan.values_to_representations(related_group.values)
+
+            if related_group.fields is not None:
+                return self._serialize_related_rows(
+                    related_group, related_objects
+                )
+
+            if isinstance(serializer, BetterListSerializer):
+                # Nested related objects are written to `related_objects`
+                # directly
+                normalized_serialized_data = serializer.to_normalized_representation(
+                    instances, related_objects
+                )
+            elif isinstance(serializer.child, BetterModelSerializer):
+                # The registry is found in the context, nothing to merge
+                normalized_serialized_data = serializer.to_representation(
+                    data=instances
+                )["object"]
+            else:
+                normalized_serialized_data = serializer.to_representation(
+                    data=instances
+                )
+
+        return {_["id"]: _ for _ in normalized_serialized_data}
+
+    def _serialize_related_rows(self, related_group, related_objects):
+        serializer = related_group.serializer
+        instances = related_group.instances
+
+        if isinstance(serializer, BetterListSerializer):
+            return serializer.to_normalized_rows(instances, related_objects)
+        if isinstance(serializer.child, BetterModelSerializer):
+            # A custom list serializer, its output is converted
+            return objects_to_rows(
+                related_group.fields,
+                serializer.to_representation(data=instances)["object"],
+            )
+        if (
+            type(serializer).to_representation
+            is serializers.ListSerializer.to_representation
+            and type(serializer.child).to_representation
+            is serializers.Serializer.to_representation
+        ):
+            # Rows are built from the fields of plain serializers, unless
+            # they customize their output
+            return serialize_rows(serializer.child, instances)
+        return objects_to_rows(
+            related_group.fields, serializer.to_representation(data=instances)
+        )
+
+    def _serialize_related_group_in_thread(self, related_group, related_objects):
+        try:
+            return self.serialize_related_group(related_group, related_objects)
+        finally:
+            # Worker threads get their own connections (if their fields query
+            # at all, e.g. `SerializerMethodField`s); do not leak them.
+            connections.close_all()
 
     @property
     def data(self):
-        ret = super().data
+        # `Serializer.data` would copy the payload into a `ReturnDict` once
+        # more
+        ret = serializers.BaseSerializer.data.fget(self)
         return ReturnDict(ret, serializer=self)
+
+    async def adata(self):
+        """
+        Async counterpart of `data`, for async views:
+        `await serializer.adata()`.
+        """
+        if not hasattr(self, "_data"):
+            self._data = await self.ato_representation(self.instance)
+        return ReturnDict(self._data, serializer=self)
@@ -0,0 +1,23 @@
+from django.http import StreamingHttpResponse
+
+
+def streaming_response(
+    serializer, chunk_size=2000, interleave_related=False, **response_kwargs
+):
+    """
+    Wrap `BetterListSerializer.iter_json_chunks` in a `StreamingHttpResponse`.
+
+    `serializer` must be a `many=True` serializer of `BetterModelSerializer`
+    (i.e. a `BetterListSerializer`). With `interleave_related=True` the body is
+    JSON Lines, otherwise a single JSON document.
+    """
+    response_kwargs.setdefault(
+        "content_type",
+        "application/x-ndjson" if interleave_related else "application/json",
+    )
+    return StreamingHttpResponse(
+        serializer.iter_json_chunks(
+            chunk_size=chunk_size, interleave_related=interleave_related
+        ),
+        **response_kwargs,
+    )
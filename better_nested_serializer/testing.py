@@ -0,0 +1,46 @@
+import contextlib
+import threading
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+from better_nested_serializer.observers import SerializationObserver
+
+
+class RecordingObserver(SerializationObserver):
+    """
+    Keep every `PhaseEvent` in `events`, e.g. to assert on them in tests.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        with self._lock:
+            self.events.append(event)
+
+
+class QueryAssertionsMixin:
+    """
+    Assertions for `django.test.TestCase` subclasses.
+    """
+
+    @contextlib.contextmanager
+    def assertMaxQueries(self, num, using="default"):
+        """
+        Fail if the block issues more than `num` queries on `using`.
+        """
+        with CaptureQueriesContext(connections[using]) as context:
+            yield context
+
+        executed = len(context.captured_queries)
+        if executed > num:
+            queries = "\n".join(
+                f"{index}. {query['sql']}"
+                for index, query in enumerate(context.captured_queries, start=1)
+            )
+            self.fail(
+                f"{executed} queries executed, at most {num} expected\n"
+                f"Captured queries were:\n{queries}"
+            )
@@ -0,0 +1,237 @@
+import dataclasses
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.query_utils import DeferredAttribute
+from rest_framework import fields, relations, serializers
+
+from better_nested_serializer.conf import get_setting
+from better_nested_serializer.fieldsets import PK_FIELD_NAME
+
+_INTEGER_TYPES = {
+    "AutoField",
+    "BigAutoField",
+    "SmallAutoField",
+    "IntegerField",
+    "BigIntegerField",
+    "SmallIntegerField",
+    "PositiveIntegerField",
+    "PositiveBigIntegerField",
+    "PositiveSmallIntegerField",
+}
+
+# Serializer fields whose `to_representation` returns the value unchanged
+# when it is read from a model field of one of the given internal types.
+_IDENTITY_CONVERSIONS = {
+    fields.IntegerField: _INTEGER_TYPES,
+    fields.CharField: {"CharField", "TextField", "SlugField", "EmailField", "URLField"},
+    fields.BooleanField: {"BooleanField"},
+    fields.FloatField: {"FloatField"},
+    fields.ReadOnlyField: None,  # Any internal type
+}
+# DRF >= 3.15 maps big integer columns to a `BigIntegerField`
+if hasattr(fields, "BigIntegerField"):
+    _IDENTITY_CONVERSIONS[fields.BigIntegerField] = _INTEGER_TYPES
+
+
+@dataclasses.dataclass(frozen=True)
+class ValuesPlan:
+    """
+    How to serialize the instances of a "simple" serializer from the values
+    of their columns, without model instances nor per-field
+    `get_attribute` calls.
+
+    `converters[i]` turns the value of `columns[i]` into the representation
+    of `field_names[i]`; `None` means the value is used as it is.
+    """
+
+    field_names: Tuple[str, ...]
+    columns: Tuple[str, ...]
+    converters: Tuple[Optional[Callable], ...]
+
+    def get_values(self, items, model_class):
+        """
+        The column values of `items`, `(pk, instance)` pairs whose instance
+        is `None` when it was not loaded: those are read in a single
+        `values_list` query. Dangling pks are left out.
+        """
+        pending_pks = [pk for pk, instance in items if instance is None]
+        pending_values = {}
+        if pending_pks:
+            pk_index = self.field_names.index(PK_FIELD_NAME)
+            pending_values = {
+                values[pk_index]: values
+                for values in model_class._base_manager.filter(
+                    pk__in=pending_pks
+                ).values_list(*self.columns)
+            }
+
+        all_values = []
+        for pk, instance in items:
+            if instance is None:
+                values = pending_values.get(pk)
+                if values is not None:
+                    all_values.append(values)
+            else:
+                all_values.append(
+                    tuple(getattr(instance, column) for column in self.columns)
+                )
+        return all_values
+
+    def to_representations(self, items, model_class) -> Dict[Any, dict]:
+        """
+        `{pk: dict}` of `items` (see `get_values`).
+        """
+        return self.values_to_representations(self.get_values(items, model_class))
+
+    def values_to_representations(self, all_values) -> Dict[Any, dict]:
+        """
+        `{pk: dict}` of column values returned by `get_values`. Does not
+        query.
+        """
+        field_names = self.field_names
+        converters = self.converters
+        objects = {}
+
+        for values in all_values:
+            obj = {}
+            for field_name, converter, value in zip(field_names, converters, values):
+                obj[field_name] = (
+                    value
+                    if converter is None or value is None
+                    else converter(value)
+                )
+            objects[obj[PK_FIELD_NAME]] = obj
+
+        return objects
+
+    def to_rows(self, items, model_class) -> Dict[Any, list]:
+        """
+        `{pk: row}` of `items`, in the columnar format (see `get_row_fields`).
+        """
+        return self.values_to_rows(self.get_values(items, model_class))
+
+    def values_to_rows(self, all_values) -> Dict[Any, list]:
+        """
+        `{pk: row}` of column values returned by `get_values`. Does not
+        query.
+        """
+        pk_index = self.field_names.index(PK_FIELD_NAME)
+        converters = self.converters
+        rows = {}
+
+        for values in all_values:
+            row = [
+                value if converter is None or value is None else converter(value)
+                for converter, value in zip(converters, values)
+            ]
+            pk = row.pop(pk_index)
+            rows[pk] = row
+
+        return rows
+
+
+# `(column, whether the value needs a conversion)`, or `None` when the field
+# is not eligible, by serializer class, field name and field type: bounded by
+# the declared fields, whichever subsets of them clients select
+_compiled_fields: Dict[tuple, Optional[tuple]] = {}
+
+
+def _is_overridden(obj, cls, name):
+    return getattr(type(obj), name) is not getattr(cls, name)
+
+
+def _compile_field(model_class, field):
+    """
+    The `(column, needs_conversion)` of `field`, or `None` when its value
+    cannot be read from a column.
+    """
+    if (
+        isinstance(field, (serializers.BaseSerializer, relations.ManyRelatedField))
+        or field.source == "*"
+        or len(field.source_attrs) != 1
+    ):
+        return None
+
+    try:
+        model_field = model_class._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        return None
+    if not model_field.concrete:
+        return None
+
+    if isinstance(field, relations.RelatedField):
+        if (
+            type(field) is not relations.PrimaryKeyRelatedField
+            or field.pk_field is not None
+            or not (model_field.many_to_one or model_field.one_to_one)
+            or not model_field.target_field.primary_key
+        ):
+            return None
+        # The pk of the related object is the foreign key column
+        return model_field.attname, False
+
+    if model_field.is_relation or _is_overridden(field, fields.Field, "get_attribute"):
+        return None
+    # Fields whose attribute is not the column value (e.g. the `FieldFile` of
+    # a `FileField`) need instances
+    if model_field.descriptor_class is not DeferredAttribute:
+        return None
+
+    internal_types = _IDENTITY_CONVERSIONS.get(type(field), ())
+    return model_field.attname, not (
+        internal_types is None or model_field.get_internal_type() in internal_types
+    )
+
+
+def get_values_plan(list_serializer) -> Optional[ValuesPlan]:
+    """
+    The `ValuesPlan` of the child of `list_serializer` (a `many=True`
+    serializer), or `None` when it is not simple enough:
+
+    - plain `ModelSerializer` and list serializer, without a custom
+      `to_representation`;
+    - only concrete model fields (foreign keys as `PrimaryKeyRelatedField`)
+      whose attribute is the column value (no `FileField`...), no method
+      fields, nested serializers or dotted sources;
+    - an `id` field.
+
+    Opt out with `Meta.values_fast_path = False`, or the `VALUES_FAST_PATH`
+    setting. Eligibility and columns are cached by serializer class and
+    field; the converters are the `to_representation` of the fields of
+    `list_serializer`, which may depend on its context.
+    """
+    serializer = getattr(list_serializer, "child", None)
+    if (
+        not isinstance(serializer, serializers.ModelSerializer)
+        or _is_overridden(
+            list_serializer, serializers.ListSerializer, "to_representation"
+        )
+        or _is_overridden(serializer, serializers.Serializer, "to_representation")
+        or not getattr(serializer.Meta, "values_fast_path", True)
+        or not get_setting("VALUES_FAST_PATH")
+    ):
+        return None
+
+    readable_fields = list(serializer._readable_fields)
+    if PK_FIELD_NAME not in (field.field_name for field in readable_fields):
+        return None
+
+    compiled_fields = []
+    for field in readable_fields:
+        key = (serializer.__class__, field.field_name, field.__class__)
+        if key not in _compiled_fields:
+            _compiled_fields[key] = _compile_field(serializer.Meta.model, field)
+        compiled_field = _compiled_fields[key]
+        if compiled_field is None:
+            return None
+        compiled_fields.append(compiled_field)
+
+    return ValuesPlan(
+        field_names=tuple(field.field_name for field in readable_fields),
+        columns=tuple(column for column, _ in compiled_fields),
+        converters=tuple(
+            field.to_representation if needs_conversion else None
+            for field, (_, needs_conversion) in zip(readable_fields, compiled_fields)
+        ),
+    )
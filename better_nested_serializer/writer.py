@@ -0,0 +1,479 @@
+import dataclasses
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import router, transaction
+from django.db.models import Field, Model
+from rest_framework import relations, serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import SkipField, empty
+from rest_framework.validators import UniqueValidator
+
+from better_nested_serializer.fieldsets import PK_FIELD_NAME
+from better_nested_serializer.formats import decode_columnar
+from better_nested_serializer.helpers import get_model_key
+from better_nested_serializer.query_plan import get_relation
+from better_nested_serializer.serializers.model_serializer import BetterModelSerializer
+
+# Pks per existence query and rows per `bulk_create` / `bulk_update` query
+DEFAULT_BATCH_SIZE = 1000
+
+
+@dataclasses.dataclass(frozen=True)
+class ForeignKeyPlan:
+    field_name: str
+    model_field: Field
+    # Model key of the referenced objects
+    model_key: str
+
+
+@dataclasses.dataclass
+class ModelWritePlan:
+    """
+    How the objects of one model key are validated and written: the
+    writable `(field_name, field, attribute)` of its serializer and its
+    foreign keys, written as pks.
+
+    Read-only foreign keys are not written, unless their field is in
+    `Meta.writable_nested_fields`: nested serializers are usually declared
+    `read_only=True`, which only concerns `serializers.Serializer` writes.
+    """
+
+    model_class: Type[Model]
+    fields: List[Tuple[str, serializers.Field, str]]
+    foreign_keys: List[ForeignKeyPlan]
+
+    @classmethod
+    def from_serializer(cls, serializer):
+        model_class = serializer.Meta.model
+        # Nested serializers of other serializers embed their objects
+        normalized = isinstance(serializer, BetterModelSerializer)
+        writable_nested_fields = getattr(
+            serializer.Meta, "writable_nested_fields", ()
+        )
+        fields = []
+        foreign_keys = []
+
+        for field_name, field in serializer.fields.items():
+            if (
+                field_name == PK_FIELD_NAME
+                or field.source == "*"
+                or (isinstance(field, serializers.BaseSerializer) and not normalized)
+            ):
+                continue
+            model_field = _get_foreign_key(model_class, field)
+            if model_field is not None:
+                if field.read_only and field_name not in writable_nested_fields:
+                    continue
+                foreign_keys.append(
+                    ForeignKeyPlan(
+                        field_name,
+                        model_field,
+                        get_model_key(model_field.related_model),
+                    )
+                )
+            elif not field.read_only and _is_column(model_class, field):
+                fields.append((field_name, field, field.source))
+
+        return cls(model_class, fields, foreign_keys)
+
+    def validate(self, data, creating) -> Tuple[Dict[str, Any], Dict[str, list]]:
+        """
+        The model attributes of the object `data` and its field errors. A
+        missing field is an error when `creating` only; foreign keys are
+        checked for existence by the writer.
+        """
+        attrs = {}
+        errors = {}
+
+        for field_name, field, attribute in self.fields:
+            value = data.get(field_name, empty)
+            if value is empty and not creating:
+                continue
+            try:
+                attrs[attribute] = _run_field_validation(field, value)
+            except SkipField:
+                pass
+            except ValidationError as exc:
+                errors[field_name] = exc.detail
+            except DjangoValidationError as exc:
+                errors[field_name] = list(exc.messages)
+
+        for foreign_key in self.foreign_keys:
+            value = data.get(foreign_key.field_name, empty)
+            if value is empty:
+                if creating and not foreign_key.model_field.null:
+                    errors[foreign_key.field_name] = ["This field is required."]
+                continue
+            if value is None:
+                if not foreign_key.model_field.null:
+                    errors[foreign_key.field_name] = ["This field may not be null."]
+                    continue
+                attrs[foreign_key.model_field.attname] = None
+                continue
+            try:
+                attrs[foreign_key.model_field.attname] = (
+                    foreign_key.model_field.target_field.to_python(value)
+                )
+            except DjangoValidationError as exc:
+                errors[foreign_key.field_name] = list(exc.messages)
+
+        return attrs, errors
+
+
+def _get_foreign_key(model_class, field) -> Optional[Field]:
+    """
+    The forward foreign key (or one-to-one) that `field` reads, when it is a
+    nested serializer or a pk related field.
+    """
+    if not isinstance(
+        field, (serializers.ModelSerializer, relations.PrimaryKeyRelatedField)
+    ) or len(field.source_attrs) != 1:
+        return None
+    relation = get_relation(model_class, field.source)
+    if (
+        relation is None
+        or not relation.concrete
+        or not (relation.many_to_one or relation.one_to_one)
+        or not relation.target_field.primary_key
+    ):
+        return None
+    return relation
+
+
+def _is_column(model_class, field) -> bool:
+    """
+    Whether `field` reads a concrete, non relational, model field.
+    """
+    if isinstance(
+        field,
+        (
+            serializers.BaseSerializer,
+            relations.RelatedField,
+            relations.ManyRelatedField,
+        ),
+    ) or len(field.source_attrs) != 1:
+        return False
+    try:
+        model_field = model_class._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        return False
+    return model_field.concrete and not model_field.is_relation
+
+
+def _run_field_validation(field, value):
+    """
+    `field.run_validation(value)`, but for `UniqueValidator`s, which would
+    query once per object: uniqueness is left to the database.
+    """
+    is_empty_value, value = field.validate_empty_values(value)
+    if is_empty_value:
+        return value
+
+    value = field.to_internal_value(value)
+    errors = []
+    for validator in field.validators:
+        if isinstance(validator, UniqueValidator):
+            continue
+        try:
+            if getattr(validator, "requires_context", False):
+                validator(value, field)
+            else:
+                validator(value)
+        except ValidationError as exc:
+            errors.extend(exc.detail if isinstance(exc.detail, list) else [exc.detail])
+        except DjangoValidationError as exc:
+            errors.extend(exc.messages)
+    if errors:
+        raise ValidationError(errors)
+    return value
+
+
+def get_write_plans(serializer) -> Dict[str, ModelWritePlan]:
+    """
+    The `ModelWritePlan` of every model key `serializer` (a
+    `BetterModelSerializer`) writes: its own and the ones of its normalized
+    nested serializers, recursively. The first serializer found for a
+    model key is used.
+    """
+    plans = {}
+    pending = [serializer]
+    while pending:
+        serializer = pending.pop(0)
+        model_key = get_model_key(serializer.Meta.model)
+        if model_key in plans:
+            continue
+        plans[model_key] = ModelWritePlan.from_serializer(serializer)
+
+        # Only the nested serializers of a `BetterModelSerializer` produce
+        # related objects; the others are embedded
+        if not isinstance(serializer, BetterModelSerializer):
+            continue
+        for field in serializer.fields.values():
+            if isinstance(field, serializers.ListSerializer):
+                field = field.child
+            if isinstance(field, serializers.ModelSerializer):
+                pending.append(field)
+
+    return plans
+
+
+def _get_write_order(plans: Dict[str, ModelWritePlan], model_keys) -> List[str]:
+    """
+    `model_keys` ordered so that referenced models come first. Cycles keep
+    the payload order (and rely on deferred foreign key constraints).
+    """
+    ordered = []
+    visiting = set()
+
+    def visit(model_key):
+        if model_key in ordered or model_key in visiting:
+            return
+        visiting.add(model_key)
+        for foreign_key in plans[model_key].foreign_keys:
+            if foreign_key.model_key in model_keys:
+                visit(foreign_key.model_key)
+        visiting.discard(model_key)
+        ordered.append(model_key)
+
+    for model_key in model_keys:
+        visit(model_key)
+    return ordered
+
+
+def _batches(items, batch_size):
+    items = list(items)
+    for start in range(0, len(items), batch_size):
+        yield items[start : start + batch_size]
+
+
+@dataclasses.dataclass
+class WriteResult:
+    """
+    The pks created and updated by a `NormalizedWriter`, by model key.
+    """
+
+    created: Dict[str, list] = dataclasses.field(default_factory=dict)
+    updated: Dict[str, list] = dataclasses.field(default_factory=dict)
+
+
+class NormalizedWriter:
+    """
+    Validate and write a `{"object", "related_objects"}` payload (the output
+    of `serializer_class`, a `BetterModelSerializer`) in bulk.
+
+    Every object is validated once per (model, pk), with the fields of the
+    serializer of its model key; nested fields are written as the foreign
+    key pks they hold. Objects whose pk exists are updated with the fields
+    they have, the others (and primary objects without `id`) are created.
+    Everything is written in one transaction with `bulk_create` /
+    `bulk_update`, model by model, referenced models first: a few queries
+    per model and `batch_size` objects, whatever the number of references.
+
+    Like `serializers.Serializer`:
+    ```
+    writer = NormalizedWriter(BlogSerializer, data=payload)
+    writer.is_valid(raise_exception=True)
+    writer.save()
+    ```
+
+    Reverse and many-to-many fields are not written (reverse relations are
+    written through the foreign keys of the related objects), nor are
+    serializer `validate` methods and unique validators run: uniqueness is
+    checked by the database.
+    """
+
+    def __init__(
+        self, serializer_class, data, context=None, batch_size=DEFAULT_BATCH_SIZE
+    ):
+        self.serializer_class = serializer_class
+        self.initial_data = data
+        self.context = context or {}
+        self.batch_size = batch_size
+        self.serializer = serializer_class(context=self.context)
+        self.plans = get_write_plans(self.serializer)
+        self._errors = None
+        self._validated_objects = None
+
+    @property
+    def model_class(self):
+        return self.serializer.Meta.model
+
+    @property
+    def errors(self):
+        if self._errors is None:
+            raise AssertionError(
+                "You must call `.is_valid()` before accessing `.errors`."
+            )
+        return self._errors
+
+    def _get_objects(self):
+        """
+        `{model_key: {pk: data}}` of the payload, the primary objects without
+        pk apart: `(objects, new_primary_objects)`.
+        """
+        related_objects = self.initial_data.get("related_objects") or {}
+        if any(
+            isinstance(table, dict) and "rows" in table and "ids" in table
+            for table in related_objects.values()
+        ):
+            related_objects = decode_columnar(related_objects)
+
+        objects = {
+            model_key: dict(objects) for model_key, objects in related_objects.items()
+        }
+        primary_objects = self.initial_data.get("object")
+        if isinstance(primary_objects, dict):
+            primary_objects = [primary_objects]
+
+        new_primary_objects = []
+        primary_key = get_model_key(self.model_class)
+        for data in primary_objects or []:
+            if data.get(PK_FIELD_NAME) is None:
+                new_primary_objects.append(data)
+            else:
+                objects.setdefault(primary_key, {})[data[PK_FIELD_NAME]] = data
+        return objects, new_primary_objects
+
+    def _get_existing_pks(self, model_class, pks) -> set:
+        existing = set()
+        for batch in _batches(pks, self.batch_size):
+            existing.update(
+                model_class._base_manager.filter(pk__in=batch).values_list(
+                    "pk", flat=True
+                )
+            )
+        return existing
+
+    def is_valid(self, raise_exception=False) -> bool:
+        """
+        Validate the payload. The errors are keyed by section:
+        `unknown_models` (model keys no serializer of the tree writes),
+        `objects` (`{model_key: {pk: field errors}}`), `new_objects` (the
+        primary objects without pk, by index) and `missing_references`
+        (`{model_key: pks}` referenced but neither in the payload nor in the
+        database).
+        """
+        errors = {}
+        validated = {}
+        objects, new_primary_objects = self._get_objects()
+
+        unknown = sorted(set(objects).difference(self.plans))
+        if unknown:
+            errors["unknown_models"] = unknown
+
+        # Pks of the payload, converted to their python type (JSON object
+        # keys are strings)
+        payload_pks = {}
+        for model_key in objects.keys() - set(unknown):
+            pk_field = self.plans[model_key].model_class._meta.pk
+            converted = payload_pks[model_key] = {}
+            for pk, data in objects[model_key].items():
+                try:
+                    converted[pk_field.to_python(pk)] = data
+                except DjangoValidationError as exc:
+                    errors.setdefault("objects", {}).setdefault(model_key, {})[
+                        pk
+                    ] = {PK_FIELD_NAME: list(exc.messages)}
+
+        # Each (model, pk) is validated once, references are checked in bulk
+        references = {}
+        for model_key, objects_by_pk in payload_pks.items():
+            plan = self.plans[model_key]
+            existing_pks = self._get_existing_pks(plan.model_class, objects_by_pk)
+            validated_objects = validated[model_key] = {}
+            for pk, data in objects_by_pk.items():
+                creating = pk not in existing_pks
+                attrs, object_errors = plan.validate(data, creating)
+                if object_errors:
+                    errors.setdefault("objects", {}).setdefault(model_key, {})[
+                        pk
+                    ] = object_errors
+                    continue
+                validated_objects[pk] = (creating, attrs)
+                self._add_references(plan, attrs, references)
+
+        primary_plan = self.plans[get_model_key(self.model_class)]
+        new_objects = []
+        for index, data in enumerate(new_primary_objects):
+            attrs, object_errors = primary_plan.validate(data, creating=True)
+            if object_errors:
+                errors.setdefault("new_objects", {})[index] = object_errors
+                continue
+            new_objects.append(attrs)
+            self._add_references(primary_plan, attrs, references)
+
+        for model_key, (model_class, pks) in references.items():
+            missing = pks.difference(payload_pks.get(model_key, ()))
+            if missing:
+                missing.difference_update(self._get_existing_pks(model_class, missing))
+            if missing:
+                errors.setdefault("missing_references", {})[model_key] = sorted(
+                    missing, key=str
+                )
+
+        self._errors = errors
+        self._validated_objects = None if errors else (validated, new_objects)
+        if errors and raise_exception:
+            raise ValidationError(errors)
+        return not errors
+
+    @staticmethod
+    def _add_references(plan, attrs, references):
+        for foreign_key in plan.foreign_keys:
+            pk = attrs.get(foreign_key.model_field.attname)
+            if pk is not None:
+                references.setdefault(
+                    foreign_key.model_key,
+                    (foreign_key.model_field.related_model, set()),
+                )[1].add(pk)
+
+    def save(self) -> WriteResult:
+        """
+        Write the validated objects, referenced models first, in one
+        transaction.
+        """
+        if self._validated_objects is None:
+            raise AssertionError(
+                "You must call `.is_valid()` with a valid payload before `.save()`."
+            )
+        validated, new_objects = self._validated_objects
+        primary_key = get_model_key(self.model_class)
+        result = WriteResult()
+
+        model_keys = list(validated)
+        if new_objects and primary_key not in model_keys:
+            model_keys.append(primary_key)
+
+        with transaction.atomic(using=router.db_for_write(self.model_class)):
+            for model_key in _get_write_order(self.plans, model_keys):
+                model_class = self.plans[model_key].model_class
+                creates = []
+                updates = {}
+                for pk, (creating, attrs) in validated.get(model_key, {}).items():
+                    instance = model_class(pk=pk, **attrs)
+                    if creating:
+                        creates.append(instance)
+                    elif attrs:
+                        # `bulk_update` writes one field list per call
+                        updates.setdefault(tuple(sorted(attrs)), []).append(
+                            instance
+                        )
+                if model_key == primary_key:
+                    creates.extend(model_class(**attrs) for attrs in new_objects)
+
+                if creates:
+                    model_class._base_manager.bulk_create(
+                        creates, batch_size=self.batch_size
+                    )
+                    result.created[model_key] = [instance.pk for instance in creates]
+                for fields, instances in updates.items():
+                    model_class._base_manager.bulk_update(
+                        instances, fields, batch_size=self.batch_size
+                    )
+                    result.updated.setdefault(model_key, []).extend(
+                        instance.pk for instance in instances
+                    )
+
+        return result
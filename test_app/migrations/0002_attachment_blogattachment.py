@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Attachment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='attachments')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BlogAttachment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attachment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='test_app.attachment')),
+                ('blog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='test_app.blog')),
+            ],
+        ),
+    ]
@@ -21,3 +21,12 @@ class Comment(models.Model):
     blog = models.ForeignKey(Blog, related_name='comments', on_delete=models.CASCADE)
     text = models.TextField()
     author = models.ForeignKey(Author, on_delete=models.CASCADE)
+
+
+class Attachment(models.Model):
+    file = models.FileField(upload_to='attachments')
+
+
+class BlogAttachment(models.Model):
+    blog = models.ForeignKey(Blog, on_delete=models.CASCADE)
+    attachment = models.ForeignKey(Attachment, on_delete=models.CASCADE)
@@ -2,7 +2,7 @@
 from rest_framework import serializers
 
 from better_nested_serializer.serializers.model_serializer import BetterModelSerializer
-from test_app.models import Author, Blog, Publisher
+from test_app.models import Attachment, Author, Blog, BlogAttachment, Comment, Publisher
 
 
 class PublisherSerializer(BetterModelSerializer):
@@ -17,6 +17,25 @@ class AuthorSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class AuthorWithTextAgeSerializer(serializers.ModelSerializer):
+    age = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Author
+        fields = '__all__'
+
+
+class AuthorWithInitialsSerializer(serializers.ModelSerializer):
+    initials = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Author
+        fields = '__all__'
+
+    def get_initials(self, author):
+        return author.name[:1]
+
+
 class BlogSerializerWithAuthorAndPublisher(BetterModelSerializer):
     author = AuthorSerializer(read_only=True)
     publisher = PublisherSerializer(read_only=True)
@@ -24,6 +43,7 @@ class BlogSerializerWithAuthorAndPublisher(BetterModelSerializer):
     class Meta:
         model = Blog
         fields = '__all__'
+        writable_nested_fields = ('author', 'publisher')
 
 
 class BlogSerializerWithAuthor(BetterModelSerializer):
@@ -33,6 +53,15 @@ class BlogSerializerWithAuthor(BetterModelSerializer):
         model = Blog
         fields = '__all__'
 
+class BlogSerializerWithReadOnlyRelations(BetterModelSerializer):
+    author = AuthorSerializer(read_only=True)
+
+    class Meta:
+        model = Blog
+        fields = '__all__'
+        read_only_fields = ('publisher',)
+
+
 class BlogSerializerWithPublisher(BetterModelSerializer):
     publisher = PublisherSerializer(read_only=True)
 
@@ -47,3 +76,92 @@ class AuthorWithAllBlogsSerializer(BetterModelSerializer):
     class Meta:
         model = Author
         fields = '__all__'
+
+
+class AuthorWithAllBlogsAutoOptimizedSerializer(AuthorWithAllBlogsSerializer):
+
+    class Meta(AuthorWithAllBlogsSerializer.Meta):
+        auto_optimize_queryset = True
+
+
+class CachedAuthorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Author
+        fields = '__all__'
+        related_cache = True
+
+
+class BlogSerializerWithCachedAuthor(BetterModelSerializer):
+    author = CachedAuthorSerializer(read_only=True)
+
+    class Meta:
+        model = Blog
+        fields = '__all__'
+
+
+class VersionedAuthorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Author
+        fields = '__all__'
+        # Stands in for an `updated_at` column
+        related_cache_version_field = 'age'
+
+
+class BlogSerializerWithVersionedAuthor(BetterModelSerializer):
+    author = VersionedAuthorSerializer(read_only=True)
+
+    class Meta:
+        model = Blog
+        fields = '__all__'
+
+
+class VersionedBlogSerializer(BetterModelSerializer):
+    author = AuthorSerializer(read_only=True)
+
+    class Meta:
+        model = Blog
+        fields = '__all__'
+        # Stands in for an `updated_at` column
+        related_cache_version_field = 'title'
+
+
+class CommentSerializerWithVersionedBlog(BetterModelSerializer):
+    blog = VersionedBlogSerializer(read_only=True)
+
+    class Meta:
+        model = Comment
+        fields = '__all__'
+
+
+class ColumnarBlogSerializer(BetterModelSerializer):
+    author = AuthorSerializer(read_only=True)
+    publisher = PublisherSerializer(read_only=True)
+
+    class Meta:
+        model = Blog
+        fields = '__all__'
+        related_format = 'columnar'
+        writable_nested_fields = ('author', 'publisher')
+
+
+class CommentSerializer(BetterModelSerializer):
+    blog = BlogSerializerWithAuthor(read_only=True)
+    author = AuthorSerializer(read_only=True)
+
+    class Meta:
+        model = Comment
+        fields = '__all__'
+
+
+class AttachmentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Attachment
+        fields = '__all__'
+
+
+class BlogAttachmentSerializer(BetterModelSerializer):
+    attachment = AttachmentSerializer(read_only=True)
+
+    class Meta:
+        model = BlogAttachment
+        fields = '__all__'
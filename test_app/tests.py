@@ -1,11 +1,45 @@
+import datetime
+import decimal
+import io
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
 import unittest
+from unittest import mock
 
 import django
+from asgiref.sync import async_to_sync, sync_to_async
 from deepdiff import DeepDiff
 from django.conf import settings
-from django.test import TestCase
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.exceptions import ValidationError
 
-from better_nested_serializer.helpers import combine_related_objects
+from better_nested_serializer.cache import (
+    get_cache,
+    get_token_cache,
+    get_version_tokens,
+)
+from better_nested_serializer.export import get_pk_ranges
+from better_nested_serializer import field_plan, values
+from better_nested_serializer.field_plan import FieldKind
+from better_nested_serializer.fieldsets import FieldSelection, select_fields
+from better_nested_serializer.formats import combine_columnar, decode_columnar
+from better_nested_serializer.helpers import (
+    RelatedObjectRegistry,
+    combine_related_objects,
+)
+from better_nested_serializer.known_objects import KnownObjects, get_version_tag
+from better_nested_serializer.limits import RelatedLimits
+from better_nested_serializer.observers import Phase
+from better_nested_serializer.streaming import streaming_response
+from better_nested_serializer.testing import QueryAssertionsMixin, RecordingObserver
+from better_nested_serializer.values import get_values_plan
 from test_app.services import normalize_serializer_payload
 
 # Configure Django settings before importing models
@@ -14,14 +48,27 @@ if not settings.configured:
         DATABASES={
             "default": {
                 "ENGINE": "django.db.backends.sqlite3",
-                "NAME": ":memory:",
+                # On disk, so that worker processes and threads share it
+                "NAME": os.path.join(tempfile.mkdtemp(), "db.sqlite3"),
             }
         },
         INSTALLED_APPS=[
             "django.contrib.contenttypes",
             "django.contrib.auth",
+            "better_nested_serializer",
             "test_app",
         ],
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            },
+            # Stands in for a cache shared by processes (Redis, Memcached...)
+            "shared": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": tempfile.mkdtemp(),
+                "OPTIONS": {"MAX_ENTRIES": 100000},
+            },
+        },
         USE_TZ=True,
         SECRET_KEY="test-secret-key",
     )
@@ -33,11 +80,44 @@ from django.core.management import call_command
 call_command("makemigrations", verbosity=1)
 call_command("migrate", verbosity=1)
 
-from test_app.models import Author, Publisher, Blog
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework import generics
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIRequestFactory
+
+from better_nested_serializer import renderers
+from better_nested_serializer.etags import (
+    GraphETagMixin,
+    get_graph_fingerprint,
+    get_versions,
+)
+from better_nested_serializer.pagination import (
+    BetterCursorPagination,
+    decode_pk_sets,
+    encode_pk_sets,
+)
+from better_nested_serializer.writer import NormalizedWriter
+from test_app.models import Attachment, Author, Publisher, Blog, BlogAttachment, Comment
 from test_app.serializers import (
+    AttachmentSerializer,
+    BlogAttachmentSerializer,
+    AuthorSerializer,
     BlogSerializerWithAuthorAndPublisher,
     BlogSerializerWithAuthor,
+    BlogSerializerWithReadOnlyRelations,
     AuthorWithAllBlogsSerializer,
+    AuthorWithAllBlogsAutoOptimizedSerializer,
+    BlogSerializerWithCachedAuthor,
+    CachedAuthorSerializer,
+    AuthorWithInitialsSerializer,
+    AuthorWithTextAgeSerializer,
+    ColumnarBlogSerializer,
+    CommentSerializer,
+    CommentSerializerWithVersionedBlog,
+    BlogSerializerWithVersionedAuthor,
+    VersionedAuthorSerializer,
+    PublisherSerializer,
 )
 
 
@@ -96,6 +176,26 @@ class TestBetterModelSerializerBasic(TestCase):
             """,
         )
 
+    def test_combine_related_objects_merges_by_pk_in_place(self):
+        related_objects = {"a": {1: {"id": 1, "name": "Alice"}}}
+        child_related_objects = {
+            "a": {1: {"id": 1, "name": "Alice B."}, 2: {"id": 2, "name": "Bob"}},
+            "b": {3: {"id": 3}},
+        }
+
+        combined = combine_related_objects(related_objects, child_related_objects)
+
+        self.assertIs(combined, related_objects)
+        self.assertEqual(
+            combined,
+            {
+                "a": {1: {"id": 1, "name": "Alice B."}, 2: {"id": 2, "name": "Bob"}},
+                "b": {3: {"id": 3}},
+            },
+        )
+        # The child's dicts are not shared with the result
+        self.assertIsNot(combined["b"], child_related_objects["b"])
+
     def test_basic_serialization_returns_expected_dict_and_related_ids(self):
         # Arrange
         serializer = BlogSerializerWithAuthorAndPublisher(instance=self.blog)
@@ -266,6 +366,1826 @@ class TestBetterModelSerializerBasic(TestCase):
             """,
         )
 
+    def test_empty_reverse_relation_does_not_load_whole_table(self):
+        author_without_blogs = Author.objects.create(name="Carol", age=41)
+
+        serializer = AuthorWithAllBlogsSerializer(instance=author_without_blogs)
+        with CaptureQueriesContext(connection) as queries:
+            data = normalize_serializer_payload(serializer.data)
+
+        self.assertEqual(data["object"]["blogs"], [])
+        self.assertEqual(data["related_objects"]["test_app_blog"], {})
+        self.assertNotIn("test_app_publisher", data["related_objects"])
+
+        for query in queries.captured_queries:
+            self.assertIn("WHERE", query["sql"], query["sql"])
+
+    def test_shared_related_object_is_serialized_once(self):
+        for index in range(5):
+            Blog.objects.create(
+                title=f"Blog {index}",
+                content="Content",
+                author=self.author,
+                publisher=self.publisher,
+            )
+
+        serializer = BlogSerializerWithAuthorAndPublisher(
+            instance=Blog.objects.all(), many=True
+        )
+        with mock.patch.object(
+            AuthorSerializer,
+            "to_representation",
+            autospec=True,
+            side_effect=lambda _, instance: {"id": instance.pk},
+        ) as author_to_representation:
+            data = normalize_serializer_payload(serializer.data)
+
+        self.assertEqual(len(data["object"]), 6)
+        self.assertEqual(author_to_representation.call_count, 1)
+        self.assertEqual(
+            data["related_objects"]["test_app_author"],
+            {self.author.id: {"id": self.author.id}},
+        )
+
+    def test_object_reached_by_several_paths_is_serialized_once(self):
+        Comment.objects.create(blog=self.blog, text="Nice", author=self.author)
+
+        serializer = CommentSerializer(instance=Comment.objects.all(), many=True)
+        with mock.patch.object(
+            AuthorSerializer,
+            "to_representation",
+            autospec=True,
+            side_effect=lambda _, instance: {"id": instance.pk},
+        ) as author_to_representation:
+            data = normalize_serializer_payload(serializer.data)
+
+        self.assertEqual(author_to_representation.call_count, 1)
+        self.assertEqual(
+            data["related_objects"]["test_app_author"],
+            {self.author.id: {"id": self.author.id}},
+        )
+        self.assertEqual(list(data["related_objects"]["test_app_blog"]), [self.blog.id])
+        # The registry only lives for the duration of the serialization
+        self.assertNotIn(RelatedObjectRegistry.context_key, serializer.context)
+
+    def test_list_serialization_collects_related_objects_of_all_items(self):
+        author_2 = Author.objects.create(name="Bob", age=35)
+        publisher_2 = Publisher.objects.create(name="Daily News")
+        blog_2 = Blog.objects.create(
+            title="Blog 2",
+            content="Content 2",
+            author=author_2,
+            publisher=publisher_2,
+        )
+        blog_3 = Blog.objects.create(
+            title="Blog 3",
+            content="Content 3",
+            author=author_2,
+            publisher=self.publisher,
+        )
+
+        serializer = AuthorWithAllBlogsSerializer(
+            instance=Author.objects.order_by("id"), many=True
+        )
+        data = normalize_serializer_payload(serializer.data)
+
+        self.assertEqual(
+            [_["blogs"] for _ in data["object"]],
+            [[self.blog.id], [blog_2.id, blog_3.id]],
+        )
+        self.assertEqual(
+            set(data["related_objects"]["test_app_blog"]),
+            {self.blog.id, blog_2.id, blog_3.id},
+        )
+        self.assertEqual(
+            set(data["related_objects"]["test_app_publisher"]),
+            {self.publisher.id, publisher_2.id},
+        )
+
+        # Every item must produce the same output as when serialized alone
+        for author, primary_object in zip(
+            Author.objects.order_by("id"), data["object"]
+        ):
+            single = normalize_serializer_payload(
+                AuthorWithAllBlogsSerializer(instance=author).data
+            )
+            self.assertEqual(single["object"], primary_object)
+            for model_key, objects in single["related_objects"].items():
+                for pk, obj in objects.items():
+                    self.assertEqual(data["related_objects"][model_key][pk], obj)
+
+
+    def test_forward_relations_are_loaded_in_bulk(self):
+        for index in range(5):
+            Blog.objects.create(
+                title=f"Blog {index}",
+                content="Content",
+                author=Author.objects.create(name=f"Author {index}", age=index),
+                publisher=self.publisher,
+            )
+
+        expected = normalize_serializer_payload(
+            BlogSerializerWithAuthorAndPublisher(
+                instance=Blog.objects.select_related("author", "publisher"),
+                many=True,
+            ).data
+        )
+
+        # One query for the blogs, then one `pk__in` query per related model
+        with self.assertNumQueries(3):
+            data = normalize_serializer_payload(
+                BlogSerializerWithAuthorAndPublisher(
+                    instance=Blog.objects.all(), many=True
+                ).data
+            )
+        self.assertEqual(DeepDiff(data, expected, ignore_order=True), {})
+        self.assertEqual(len(data["related_objects"]["test_app_author"]), 6)
+
+        # Instances loaded by `select_related` are reused
+        with self.assertNumQueries(1):
+            BlogSerializerWithAuthorAndPublisher(
+                instance=Blog.objects.select_related("author", "publisher"),
+                many=True,
+            ).data
+
+
+class TestStreaming(TestCase):
+
+    def setUp(self):
+        self.authors = [
+            Author.objects.create(name=f"Author {index}", age=index)
+            for index in range(2)
+        ]
+        self.publisher = Publisher.objects.create(name="Tech Publications")
+        for index in range(5):
+            Blog.objects.create(
+                title=f"Blog {index}",
+                content="Content",
+                author=self.authors[index % 2],
+                publisher=self.publisher,
+            )
+
+    def get_serializer(self):
+        return BlogSerializerWithAuthorAndPublisher(
+            instance=Blog.objects.order_by("id"), many=True
+        )
+
+    def test_json_chunks_render_same_payload(self):
+        expected = normalize_serializer_payload(self.get_serializer().data)
+
+        chunks = list(self.get_serializer().iter_json_chunks(chunk_size=2))
+        data = normalize_serializer_payload(json.loads("".join(chunks)))
+
+        self.assertGreater(len(chunks), 3)
+        self.assertEqual(DeepDiff(data, expected), {})
+
+    def test_interleaved_chunks_send_related_objects_once(self):
+        lines = list(
+            self.get_serializer().iter_json_chunks(
+                chunk_size=2, interleave_related=True
+            )
+        )
+        chunks = [normalize_serializer_payload(json.loads(line)) for line in lines]
+
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(sum(len(chunk["object"]) for chunk in chunks), 5)
+        self.assertEqual(
+            set(chunks[0]["related_objects"]["test_app_author"]),
+            {author.id for author in self.authors},
+        )
+        for chunk in chunks[1:]:
+            self.assertEqual(chunk["related_objects"]["test_app_author"], {})
+            self.assertEqual(chunk["related_objects"]["test_app_publisher"], {})
+
+    def test_later_chunks_do_not_fetch_sent_objects(self):
+        serializer = self.get_serializer()
+        chunks = serializer.iter_chunks(chunk_size=2)
+
+        # blogs + authors + publishers
+        with self.assertNumQueries(3):
+            next(chunks)
+        # Every related object was already sent, only the blogs are read
+        # from the open cursor.
+        with self.assertNumQueries(0):
+            next(chunks)
+
+    def test_streaming_response(self):
+        response = streaming_response(self.get_serializer(), chunk_size=2)
+
+        self.assertEqual(response["Content-Type"], "application/json")
+        data = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(len(data["object"]), 5)
+
+
+class TestAsyncSerialization(TestCase):
+
+    def setUp(self):
+        self.publisher = Publisher.objects.create(name="Tech Publications")
+        for index in range(3):
+            author = Author.objects.create(name=f"Author {index}", age=index)
+            Blog.objects.create(
+                title=f"Blog {index}",
+                content="Content",
+                author=author,
+                publisher=self.publisher,
+            )
+
+    async def test_adata_matches_data(self):
+        blog = await Blog.objects.afirst()
+        expected = await sync_to_async(
+            lambda: normalize_serializer_payload(
+                BlogSerializerWithAuthorAndPublisher(instance=blog).data
+            )
+        )()
+
+        data = normalize_serializer_payload(
+            await BlogSerializerWithAuthorAndPublisher(instance=blog).adata()
+        )
+
+        self.assertEqual(DeepDiff(data, expected), {})
+
+    async def test_list_adata_matches_data(self):
+        expected = await sync_to_async(
+            lambda: normalize_serializer_payload(
+                AuthorWithAllBlogsSerializer(
+                    instance=Author.objects.all(), many=True
+                ).data
+            )
+        )()
+
+        serializer = AuthorWithAllBlogsSerializer(
+            instance=Author.objects.all(), many=True
+        )
+        data = normalize_serializer_payload(await serializer.adata())
+
+        self.assertEqual(DeepDiff(data, expected, ignore_order=True), {})
+
+    def test_list_adata_fetches_related_models_in_bulk(self):
+        serializer = BlogSerializerWithAuthorAndPublisher(
+            instance=Blog.objects.all(), many=True
+        )
+        # blogs, then one query per related model
+        with self.assertNumQueries(3):
+            data = async_to_sync(serializer.adata)()
+
+        self.assertEqual(len(data["related_objects"]["test_app_author"]), 3)
+
+
+class TestParallelRelatedSerialization(TestCase):
+
+    def setUp(self):
+        for index in range(4):
+            Blog.objects.create(
+                title=f"Blog {index}",
+                content="Content",
+                author=Author.objects.create(name=f"Author {index}", age=index),
+                publisher=Publisher.objects.create(name=f"Publisher {index}"),
+            )
+
+    def serialize(self, **context):
+        # Instances are loaded up front, worker threads do not query
+        return BlogSerializerWithAuthorAndPublisher(
+            instance=Blog.objects.select_related("author", "publisher"),
+            many=True,
+            context=context,
+        ).data
+
+    def test_parallel_output_matches_sequential_output(self):
+        expected = self.serialize()
+        data = self.serialize(parallel_related=True)
+
+        self.assertEqual(data, expected)
+        self.assertEqual(list(data["related_objects"]), list(expected["related_objects"]))
+
+    def test_related_models_are_serialized_on_worker_threads(self):
+        thread_ids = set()
+
+        def to_representation(serializer, instance):
+            thread_ids.add(threading.get_ident())
+            return {"id": instance.pk}
+
+        with mock.patch.object(
+            AuthorSerializer,
+            "to_representation",
+            autospec=True,
+            side_effect=to_representation,
+        ):
+            self.serialize(parallel_related=True)
+
+        self.assertEqual(len(thread_ids), 1)
+        self.assertNotIn(threading.get_ident(), thread_ids)
+
+    def serialize_comments(self, **context):
+        for blog in Blog.objects.all():
+            Comment.objects.create(
+                blog=blog,
+                text="Comment",
+                author=Author.objects.create(name="Commenter", age=1),
+            )
+        return CommentSerializer(
+            instance=Comment.objects.all(), many=True, context=context
+        ).data
+
+    def test_nested_levels_query_in_the_calling_thread(self):
+        # The Blog level loads its Authors: worker threads would query
+        # outside of the transaction of the test and miss them
+        with self.settings(BETTER_NESTED_SERIALIZER={"VALUES_FAST_PATH": False}):
+            expected = self.serialize_comments()
+            data = CommentSerializer(
+                instance=Comment.objects.all(),
+                many=True,
+                context={"parallel_related": True},
+            ).data
+
+        self.assertEqual(len(expected["related_objects"]["test_app_author"]), 8)
+        self.assertEqual(data, expected)
+
+    def test_values_are_read_in_the_calling_thread(self):
+        expected = self.serialize_comments()
+        data = CommentSerializer(
+            instance=Comment.objects.all(),
+            many=True,
+            context={"parallel_related": True},
+        ).data
+
+        self.assertEqual(len(expected["related_objects"]["test_app_author"]), 8)
+        self.assertEqual(data, expected)
+
+
+class TestExport(TestCase):
+
+    def setUp(self):
+        self.publisher = Publisher.objects.create(name="Tech Publications")
+        for index in range(5):
+            Blog.objects.create(
+                title=f"Blog {index}",
+                content="Content",
+                author=Author.objects.create(name=f"Author {index}", age=index),
+                publisher=self.publisher,
+            )
+
+    def get_serializer(self):
+        return BlogSerializerWithAuthorAndPublisher(
+            instance=Blog.objects.order_by("id"), many=True
+        )
+
+    def test_pk_ranges(self):
+        pks = list(Blog.objects.order_by("pk").values_list("pk", flat=True))
+
+        self.assertEqual(
+            get_pk_ranges(Blog.objects.all(), 2),
+            [(pks[0], pks[2]), (pks[2], pks[4]), (pks[4], None)],
+        )
+        self.assertEqual(get_pk_ranges(Blog.objects.none(), 2), [])
+
+    def test_export_matches_data(self):
+        expected = normalize_serializer_payload(self.get_serializer().data)
+
+        data = normalize_serializer_payload(self.get_serializer().export(chunk_size=2))
+
+        self.assertEqual(DeepDiff(data, expected), {})
+
+    def test_export_to_json_file(self):
+        expected = normalize_serializer_payload(self.get_serializer().data)
+
+        fp = io.StringIO()
+        count = self.get_serializer().export(chunk_size=2, fp=fp)
+
+        self.assertEqual(count, 5)
+        self.assertEqual(
+            DeepDiff(normalize_serializer_payload(json.loads(fp.getvalue())), expected),
+            {},
+        )
+
+    def test_export_to_json_lines(self):
+        fp = io.StringIO()
+        self.get_serializer().export(chunk_size=2, fp=fp, export_format="jsonl")
+
+        lines = [json.loads(line) for line in fp.getvalue().splitlines()]
+        self.assertEqual(len([line for line in lines if "object" in line]), 5)
+        self.assertEqual(
+            sorted(line["model"] for line in lines if "related_object" in line),
+            ["test_app_author"] * 5 + ["test_app_publisher"],
+        )
+
+
+class TestExportWorkers(TransactionTestCase):
+    # Worker processes only see committed rows
+
+    def setUp(self):
+        publisher = Publisher.objects.create(name="Tech Publications")
+        for index in range(5):
+            Blog.objects.create(
+                title=f"Blog {index}",
+                content="Content",
+                author=Author.objects.create(name=f"Author {index}", age=index),
+                publisher=publisher,
+            )
+
+    @unittest.skipUnless(
+        multiprocessing.get_start_method() == "fork",
+        "Workers inherit the settings of the tests when forked only",
+    )
+    def test_export_in_worker_processes(self):
+        expected = normalize_serializer_payload(
+            BlogSerializerWithAuthorAndPublisher(
+                instance=Blog.objects.order_by("id"), many=True
+            ).data
+        )
+
+        queryset = Blog.objects.order_by("id")
+        data = BlogSerializerWithAuthorAndPublisher(
+            instance=queryset, many=True
+        ).export(workers=2, chunk_size=2)
+
+        self.assertEqual(DeepDiff(normalize_serializer_payload(data), expected), {})
+        # The rows are only loaded by the workers
+        self.assertIsNone(queryset._result_cache)
+
+
+class TestObservers(QueryAssertionsMixin, TestCase):
+
+    def setUp(self):
+        self.author = Author.objects.create(name="Alice", age=30)
+        self.publisher = Publisher.objects.create(name="Tech Publications")
+        for index in range(3):
+            Blog.objects.create(
+                title=f"Blog {index}",
+                content="Content",
+                author=self.author,
+                publisher=self.publisher,
+            )
+
+    def test_phases_are_reported(self):
+        observer = RecordingObserver()
+        BlogSerializerWithAuthorAndPublisher(
+            instance=Blog.objects.all(),
+            many=True,
+            context={"serialization_observer": observer},
+        ).data
+
+        events = [
+            (event.serializer.__class__, event.phase, event.model_key)
+            for event in observer.events
+        ]
+        self.assertEqual(
+            events,
+            [
+                (BlogSerializerWithAuthorAndPublisher, Phase.PRIMARY, None),
+                (BlogSerializerWithAuthorAndPublisher, Phase.COLLECT, None),
+                (BlogSerializerWithAuthorAndPublisher, Phase.RELATED, "test_app_author"),
+                # The nested PublisherSerializer level
+                (PublisherSerializer, Phase.PRIMARY, None),
+                (PublisherSerializer, Phase.COLLECT, None),
+                (
+                    BlogSerializerWithAuthorAndPublisher,
+                    Phase.RELATED,
+                    "test_app_publisher",
+                ),
+            ],
+        )
+
+        primary, collect, author = observer.events[:3]
+        self.assertEqual(primary.instance_count, 3)
+        self.assertEqual(primary.queries, 1)
+        # The publishers are loaded with a `pk__in` query, the authors
+        # (a simple serializer) are read with `values_list`, both while
+        # collecting
+        self.assertEqual(collect.queries, 2)
+        self.assertEqual(collect.instance_count, 2)
+        self.assertEqual(collect.duplicates_dropped, 4)
+        self.assertEqual(author.instance_count, 1)
+        self.assertEqual(author.duplicates_dropped, 2)
+        self.assertEqual(author.queries, 0)
+        self.assertGreaterEqual(author.elapsed, 0)
+
+    def test_observer_from_settings(self):
+        with self.settings(
+            BETTER_NESTED_SERIALIZER={
+                "OBSERVER": "better_nested_serializer.observers.LoggingObserver"
+            }
+        ), self.assertLogs("better_nested_serializer", level="DEBUG") as logs:
+            BlogSerializerWithAuthorAndPublisher(instance=Blog.objects.first()).data
+
+        self.assertIn(
+            "BlogSerializerWithAuthorAndPublisher related test_app_author: "
+            "1 instances, 0 duplicates dropped, 0 queries",
+            "\n".join(logs.output),
+        )
+
+    def test_assert_max_queries(self):
+        with self.assertMaxQueries(3):
+            BlogSerializerWithAuthorAndPublisher(
+                instance=Blog.objects.all(), many=True
+            ).data
+
+        with self.assertRaises(AssertionError):
+            with self.assertMaxQueries(2):
+                BlogSerializerWithAuthorAndPublisher(
+                    instance=Blog.objects.all(), many=True
+                ).data
+
+
+class TestFieldSelection(TestCase):
+
+    def setUp(self):
+        self.author = Author.objects.create(name="Alice", age=30)
+        self.publisher = Publisher.objects.create(name="Tech Publications")
+        self.blog = Blog.objects.create(
+            title="Blog",
+            content="Content",
+            author=self.author,
+            publisher=self.publisher,
+        )
+        self.comment = Comment.objects.create(
+            blog=self.blog, text="Nice", author=self.author
+        )
+
+    def get_context(self, **query_params):
+        return {"request": Request(APIRequestFactory().get("/", query_params))}
+
+    def test_pruned_nested_fields_are_not_collected(self):
+        serializer = BlogSerializerWithAuthorAndPublisher(
+            instance=Blog.objects.all(),
+            many=True,
+            context=self.get_context(fields="title"),
+        )
+        with self.assertNumQueries(1):
+            data = normalize_serializer_payload(serializer.data)
+
+        self.assertEqual(
+            data,
+            {"object": [{"id": self.blog.id, "title": "Blog"}], "related_objects": {}},
+        )
+
+    def test_related_fields_are_selected_per_model(self):
+        serializer = BlogSerializerWithAuthorAndPublisher(
+            instance=Blog.objects.get(),
+            context=self.get_context(
+                fields="title,author", related="test_app_author(name)"
+            ),
+        )
+        # The author only, the publisher is not loaded
+        with self.assertNumQueries(1):
+            data = normalize_serializer_payload(serializer.data)
+
+        self.assertEqual(
+            data,
+            {
+                "object": {
+                    "id": self.blog.id,
+                    "title": "Blog",
+                    "author": self.author.id,
+                },
+                "related_objects": {
+                    "test_app_author": {
+                        self.author.id: {"id": self.author.id, "name": "Alice"}
+                    }
+                },
+            },
+        )
+
+    def test_selection_applies_to_nested_levels(self):
+        serializer = CommentSerializer(
+            instance=Comment.objects.all(),
+            many=True,
+            context={
+                "field_selection": FieldSelection.parse(
+                    related="test_app_blog(title)"
+                )
+            },
+        )
+        # Comments, their authors and their blogs: the blog authors are not
+        # collected anymore
+        with self.assertNumQueries(3):
+            data = normalize_serializer_payload(serializer.data)
+
+        self.assertEqual(
+            data["related_objects"]["test_app_blog"],
+            {self.blog.id: {"id": self.blog.id, "title": "Blog"}},
+        )
+        self.assertEqual(
+            set(data["related_objects"]["test_app_author"][self.author.id]),
+            {"id", "name", "age"},
+        )
+
+    def test_query_plan_respects_selection(self):
+        plan = AuthorWithAllBlogsSerializer.get_query_plan(
+            FieldSelection.parse(fields="name")
+        )
+        self.assertEqual(plan.prefetch_related, ())
+
+        selection = FieldSelection.parse(related="test_app_blog(title)")
+        plan = AuthorWithAllBlogsSerializer.get_query_plan(selection)
+        self.assertEqual(
+            [prefetch.prefetch_to for prefetch in plan.prefetch_related],
+            ["blog_set"],
+        )
+        self.assertEqual(plan.prefetch_related[0].queryset.query.select_related, False)
+        self.assertIs(AuthorWithAllBlogsSerializer.get_query_plan(selection), plan)
+
+    def test_query_plans_are_cached_by_relation_fields(self):
+        AuthorWithAllBlogsSerializer.get_query_plan()
+        count = len(AuthorWithAllBlogsSerializer._query_plans)
+        for index in range(100):
+            AuthorWithAllBlogsSerializer.get_query_plan(
+                FieldSelection.parse(
+                    fields=f"id,x{index}", related=f"test_app_blog(x{index}),y{index}()"
+                )
+            )
+
+        # All of them select no relation field: they share one plan
+        self.assertLessEqual(len(AuthorWithAllBlogsSerializer._query_plans), count + 1)
+
+    def test_malformed_related_selection(self):
+        with self.assertRaises(ValidationError):
+            FieldSelection.parse(related="test_app_author(name")
+
+
+class TestRelatedLimits(TestCase):
+
+    def setUp(self):
+        self.authors = [
+            Author.objects.create(name=f"Author {index}", age=30 + index)
+            for index in range(3)
+        ]
+        self.blogs = [
+            Blog.objects.create(
+                title=f"Blog {index}", content="Content", author=author
+            )
+            for index, author in enumerate(self.authors)
+        ]
+        self.commenter = Author.objects.create(name="Commenter", age=40)
+        for blog in self.blogs:
+            Comment.objects.create(blog=blog, text="Nice", author=self.commenter)
+
+    def serialize(self, serializer_class, queryset, **limits):
+        return normalize_serializer_payload(
+            serializer_class(
+                instance=queryset,
+                many=True,
+                context={"related_limits": RelatedLimits(**limits)},
+            ).data
+        )
+
+    def test_objects_beyond_max_depth_are_referenced(self):
+        # Comments, their blogs and the commenter: the blog authors are not
+        # loaded
+        with self.assertNumQueries(3):
+            data = self.serialize(CommentSerializer, Comment.objects.all(), max_depth=1)
+
+        self.assertEqual(
+            set(data["related_objects"]["test_app_author"]), {self.commenter.id}
+        )
+        self.assertEqual(len(data["related_objects"]["test_app_blog"]), 3)
+        self.assertEqual(
+            data["related_refs"],
+            {"test_app_author": [author.id for author in self.authors]},
+        )
+
+    def test_objects_beyond_max_objects_per_model_are_referenced(self):
+        with self.assertNumQueries(2):
+            data = self.serialize(
+                BlogSerializerWithAuthor,
+                Blog.objects.order_by("pk"),
+                max_objects_per_model=2,
+            )
+
+        self.assertEqual(
+            set(data["related_objects"]["test_app_author"]),
+            {self.authors[0].id, self.authors[1].id},
+        )
+        self.assertEqual(
+            data["related_refs"], {"test_app_author": [self.authors[2].id]}
+        )
+
+    def test_objects_beyond_max_objects_are_referenced(self):
+        data = self.serialize(CommentSerializer, Comment.objects.all(), max_objects=4)
+
+        # The 3 blogs are claimed first, then 1 author
+        self.assertEqual(len(data["related_objects"]["test_app_blog"]), 3)
+        self.assertEqual(len(data["related_objects"]["test_app_author"]), 1)
+        self.assertEqual(len(data["related_refs"]["test_app_author"]), 3)
+
+    def test_limits_ignore_objects_already_sent(self):
+        # As on a later cursor page: 2 authors were sent by the first one
+        data = normalize_serializer_payload(
+            BlogSerializerWithAuthor(
+                instance=Blog.objects.order_by("pk"),
+                many=True,
+                context={
+                    "related_limits": RelatedLimits(
+                        max_objects_per_model=1, max_objects=1
+                    ),
+                    "sent_related_objects": {
+                        "test_app_author": {self.authors[0].id, self.authors[1].id}
+                    },
+                },
+            ).data
+        )
+
+        self.assertEqual(
+            data["related_objects"],
+            {"test_app_author": {self.authors[2].id: mock.ANY}},
+        )
+        self.assertNotIn("related_refs", data)
+
+    def test_no_refs_without_limits(self):
+        data = self.serialize(CommentSerializer, Comment.objects.all())
+        self.assertNotIn("related_refs", data)
+
+    def test_limits_from_settings(self):
+        with self.settings(BETTER_NESTED_SERIALIZER={"MAX_RELATED_DEPTH": 0}):
+            data = normalize_serializer_payload(
+                BlogSerializerWithAuthor(instance=Blog.objects.all(), many=True).data
+            )
+
+        self.assertEqual(data["related_objects"], {})
+        self.assertEqual(
+            sorted(data["related_refs"]["test_app_author"]),
+            [author.id for author in self.authors],
+        )
+
+    def test_streamed_refs(self):
+        serializer = BlogSerializerWithAuthor(
+            instance=Blog.objects.order_by("pk"),
+            many=True,
+            context={"related_limits": RelatedLimits(max_objects_per_model=1)},
+        )
+        data = json.loads("".join(serializer.iter_json_chunks(chunk_size=1)))
+
+        self.assertEqual(
+            list(data["related_objects"]["test_app_author"]),
+            [str(self.authors[0].id)],
+        )
+        self.assertEqual(
+            data["related_refs"],
+            {"test_app_author": [self.authors[1].id, self.authors[2].id]},
+        )
+
+
+class TestColumnarFormat(TestCase):
+
+    def setUp(self):
+        self.authors = [
+            Author.objects.create(name=f"Author {index}", age=30 + index)
+            for index in range(2)
+        ]
+        self.publisher = Publisher.objects.create(name="Tech Publications")
+        for index in range(4):
+            blog = Blog.objects.create(
+                title=f"Blog {index}",
+                content="Content",
+                author=self.authors[index % 2],
+                publisher=self.publisher if index % 2 else None,
+            )
+            Comment.objects.create(blog=blog, text="Nice", author=self.authors[0])
+
+    def serialize(self, related_format, queryset=None):
+        return CommentSerializer(
+            instance=Comment.objects.all() if queryset is None else queryset,
+            many=True,
+            context={"related_format": related_format},
+        ).data
+
+    def test_columnar_tables(self):
+        data = self.serialize("columnar")
+
+        authors = data["related_objects"]["test_app_author"]
+        self.assertEqual(authors["fields"], ["name", "age"])
+        self.assertEqual(
+            dict(zip(authors["ids"], authors["rows"])),
+            {
+                self.authors[0].id: ["Author 0", 30],
+                self.authors[1].id: ["Author 1", 31],
+            },
+        )
+        self.assertEqual(
+            data["related_objects"]["test_app_blog"]["fields"],
+            ["author", "title", "content", "publisher"],
+        )
+
+    def test_decoded_columnar_matches_objects(self):
+        expected = normalize_serializer_payload(self.serialize("objects"))
+        data = self.serialize("columnar")
+
+        self.assertEqual(
+            DeepDiff(
+                {
+                    "object": data["object"],
+                    "related_objects": decode_columnar(data["related_objects"]),
+                },
+                expected,
+                ignore_order=True,
+            ),
+            {},
+        )
+
+    def test_format_from_meta_and_query_parameter(self):
+        data = ColumnarBlogSerializer(instance=Blog.objects.all(), many=True).data
+        self.assertEqual(
+            data["related_objects"]["test_app_publisher"],
+            {
+                "fields": ["name"],
+                "ids": [self.publisher.id],
+                "rows": [["Tech Publications"]],
+            },
+        )
+
+        request = Request(APIRequestFactory().get("/", {"related_format": "columnar"}))
+        data = BlogSerializerWithAuthorAndPublisher(
+            instance=Blog.objects.all(), many=True, context={"request": request}
+        ).data
+        self.assertEqual(
+            data["related_objects"]["test_app_publisher"]["ids"], [self.publisher.id]
+        )
+
+        request = Request(APIRequestFactory().get("/", {"related_format": "xml"}))
+        with self.assertRaises(ValidationError):
+            BlogSerializerWithAuthorAndPublisher(
+                instance=Blog.objects.all(), many=True, context={"request": request}
+            ).data
+
+    def test_streamed_and_exported_tables(self):
+        expected = decode_columnar(self.serialize("columnar")["related_objects"])
+        serializer = CommentSerializer(
+            instance=Comment.objects.all(),
+            many=True,
+            context={"related_format": "columnar"},
+        )
+
+        data = json.loads("".join(serializer.iter_json_chunks(chunk_size=1)))
+        self.assertEqual(decode_columnar(data["related_objects"]), expected)
+
+        data = serializer.export(chunk_size=2)
+        self.assertEqual(decode_columnar(data["related_objects"]), expected)
+
+    def test_combine_tables_with_different_fields(self):
+        related_objects = {
+            "test_app_author": {"fields": ["name"], "ids": [1], "rows": [["Alice"]]}
+        }
+        combine_columnar(
+            related_objects,
+            {
+                "test_app_author": {
+                    "fields": ["age", "name"],
+                    "ids": [2],
+                    "rows": [[31, "Bob"]],
+                }
+            },
+        )
+
+        self.assertEqual(
+            related_objects,
+            {
+                "test_app_author": {
+                    "fields": ["name", "age"],
+                    "ids": [1, 2],
+                    "rows": [["Alice", None], ["Bob", 31]],
+                }
+            },
+        )
+
+
+class TestBetterJSONRenderer(TestCase):
+
+    def setUp(self):
+        self.author = Author.objects.create(name="Alice \u2028", age=30)
+        self.blog = Blog.objects.create(
+            title="Blog é", content="Content", author=self.author
+        )
+        self.data = BlogSerializerWithAuthorAndPublisher(
+            instance=Blog.objects.all(), many=True
+        ).data
+
+    def test_renders_like_json_renderer(self):
+        rendered = renderers.BetterJSONRenderer().render(self.data)
+
+        self.assertEqual(rendered, JSONRenderer().render(self.data))
+        self.assertIn(b"\\u2028", rendered)
+        self.assertEqual(
+            json.loads(rendered)["related_objects"]["test_app_author"][
+                str(self.author.id)
+            ]["name"],
+            "Alice \u2028",
+        )
+
+    def test_unknown_types_are_converted_like_drf(self):
+        data = {"object": {"price": decimal.Decimal("1.50")}, "related_objects": {}}
+        self.assertEqual(
+            renderers.BetterJSONRenderer().render(data),
+            JSONRenderer().render(data),
+        )
+
+    def test_datetimes_are_rendered_like_drf(self):
+        data = {
+            "object": {
+                "created": datetime.datetime(
+                    2024, 1, 2, 3, 4, 5, 123456, tzinfo=datetime.timezone.utc
+                ),
+                "day": datetime.date(2024, 1, 2),
+                "duration": datetime.timedelta(minutes=1),
+            },
+            "related_objects": {},
+        }
+        rendered = renderers.BetterJSONRenderer().render(data)
+
+        self.assertEqual(rendered, JSONRenderer().render(data))
+        self.assertIn(b'"2024-01-02T03:04:05.123456Z"', rendered)
+
+    def test_indented_output_uses_json_renderer(self):
+        rendered = renderers.BetterJSONRenderer().render(
+            self.data, "application/json; indent=2"
+        )
+        self.assertEqual(
+            rendered, JSONRenderer().render(self.data, "application/json; indent=2")
+        )
+
+    def test_standard_library_fallback(self):
+        with mock.patch.object(renderers, "_dumps", None):
+            rendered = renderers.BetterJSONRenderer().render(self.data)
+        self.assertEqual(rendered, JSONRenderer().render(self.data))
+
+
+class TestValuesFastPath(TestCase):
+
+    def setUp(self):
+        self.authors = [
+            Author.objects.create(name=f"Author {index}", age=30 + index)
+            for index in range(3)
+        ]
+        for index, author in enumerate(self.authors):
+            Blog.objects.create(
+                title=f"Blog {index}", content="Content", author=author
+            )
+
+    def test_simple_serializers_are_eligible(self):
+        plan = get_values_plan(AuthorSerializer(many=True))
+        self.assertEqual(plan.columns, ("id", "name", "age"))
+        self.assertEqual(plan.converters, (None, None, None))
+
+        plan = get_values_plan(AuthorWithTextAgeSerializer(many=True))
+        converters = dict(zip(plan.field_names, plan.converters))
+        self.assertIsNone(converters["name"])
+        self.assertIsNotNone(converters["age"])
+
+        items = [(author.pk, None) for author in self.authors[:2]]
+        self.assertEqual(
+            plan.to_representations(items, Author),
+            {
+                author.id: {
+                    "id": author.id,
+                    "name": author.name,
+                    "age": str(author.age),
+                }
+                for author in self.authors[:2]
+            },
+        )
+
+    def test_other_serializers_are_not_eligible(self):
+        self.assertIsNone(get_values_plan(AuthorWithInitialsSerializer(many=True)))
+        self.assertIsNone(get_values_plan(AttachmentSerializer(many=True)))
+        self.assertIsNone(get_values_plan(PublisherSerializer(many=True)))
+        with self.settings(BETTER_NESTED_SERIALIZER={"VALUES_FAST_PATH": False}):
+            self.assertIsNone(get_values_plan(AuthorSerializer(many=True)))
+
+    def test_related_objects_are_read_without_instances(self):
+        with self.settings(BETTER_NESTED_SERIALIZER={"VALUES_FAST_PATH": False}):
+            expected = BlogSerializerWithAuthor(
+                instance=Blog.objects.all(), many=True
+            ).data
+
+        with mock.patch.object(
+            Author, "from_db", side_effect=AssertionError("Author instantiated")
+        ), self.assertNumQueries(2):
+            data = BlogSerializerWithAuthor(
+                instance=Blog.objects.all(), many=True
+            ).data
+
+        self.assertEqual(data, expected)
+
+    def test_file_fields_are_represented_from_instances(self):
+        attachment = Attachment.objects.create(file="attachments/report.pdf")
+        BlogAttachment.objects.create(
+            blog=Blog.objects.first(), attachment=attachment
+        )
+
+        data = BlogAttachmentSerializer(
+            instance=BlogAttachment.objects.all(), many=True
+        ).data
+
+        self.assertEqual(
+            data["related_objects"]["test_app_attachment"][attachment.id]["file"],
+            attachment.file.url,
+        )
+
+    def test_loaded_instances_are_not_read_again(self):
+        with self.assertNumQueries(1):
+            data = BlogSerializerWithAuthor(
+                instance=Blog.objects.select_related("author"), many=True
+            ).data
+
+        self.assertEqual(
+            data["related_objects"]["test_app_author"][self.authors[0].id],
+            {"id": self.authors[0].id, "name": "Author 0", "age": 30},
+        )
+
+
+class TestRelatedObjectCache(TestCase):
+
+    def setUp(self):
+        get_cache().clear()
+        get_token_cache().clear()
+        self.authors = [
+            Author.objects.create(name=f"Author {index}", age=index)
+            for index in range(2)
+        ]
+        for index in range(4):
+            Blog.objects.create(
+                title=f"Blog {index}",
+                content="Content",
+                author=self.authors[index % 2],
+            )
+
+    def serialize(self):
+        return normalize_serializer_payload(
+            BlogSerializerWithCachedAuthor(instance=Blog.objects.all(), many=True).data
+        )
+
+    def test_cached_objects_are_not_loaded_nor_serialized(self):
+        expected = self.serialize()
+
+        with mock.patch.object(
+            CachedAuthorSerializer, "to_representation", autospec=True
+        ) as to_representation, self.assertNumQueries(1):
+            data = self.serialize()
+
+        to_representation.assert_not_called()
+        self.assertEqual(DeepDiff(data, expected), {})
+        self.assertEqual(len(data["related_objects"]["test_app_author"]), 2)
+
+    def test_many_objects_stay_cached(self):
+        for index in range(400):
+            Blog.objects.create(
+                title=f"Blog {index}",
+                content="Content",
+                author=Author.objects.create(name=f"Author {index}", age=index),
+            )
+        self.serialize()
+
+        with mock.patch.object(
+            CachedAuthorSerializer, "to_representation", autospec=True
+        ) as to_representation:
+            data = self.serialize()
+
+        to_representation.assert_not_called()
+        self.assertEqual(len(data["related_objects"]["test_app_author"]), 402)
+
+    def test_saves_invalidate_before_any_serialization(self):
+        # No serializer ever versioned attachments in this process
+        attachment = Attachment.objects.create(file="attachments/report.pdf")
+        token = get_version_tokens("test_app_attachment", [attachment.pk])[
+            attachment.pk
+        ]
+
+        attachment.save()
+
+        self.assertNotEqual(
+            get_version_tokens("test_app_attachment", [attachment.pk])[
+                attachment.pk
+            ],
+            token,
+        )
+
+    def test_shared_tokens_need_the_app(self):
+        with self.settings(
+            BETTER_NESTED_SERIALIZER={"RELATED_CACHE_ALIAS": "shared"}
+        ), mock.patch(
+            "better_nested_serializer.cache.apps.is_installed", return_value=False
+        ), self.assertRaises(ImproperlyConfigured):
+            self.serialize()
+
+    def test_saved_objects_are_invalidated(self):
+        self.serialize()
+
+        author = self.authors[0]
+        author.name = "Renamed"
+        author.save()
+
+        # The blogs, then only the changed author
+        with self.assertNumQueries(2):
+            data = self.serialize()
+        self.assertEqual(
+            data["related_objects"]["test_app_author"][author.id]["name"], "Renamed"
+        )
+
+
+class TestKnownObjects(TestCase):
+
+    def setUp(self):
+        get_cache().clear()
+        get_token_cache().clear()
+        self.authors = [
+            Author.objects.create(name=f"Author {index}", age=30 + index)
+            for index in range(2)
+        ]
+        for index in range(4):
+            Blog.objects.create(
+                title=f"Blog {index}",
+                content="Content",
+                author=self.authors[index % 2],
+            )
+
+    def serialize(self, serializer_class, known_objects):
+        return normalize_serializer_payload(
+            serializer_class(
+                instance=Blog.objects.all(),
+                many=True,
+                context={"known_related_objects": known_objects},
+            ).data
+        )
+
+    def test_known_objects_are_not_loaded_nor_sent(self):
+        data = self.serialize(BlogSerializerWithVersionedAuthor, KnownObjects())
+        versions = data["related_versions"]["test_app_author"]
+        self.assertEqual(set(versions), {author.id for author in self.authors})
+        self.assertEqual(len(data["related_objects"]["test_app_author"]), 2)
+
+        known_objects = KnownObjects.parse(
+            KnownObjects.format(data["related_versions"])
+        )
+        # The blogs, then the version column of the authors
+        with mock.patch.object(
+            VersionedAuthorSerializer, "to_representation", autospec=True
+        ) as to_representation, self.assertNumQueries(2):
+            data = self.serialize(BlogSerializerWithVersionedAuthor, known_objects)
+
+        to_representation.assert_not_called()
+        self.assertEqual(data["related_objects"], {"test_app_author": {}})
+        self.assertNotIn("related_versions", data)
+        self.assertEqual(len(data["object"]), 4)
+
+    def test_changed_objects_are_sent(self):
+        data = self.serialize(BlogSerializerWithVersionedAuthor, KnownObjects())
+        known_objects = KnownObjects.parse(
+            KnownObjects.format(data["related_versions"])
+        )
+
+        author = self.authors[0]
+        author.age = 50
+        author.save()
+
+        data = self.serialize(BlogSerializerWithVersionedAuthor, known_objects)
+        self.assertEqual(
+            data["related_objects"]["test_app_author"],
+            {author.id: {"id": author.id, "name": author.name, "age": 50}},
+        )
+        self.assertEqual(list(data["related_versions"]["test_app_author"]), [author.id])
+
+    def test_objects_with_nested_fields_are_always_sent(self):
+        for blog in Blog.objects.all():
+            Comment.objects.create(blog=blog, text="Nice", author=self.authors[0])
+        # The client holds every blog, with its current version
+        known_objects = KnownObjects(
+            {
+                "test_app_blog": {
+                    str(blog.pk): get_version_tag(blog.title)
+                    for blog in Blog.objects.all()
+                }
+            }
+        )
+
+        author = self.authors[0]
+        author.name = "Renamed"
+        author.save()
+
+        data = normalize_serializer_payload(
+            CommentSerializerWithVersionedBlog(
+                instance=Comment.objects.all(),
+                many=True,
+                context={"known_related_objects": known_objects},
+            ).data
+        )
+        self.assertEqual(len(data["related_objects"]["test_app_blog"]), 4)
+        self.assertEqual(
+            data["related_objects"]["test_app_author"][author.id]["name"], "Renamed"
+        )
+        self.assertNotIn("related_versions", data)
+
+    def test_cache_tokens_are_versions(self):
+        data = self.serialize(BlogSerializerWithCachedAuthor, KnownObjects())
+        known_objects = KnownObjects.parse(
+            KnownObjects.format(data["related_versions"])
+        )
+
+        # The blogs only
+        with self.assertNumQueries(1):
+            data = self.serialize(BlogSerializerWithCachedAuthor, known_objects)
+        self.assertEqual(data["related_objects"], {"test_app_author": {}})
+
+        self.authors[1].save()
+        data = self.serialize(BlogSerializerWithCachedAuthor, known_objects)
+        self.assertEqual(
+            set(data["related_objects"]["test_app_author"]), {self.authors[1].id}
+        )
+
+    def test_protocol_needs_header(self):
+        data = BlogSerializerWithVersionedAuthor(
+            instance=Blog.objects.all(), many=True
+        ).data
+        self.assertNotIn("related_versions", data)
+
+        request = Request(APIRequestFactory().get("/"))
+        data = BlogSerializerWithVersionedAuthor(
+            instance=Blog.objects.all(), many=True, context={"request": request}
+        ).data
+        self.assertNotIn("related_versions", data)
+
+        request = Request(
+            APIRequestFactory().get("/", HTTP_X_KNOWN_RELATED_OBJECTS="")
+        )
+        data = BlogSerializerWithVersionedAuthor(
+            instance=Blog.objects.all(), many=True, context={"request": request}
+        ).data
+        header = KnownObjects.format(data["related_versions"])
+
+        request = Request(
+            APIRequestFactory().get("/", HTTP_X_KNOWN_RELATED_OBJECTS=header)
+        )
+        data = BlogSerializerWithVersionedAuthor(
+            instance=Blog.objects.all(), many=True, context={"request": request}
+        ).data
+        self.assertEqual(data["related_objects"], {"test_app_author": {}})
+
+    def test_malformed_header(self):
+        with self.assertRaises(ValidationError):
+            KnownObjects.parse("test_app_author=1")
+
+    def test_streamed_versions(self):
+        serializer = BlogSerializerWithVersionedAuthor(
+            instance=Blog.objects.order_by("pk"),
+            many=True,
+            context={"known_related_objects": KnownObjects()},
+        )
+        chunks = list(serializer.iter_chunks(chunk_size=1))
+        self.assertEqual(
+            [list(chunk.get("related_versions", {})) for chunk in chunks],
+            [["test_app_author"], ["test_app_author"], [], []],
+        )
+
+        data = json.loads("".join(serializer.iter_json_chunks(chunk_size=1)))
+        self.assertEqual(len(data["related_versions"]["test_app_author"]), 2)
+
+
+@override_settings(BETTER_NESTED_SERIALIZER={"RELATED_CACHE_ALIAS": "shared"})
+class TestGraphETag(TestCase):
+
+    def setUp(self):
+        get_cache().clear()
+        get_token_cache().clear()
+        self.authors = [
+            Author.objects.create(name=f"Author {index}", age=30 + index)
+            for index in range(2)
+        ]
+        self.blogs = [
+            Blog.objects.create(
+                title=f"Blog {index}",
+                content="Content",
+                author=self.authors[index % 2],
+            )
+            for index in range(4)
+        ]
+        for blog in self.blogs:
+            Comment.objects.create(blog=blog, text="Nice", author=self.authors[0])
+
+    def fingerprint(self, serializer_class=CommentSerializer, queryset=None):
+        return get_graph_fingerprint(
+            serializer_class(
+                instance=Comment.objects.all() if queryset is None else queryset,
+                many=True,
+            )
+        )
+
+    def test_saves_replace_tokens_before_any_fingerprint(self):
+        # No fingerprint ever versioned attachments, as in a process that
+        # only writes them
+        attachment = Attachment.objects.create(file="attachments/report.pdf")
+        versions = get_version_tokens("test_app_attachment", [attachment.pk])
+
+        attachment.save()
+
+        serializer = BlogAttachmentSerializer().fields["attachment"]
+        self.assertNotEqual(
+            get_versions(serializer, Attachment, [(attachment.pk, None)]), versions
+        )
+
+    def test_tokens_need_the_app(self):
+        with mock.patch(
+            "better_nested_serializer.cache.apps.is_installed", return_value=False
+        ), self.assertRaises(ImproperlyConfigured):
+            self.fingerprint()
+
+    def test_fingerprint_does_not_serialize_related_objects(self):
+        self.fingerprint()
+
+        # The comments, then the blogs to collect their authors
+        with mock.patch.object(
+            AuthorSerializer, "to_representation", autospec=True
+        ) as to_representation, self.assertNumQueries(2):
+            self.fingerprint()
+        to_representation.assert_not_called()
+
+        # Related objects without nested fields are not loaded
+        with self.assertNumQueries(1):
+            self.fingerprint(BlogSerializerWithAuthor, Blog.objects.all())
+
+    def test_fingerprint_follows_the_graph(self):
+        fingerprint = self.fingerprint()
+        self.assertEqual(self.fingerprint(), fingerprint)
+
+        # A related object two levels deep
+        self.authors[1].save()
+        changed = self.fingerprint()
+        self.assertNotEqual(changed, fingerprint)
+
+        # A primary object
+        Comment.objects.create(blog=self.blogs[0], text="New", author=self.authors[1])
+        self.assertNotEqual(self.fingerprint(), changed)
+
+    def test_fingerprint_is_stable_with_many_objects(self):
+        for index in range(200):
+            Blog.objects.create(
+                title=f"Blog {index}", content="Content", author=self.authors[0]
+            )
+
+        fingerprint = self.fingerprint(BlogSerializerWithAuthor, Blog.objects.all())
+        self.assertEqual(
+            self.fingerprint(BlogSerializerWithAuthor, Blog.objects.all()),
+            fingerprint,
+        )
+
+    def test_tokens_need_a_shared_cache(self):
+        for settings_value in ({}, {"RELATED_CACHE_ALIAS": "default"}):
+            with self.settings(BETTER_NESTED_SERIALIZER=settings_value):
+                with self.assertRaises(ImproperlyConfigured):
+                    self.fingerprint()
+
+    def test_fingerprint_reads_version_fields(self):
+        fingerprint = self.fingerprint(
+            BlogSerializerWithVersionedAuthor, Blog.objects.all()
+        )
+        Author.objects.filter(pk=self.authors[0].pk).update(age=60)
+        self.assertNotEqual(
+            self.fingerprint(BlogSerializerWithVersionedAuthor, Blog.objects.all()),
+            fingerprint,
+        )
+
+    def test_evaluated_queryset_is_reused(self):
+        serializer = BlogSerializerWithAuthor(instance=Blog.objects.all(), many=True)
+        get_graph_fingerprint(serializer)
+
+        # The authors only
+        with self.assertNumQueries(1):
+            data = serializer.data
+        self.assertEqual(len(data["object"]), 4)
+
+    def test_view_answers_not_modified(self):
+        class CommentListView(GraphETagMixin, generics.ListAPIView):
+            queryset = Comment.objects.all()
+            serializer_class = CommentSerializer
+
+        view = CommentListView.as_view()
+        response = view(APIRequestFactory().get("/comments/"))
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        with mock.patch.object(
+            CommentSerializer, "to_related_representation", autospec=True
+        ) as to_related_representation:
+            response = view(
+                APIRequestFactory().get("/comments/", HTTP_IF_NONE_MATCH=etag)
+            )
+        to_related_representation.assert_not_called()
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        self.authors[0].save()
+        response = view(APIRequestFactory().get("/comments/", HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_pages_and_objects_have_their_own_etags(self):
+        class Pagination(PageNumberPagination):
+            page_size = 2
+
+        class BlogView(GraphETagMixin, generics.GenericAPIView):
+            queryset = Blog.objects.order_by("pk")
+            serializer_class = BlogSerializerWithAuthor
+            pagination_class = Pagination
+
+            def get(self, request, *args, **kwargs):
+                if "pk" in kwargs:
+                    return self.retrieve(request, *args, **kwargs)
+                return self.list(request, *args, **kwargs)
+
+        view = BlogView.as_view()
+        # Page links are absolute
+        with self.settings(ALLOWED_HOSTS=["testserver"]):
+            first = view(APIRequestFactory().get("/blogs/"))
+            second = view(APIRequestFactory().get("/blogs/", {"page": 2}))
+        self.assertEqual(len(first.data["results"]["object"]), 2)
+        self.assertNotEqual(first["ETag"], second["ETag"])
+
+        blog = self.blogs[0]
+        response = view(APIRequestFactory().get("/blogs/"), pk=blog.pk)
+        self.assertEqual(response.data["object"]["id"], blog.pk)
+        response = view(
+            APIRequestFactory().get("/blogs/", HTTP_IF_NONE_MATCH=response["ETag"]),
+            pk=blog.pk,
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+class TestCursorPagination(TestCase):
+
+    def setUp(self):
+        self.publisher = Publisher.objects.create(name="Tech Publications")
+        self.authors = [
+            Author.objects.create(name=f"Author {index}", age=30 + index)
+            for index in range(2)
+        ]
+        for index in range(6):
+            Blog.objects.create(
+                title=f"Blog {index}",
+                content="Content",
+                author=self.authors[index % 2],
+                publisher=self.publisher if index >= 4 else None,
+            )
+
+        class Pagination(BetterCursorPagination):
+            page_size = 2
+            ordering = "id"
+
+        class BlogListView(generics.ListAPIView):
+            queryset = Blog.objects.all()
+            serializer_class = BlogSerializerWithAuthorAndPublisher
+            pagination_class = Pagination
+
+        self.pagination_class = Pagination
+        self.view = BlogListView.as_view()
+
+    def get(self, url="/blogs/"):
+        with self.settings(ALLOWED_HOSTS=["testserver"]):
+            return self.view(APIRequestFactory().get(url))
+
+    def test_pk_sets_round_trip(self):
+        pk_sets = {"test_app_author": set(range(1, 1000)) | {10**12}, "other": {3}}
+        data = encode_pk_sets(pk_sets)
+        self.assertEqual(decode_pk_sets(data), pk_sets)
+        # Dense ranges take about a bit per pk
+        self.assertLess(len(encode_pk_sets({"a": range(10000)})), 200)
+
+        # Only integer pks are carried
+        self.assertEqual(decode_pk_sets(encode_pk_sets({"a": {"x"}})), {})
+        with self.assertRaises(ValueError):
+            decode_pk_sets(b"garbage")
+
+    def test_related_objects_are_sent_once(self):
+        pages = [self.get()]
+        while pages[-1].data["next"]:
+            pages.append(self.get(pages[-1].data["next"]))
+
+        self.assertEqual(
+            [len(page.data["results"]["object"]) for page in pages], [2, 2, 2]
+        )
+        self.assertEqual(
+            [
+                set(page.data["results"]["related_objects"].get("test_app_author", {}))
+                for page in pages
+            ],
+            [{author.id for author in self.authors}, set(), set()],
+        )
+        self.assertEqual(
+            set(pages[2].data["results"]["related_objects"]["test_app_publisher"]),
+            {self.publisher.id},
+        )
+
+        # Later pages do not load the objects already sent
+        with self.assertNumQueries(1):
+            self.get(pages[0].data["next"])
+
+    def test_sent_set_starts_over_past_the_maximum(self):
+        self.pagination_class.max_sent_objects = 1
+        first = self.get()
+        second = self.get(first.data["next"])
+        self.assertEqual(
+            len(second.data["results"]["related_objects"]["test_app_author"]), 2
+        )
+
+    def test_sent_set_starts_over_past_the_maximum_size(self):
+        self.pagination_class.max_sent_size = 8
+        first = self.get()
+        second = self.get(first.data["next"])
+        self.assertEqual(
+            len(second.data["results"]["related_objects"]["test_app_author"]), 2
+        )
+
+    def test_cursor_size_is_capped(self):
+        paginator = BetterCursorPagination()
+        paginator.base_url = "http://testserver/blogs/"
+        paginator.sent_related_objects = {
+            "test_app_author": set(random.Random(0).sample(range(10**7), 2000))
+        }
+
+        self.assertEqual(paginator.encode_sent_related_objects(), "")
+        paginator.sent_related_objects = {"test_app_author": set(range(2000))}
+        self.assertLess(len(paginator.encode_sent_related_objects()), 2048)
+        self.assertNotEqual(paginator.encode_sent_related_objects(), "")
+
+    def test_tampered_cursor_is_rejected(self):
+        next_url = self.get().data["next"]
+        response = self.get(next_url.replace("cursor=", "cursor=x"))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestNormalizedWriter(TestCase):
+
+    def setUp(self):
+        self.publisher = Publisher.objects.create(name="Tech Publications")
+        self.authors = [
+            Author.objects.create(name=f"Author {index}", age=30 + index)
+            for index in range(3)
+        ]
+        for index in range(6):
+            Blog.objects.create(
+                title=f"Blog {index}",
+                content="Content",
+                author=self.authors[index % 3],
+                publisher=self.publisher,
+            )
+
+    def serialize(self):
+        return json.loads(
+            JSONRenderer().render(
+                BlogSerializerWithAuthorAndPublisher(
+                    instance=Blog.objects.order_by("pk"), many=True
+                ).data
+            )
+        )
+
+    def test_payload_round_trip(self):
+        payload = self.serialize()
+        Blog.objects.all().delete()
+        Author.objects.all().delete()
+        Publisher.objects.all().delete()
+
+        writer = BlogSerializerWithAuthorAndPublisher.get_writer(payload)
+        # Existence of the objects of each model, then one insert per model
+        with self.assertNumQueries(3):
+            self.assertTrue(writer.is_valid())
+        with self.assertNumQueries(3 + 2):
+            result = writer.save()
+
+        self.assertEqual(len(result.created["test_app_blog"]), 6)
+        self.assertEqual(len(result.created["test_app_author"]), 3)
+        self.assertEqual(result.updated, {})
+        self.assertEqual(self.serialize(), payload)
+
+    def test_existing_objects_are_updated(self):
+        payload = self.serialize()
+        author_id = str(self.authors[0].id)
+        payload["related_objects"]["test_app_author"][author_id]["name"] = "Renamed"
+        for blog in payload["object"]:
+            blog["title"] = blog["title"].upper()
+        payload["object"].append(
+            {"title": "New", "content": "Content", "author": self.authors[1].id}
+        )
+
+        writer = NormalizedWriter(
+            BlogSerializerWithAuthorAndPublisher, payload, batch_size=100
+        )
+        writer.is_valid(raise_exception=True)
+        # The updates of the 3 models and the insert of the new blog
+        with self.assertNumQueries(4 + 2):
+            result = writer.save()
+
+        self.assertEqual(len(result.updated["test_app_blog"]), 6)
+        self.assertEqual(len(result.created["test_app_blog"]), 1)
+        self.assertEqual(Author.objects.get(pk=author_id).name, "Renamed")
+        self.assertEqual(Blog.objects.filter(title__startswith="BLOG").count(), 6)
+        self.assertEqual(Blog.objects.get(title="New").author, self.authors[1])
+
+    def test_read_only_relations_are_not_written(self):
+        blog = Blog.objects.order_by("pk").first()
+        other_publisher = Publisher.objects.create(name="Other")
+        payload = {
+            "object": {
+                "id": blog.id,
+                "title": "Renamed",
+                "author": self.authors[2].id,
+                "publisher": other_publisher.id,
+            }
+        }
+
+        writer = BlogSerializerWithReadOnlyRelations.get_writer(payload)
+        writer.is_valid(raise_exception=True)
+        writer.save()
+
+        blog.refresh_from_db()
+        self.assertEqual(blog.title, "Renamed")
+        self.assertEqual(blog.author, self.authors[0])
+        self.assertEqual(blog.publisher, self.publisher)
+
+    def test_invalid_payload(self):
+        payload = self.serialize()
+        author_id = str(self.authors[0].id)
+        payload["related_objects"]["test_app_author"][author_id]["age"] = "old"
+        payload["related_objects"]["test_app_unknown"] = {"1": {"id": 1}}
+        payload["object"][0]["publisher"] = 999
+        payload["object"].append({"content": "No title", "author": self.authors[0].id})
+
+        writer = BlogSerializerWithAuthorAndPublisher.get_writer(payload)
+        self.assertFalse(writer.is_valid())
+        self.assertEqual(writer.errors["unknown_models"], ["test_app_unknown"])
+        self.assertIn(
+            "age", writer.errors["objects"]["test_app_author"][self.authors[0].id]
+        )
+        self.assertEqual(
+            writer.errors["missing_references"], {"test_app_publisher": [999]}
+        )
+        self.assertIn("title", writer.errors["new_objects"][0])
+        with self.assertRaises(AssertionError):
+            writer.save()
+        with self.assertRaises(ValidationError):
+            writer.is_valid(raise_exception=True)
+
+    def test_columnar_payload(self):
+        payload = json.loads(
+            JSONRenderer().render(
+                ColumnarBlogSerializer(instance=Blog.objects.all(), many=True).data
+            )
+        )
+        Blog.objects.all().delete()
+        Author.objects.all().delete()
+
+        writer = ColumnarBlogSerializer.get_writer(payload)
+        writer.is_valid(raise_exception=True)
+        writer.save()
+        self.assertEqual(Author.objects.count(), 3)
+        self.assertEqual(Blog.objects.count(), 6)
+
+
+class TestQueryPlan(TestCase):
+
+    def setUp(self):
+        for index in range(3):
+            author = Author.objects.create(name=f"Author {index}", age=30 + index)
+            for blog_index in range(2):
+                Blog.objects.create(
+                    title=f"Blog {index}.{blog_index}",
+                    content="Content",
+                    author=author,
+                    publisher=Publisher.objects.create(name=f"Publisher {index}"),
+                )
+
+    def test_query_plan_is_derived_from_serializer_tree(self):
+        plan = AuthorWithAllBlogsSerializer.get_query_plan()
+
+        self.assertEqual(plan.select_related, ())
+        self.assertEqual(
+            [prefetch.prefetch_to for prefetch in plan.prefetch_related],
+            ["blog_set"],
+        )
+        self.assertEqual(
+            plan.prefetch_related[0].queryset.query.select_related,
+            {"publisher": {}},
+        )
+
+        plan = BlogSerializerWithAuthorAndPublisher.get_query_plan()
+        self.assertEqual(set(plan.select_related), {"author", "publisher"})
+        self.assertEqual(plan.prefetch_related, ())
+
+    def test_query_plan_is_cached_per_class(self):
+        self.assertIs(
+            AuthorWithAllBlogsSerializer.get_query_plan(),
+            AuthorWithAllBlogsSerializer.get_query_plan(),
+        )
+        self.assertIsNot(
+            AuthorWithAllBlogsSerializer.get_query_plan(),
+            BlogSerializerWithAuthorAndPublisher.get_query_plan(),
+        )
+
+    def test_optimized_queryset_avoids_per_row_queries(self):
+        expected = normalize_serializer_payload(
+            AuthorWithAllBlogsSerializer(instance=Author.objects.all(), many=True).data
+        )
+
+        queryset = AuthorWithAllBlogsSerializer.optimize_queryset(Author.objects.all())
+        with self.assertNumQueries(2):
+            data = normalize_serializer_payload(
+                AuthorWithAllBlogsSerializer(instance=queryset, many=True).data
+            )
+
+        self.assertEqual(DeepDiff(data, expected, ignore_order=True), {})
+
+    def test_list_serializer_applies_plan_when_opted_in(self):
+        with self.assertNumQueries(2):
+            AuthorWithAllBlogsAutoOptimizedSerializer(
+                instance=Author.objects.all(), many=True
+            ).data
+
+    def test_existing_prefetch_is_kept(self):
+        queryset = AuthorWithAllBlogsSerializer.optimize_queryset(
+            Author.objects.prefetch_related("blog_set")
+        )
+        with self.assertNumQueries(2):
+            list(queryset)
+
+    def test_reverse_relations_are_loaded_in_bulk(self):
+        expected = normalize_serializer_payload(
+            AuthorWithAllBlogsSerializer(
+                instance=AuthorWithAllBlogsSerializer.optimize_queryset(
+                    Author.objects.all()
+                ),
+                many=True,
+            ).data
+        )
+
+        # The authors, their blogs in one `author_id IN (...)` query, then
+        # the publishers; not one blog query per author
+        with self.assertNumQueries(3):
+            data = normalize_serializer_payload(
+                AuthorWithAllBlogsSerializer(instance=Author.objects.all(), many=True).data
+            )
+        self.assertEqual(DeepDiff(data, expected, ignore_order=True), {})
+
+        # A single object too
+        with self.assertNumQueries(3):
+            AuthorWithAllBlogsSerializer(instance=Author.objects.first()).data
+
+    def test_prefetched_reverse_relations_are_reused(self):
+        authors = list(Author.objects.prefetch_related("blog_set"))
+        with self.assertNumQueries(1):
+            data = AuthorWithAllBlogsSerializer(instance=authors, many=True).data
+        self.assertEqual(len(data["related_objects"]["test_app_blog"]), 6)
+
+
+
+class TestRepresentationPlan(TestCase):
+
+    def test_plan_describes_fields(self):
+        serializer = BlogSerializerWithAuthorAndPublisher()
+        plans = {
+            field_plan.field_name: field_plan
+            for _, field_plan in serializer._get_compiled_fields()
+        }
+
+        self.assertEqual(plans["title"].kind, FieldKind.PRIMITIVE)
+        self.assertEqual(plans["author"].kind, FieldKind.NESTED)
+        self.assertEqual(plans["author"].model_key, "test_app_author")
+        self.assertIs(plans["author"].nested_data.serializer_class, AuthorSerializer)
+        self.assertEqual(plans["publisher"].model_key, "test_app_publisher")
+
+        plans = {
+            field_plan.field_name: field_plan
+            for _, field_plan in AuthorWithAllBlogsSerializer()._get_compiled_fields()
+        }
+        self.assertEqual(plans["blogs"].kind, FieldKind.NESTED_MANY)
+        self.assertEqual(plans["blogs"].model_key, "test_app_blog")
+
+    def test_plan_is_shared_between_instances(self):
+        first = [
+            field_plan
+            for _, field_plan in BlogSerializerWithAuthorAndPublisher()._get_compiled_fields()
+        ]
+        second = [
+            field_plan
+            for _, field_plan in BlogSerializerWithAuthorAndPublisher()._get_compiled_fields()
+        ]
+        self.assertEqual(len(first), len(second))
+        for first_plan, second_plan in zip(first, second):
+            self.assertIs(first_plan, second_plan)
+
+    def test_field_selections_do_not_grow_the_caches(self):
+        field_names = ["id", "title", "content", "author", "publisher"]
+        BlogSerializerWithAuthorAndPublisher()._get_compiled_fields()
+        get_values_plan(AuthorSerializer(many=True))
+        plan_count = len(field_plan._field_plans)
+        values_count = len(values._compiled_fields)
+
+        for size in range(1, len(field_names) + 1):
+            for _ in range(10):
+                selected = frozenset(random.sample(field_names, size))
+                serializer = BlogSerializerWithAuthorAndPublisher()
+                select_fields(serializer, selected)
+                serializer._get_compiled_fields()
+                list_serializer = AuthorSerializer(many=True)
+                select_fields(list_serializer.child, selected | {"name"})
+                get_values_plan(list_serializer)
+
+        self.assertEqual(len(field_plan._field_plans), plan_count)
+        self.assertEqual(len(values._compiled_fields), values_count)
+
 
 if __name__ == "__main__":
 